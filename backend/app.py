@@ -1,107 +1,101 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, g, request, jsonify
 from flask_cors import CORS
+from werkzeug.datastructures import ImmutableMultiDict, MultiDict
 import os
+import json
+import time
 
-# Try to import the Hugging Face version first, fall back to local version
-LeafDiseaseChecker = None
-USE_HUGGINGFACE = True
-
-try:
-    from run_hf import LeafDiseaseChecker
-    print("Hugging Face version available")
-except ImportError as e:
-    print(f"Hugging Face version not available: {e}")
-    try:
-        from run import LeafDiseaseChecker
-        USE_HUGGINGFACE = False
-        print("Using local version of LeafDiseaseChecker")
-    except ImportError as e2:
-        print(f"Both versions failed to import: {e2}")
-        print("Flask will start without model - check logs for import errors")
+# Configuration, model state and the logic behind every route - shared with asgi.py
+import service
+from service import ApiError
+from upload_guard import UploadRejected
+from metrics import registry, span, start_request, end_request, server_timing
+
+class ArrivalOrderMultiDict(ImmutableMultiDict):
+    """ImmutableMultiDict that also keeps its (key, value) pairs in the order they arrived"""
+    def __init__(self, mapping=None):
+        if isinstance(mapping, dict):
+            pairs = list(MultiDict(mapping).items(multi=True))
+        else:
+            pairs = list(mapping or ())
+        super().__init__(pairs)
+        self.arrival_order = pairs
+
+class UploadRequest(Request):
+    # MultiDict groups values by key, which loses the order of 'files' and 'file' parts
+    parameter_storage_class = ArrivalOrderMultiDict
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 # CORS configuration - allow all origins for now
 CORS(app)
 
+@app.before_request
+def start_timing():
+    g.request_start = time.perf_counter()
+    g.metrics_token = start_request()
+
+@app.after_request
+def record_timing(response):
+    """Count the request and attach its per-stage timings as a Server-Timing header"""
+    if 'metrics_token' not in g:
+        return response
+    total = time.perf_counter() - g.request_start
+    spans = end_request(g.pop('metrics_token'))
+    # Label by route pattern, not raw path, so /jobs/<id> stays one series
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    registry.inc(
+        'leaf_http_requests_total', 'HTTP requests by route, method and status',
+        endpoint=endpoint, method=request.method, status=response.status_code
+    )
+    if response.status_code >= 400:
+        registry.inc(
+            'leaf_http_request_errors_total', 'HTTP requests answered with a 4xx or 5xx status',
+            endpoint=endpoint, status=response.status_code
+        )
+    registry.observe(
+        'leaf_http_request_duration_seconds', total,
+        'Time from request start to response headers, by route', endpoint=endpoint
+    )
+    response.headers['Server-Timing'] = server_timing(spans, total)
+    return response
+
 print("Flask app created successfully")
 print(f"Flask app name: {app.name}")
 print("CORS enabled")
 
-# Configuration for Hugging Face model (ONLY)
-HF_REPO_ID = os.environ.get('HF_REPO_ID', 'rishabh914/leaf-disease-detection')
-
-print(f"Using ONLY Hugging Face model: {HF_REPO_ID}")
-print(f"Current directory: {os.getcwd()}")
-print("Local files will be ignored")
-
-# Initialize checker as None - will be loaded asynchronously
-checker = None
-model_loading = False
-model_error = None
-
-def load_model_async():
-    """Load model asynchronously to avoid blocking Flask startup"""
-    global checker, model_loading, model_error
-    
-    if checker is not None or model_loading:
-        return
-    
-    if LeafDiseaseChecker is None:
-        model_error = "LeafDiseaseChecker class not available - import failed"
-        print(f"Cannot load model: {model_error}")
-        return
-        
-    model_loading = True
-    try:
-        print(f"Loading model from Hugging Face: {HF_REPO_ID}")
-        checker = LeafDiseaseChecker(
-            use_huggingface=True,
-            repo_id=HF_REPO_ID
-        )
-        print("Hugging Face model loaded successfully")
-        model_error = None
-    except Exception as e:
-        print(f"Failed to load Hugging Face model: {e}")
-        print("Make sure you have internet connection and the repo ID is correct")
-        model_error = str(e)
-        checker = None
-    finally:
-        model_loading = False
-
-FRONTEND_JSON_PATH = 'predictions.json'
+@app.errorhandler(ApiError)
+def api_error(e):
+    return jsonify(e.body()), e.status, e.headers
+
+UPLOAD_LIMITS = {
+    'predict': service.MAX_UPLOAD_BYTES,
+    'similar': service.MAX_UPLOAD_BYTES,
+    'add_similar_case': service.MAX_UPLOAD_BYTES,
+    'predict_batch': service.BATCH_MAX_UPLOAD_BYTES,
+    'submit_job': service.BATCH_MAX_UPLOAD_BYTES
+}
+# Werkzeug stops reading a body past this, which also covers chunked uploads
+app.config['MAX_CONTENT_LENGTH'] = max(UPLOAD_LIMITS.values())
+
+@app.before_request
+def check_upload_headers():
+    """Refuse oversized or non-multipart uploads from the headers, before the body is read"""
+    limit = UPLOAD_LIMITS.get(request.endpoint)
+    if limit is not None and request.method == 'POST':
+        service.check_upload_headers(request.content_length, request.mimetype, limit)
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    # Raised by Werkzeug when a body without Content-Length runs past MAX_CONTENT_LENGTH
+    return api_error(service.rejected(UploadRejected('too_large', 'Upload is too large', 413)))
 
 @app.route('/')
 def health_check():
     # Start model loading if not already started
-    if checker is None and not model_loading:
-        import threading
-        threading.Thread(target=load_model_async, daemon=True).start()
-    
-    if model_loading:
-        return jsonify({
-            'status': 'loading',
-            'message': 'Leaf Disease Detection API is loading model...',
-            'model_source': 'Hugging Face',
-            'hf_repo': HF_REPO_ID,
-            'version': '2.0'
-        }), 200
-    
-    if checker is None:
-        return jsonify({
-            'status': 'error',
-            'message': f'Model loading failed: {model_error}',
-            'model_source': 'Hugging Face',
-            'hf_repo': HF_REPO_ID,
-            'version': '2.0'
-        }), 200  # Still return 200 for Railway health check
-    
-    return jsonify({
-        'status': 'healthy',
-        'message': 'Leaf Disease Detection API is running',
-        'model_source': 'Hugging Face',
-        'hf_repo': HF_REPO_ID,
-        'version': '2.0'
-    })
+    service.ensure_model_loading()
+    # Always 200 for Railway's health check, even while loading or after a failed load
+    return jsonify(service.health())
 
 @app.route('/health')  # Railway checks this
 def health():
@@ -116,81 +110,153 @@ def test():
     print("Test endpoint called")
     return jsonify({'message': 'Flask is running', 'status': 'ok'})
 
+def read_image_upload():
+    """The single 'file' upload and its checked bytes, as (file, data)"""
+    with span('upload'):
+        file = request.files.get('file')
+    if file is None:
+        raise ApiError('No file provided')
+    if file.filename == '':
+        raise ApiError('No file selected')
+    return file, service.read_upload(file.stream)
+
+def read_uploads(max_files):
+    """(filename, bytes) for every image in the 'files'/'file' parts, archives unpacked"""
+    with span('upload'):
+        # In the order the parts arrived, so results line up with the client's files
+        uploads = [f for name, f in request.files.arrival_order if name in ('files', 'file') and f.filename]
+    if not uploads:
+        raise ApiError('No files provided')
+    return service.read_archive_uploads([(f.filename, f.read()) for f in uploads], max_files)
+
 @app.route('/predict', methods=['POST'])
 def predict():
-    if model_loading:
-        return jsonify({
-            'error': 'Model is still loading, please try again in a few moments'
-        }), 503
-        
-    if checker is None:
-        return jsonify({
-            'error': f'Model not loaded - {model_error or "check Hugging Face connection"}'
-        }), 500
-    
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file provided'}), 400
-    
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
-    
-    try:
-        # Save uploaded file temporarily
-        upload_path = os.path.join('uploads', file.filename)
-        os.makedirs('uploads', exist_ok=True)
-        file.save(upload_path)
-        
-        # Make prediction
-        result = checker.predict(upload_path)
-        
-        # Save to JSON file
-        import json
-        with open(FRONTEND_JSON_PATH, 'w') as f:
-            json.dump(result, f, indent=2)
-        
-        # Clean up uploaded file
-        os.remove(upload_path)
-        
-        return jsonify({
-            'success': True,
-            'prediction': result,
-            'model_source': 'Hugging Face',
-            'hf_repo': HF_REPO_ID
-        })
-        
-    except Exception as e:
-        print(f"Prediction error: {e}")
-        # Clean up uploaded file if it exists
-        if os.path.exists(upload_path):
-            os.remove(upload_path)
-        return jsonify({
-            'error': f'Prediction failed: {str(e)}'
-        }), 500
+    service.require_model()
+    options = service.predict_options(request.args)
+    file, data = read_image_upload()
+    return jsonify(service.predict_image(data, file.filename, **options))
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    """Classify many images (or zip/tar archives of images) posted in one request"""
+    service.require_model()
+    mode, k = service.response_options(request.args)
+    items = read_uploads(service.BATCH_UPLOAD_MAX_FILES)
+    return jsonify(service.predict_batch(items, mode, k))
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue images or archives for background classification and return a job ID at once"""
+    mode, k = service.response_options(request.args)
+    items = read_uploads(service.JOB_MAX_FILES)
+    return jsonify(service.submit_job(items, mode, k)), 202
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    """Job status plus finished results, paginated with ?offset=&limit="""
+    summary, status = service.get_job(job_id, request.args)
+    return jsonify(summary), status
+
+@app.route('/jobs/<job_id>/stream')
+def stream_job(job_id):
+    """Stream results as newline-delimited JSON while the job runs, then a final summary line"""
+    service.require_job(job_id)
+
+    def generate():
+        offset, finished = 0, False
+        while not finished:
+            lines, new_offset, finished = service.job_stream_step(job_id, offset)
+            for line in lines:
+                yield json.dumps(line) + '\n'
+            if not lines:
+                time.sleep(0.5)
+            offset = new_offset
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/metrics')
+def metrics():
+    """Counters, gauges and latency histograms in Prometheus text format (per process)"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/classes')
+def get_classes():
+    """Class names in model output order, for decoding array/float16 responses"""
+    return jsonify(service.get_classes())
 
 @app.route('/predictions')
 def get_predictions():
-    """Get the latest predictions from JSON file"""
-    try:
-        if os.path.exists(FRONTEND_JSON_PATH):
-            import json
-            with open(FRONTEND_JSON_PATH, 'r') as f:
-                predictions = json.load(f)
-            return jsonify({
-                'success': True,
-                'predictions': predictions,
-                'model_source': 'Hugging Face',
-                'hf_repo': HF_REPO_ID
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'message': 'No predictions available yet'
-            })
-    except Exception as e:
-        return jsonify({
-            'error': f'Failed to load predictions: {str(e)}'
-        }), 500
+    """
+    Prediction history, newest first
+
+    Filters: ?class=&since=&until=&min_confidence=&max_confidence=
+    Pagination: ?limit= (max 500) and ?before=<next_before from the previous page>
+    """
+    return jsonify(service.list_predictions(request.args))
+
+@app.route('/predictions/<request_id>')
+def get_prediction(request_id):
+    """Look up one recorded prediction by the request_id returned from /predict"""
+    return jsonify(service.get_prediction(request_id))
+
+@app.route('/similar', methods=['POST'])
+def similar():
+    """Diagnose an image and return the closest confirmed cases in the index"""
+    service.require_model()
+    k, label = service.similar_options(request.args)
+    _, data = read_image_upload()
+    return jsonify(service.find_similar(data, k, label))
+
+@app.route('/similar/cases', methods=['POST'])
+def add_similar_case():
+    """Add a confirmed case: an image plus the class an agronomist confirmed for it"""
+    service.require_model()
+    file, data = read_image_upload()
+    result = service.add_similar_case(data, file.filename, request.form.get('label', ''), request.form.get('case_id'))
+    return jsonify(result), 201
+
+def admin_options():
+    """Check the admin bearer token; the JSON object body of the request, {} when missing"""
+    service.require_admin(request.headers.get('Authorization'))
+    return request.get_json(silent=True) or {}
+
+@app.route('/models')
+def get_models():
+    """Active and candidate model versions with their traffic share and latency"""
+    service.require_admin(request.headers.get('Authorization'))
+    return jsonify(service.get_models())
+
+@app.route('/models/candidate', methods=['POST'])
+def add_candidate():
+    """
+    Load another model version next to the active one without downtime
+
+    JSON body: filename, revision, sha256 and backend select the artifact;
+    mode is 'shadow' or 'split' (with percent of requests), or 'promote' to
+    swap it in as soon as it is warm.
+    """
+    return jsonify(service.add_candidate(admin_options())), 202
+
+@app.route('/models/candidate', methods=['DELETE'])
+def discard_candidate():
+    """Stop sending traffic to the candidate and unload it"""
+    service.require_admin(request.headers.get('Authorization'))
+    return jsonify(service.discard_candidate())
+
+@app.route('/models/traffic', methods=['POST'])
+def set_traffic():
+    """Change how the candidate is evaluated: {"mode": "shadow"|"split", "percent": 0-100}"""
+    return jsonify(service.set_traffic(admin_options()))
+
+@app.route('/models/promote', methods=['POST'])
+def promote_candidate():
+    """Swap the candidate in; requests in flight finish on the old version, which is then unloaded"""
+    service.require_admin(request.headers.get('Authorization'))
+    return jsonify(service.promote_candidate())
+
+# Start loading the model at worker boot rather than on the first request
+if service.MODEL_EAGER_LOAD:
+    service.ensure_model_loading()
 
 if __name__ == '__main__':
     # Get port from environment variable or default to 5000
@@ -199,5 +265,6 @@ if __name__ == '__main__':
     app.run(host='0.0.0.0', port=port, debug=False)
 
 # This code runs when imported by Gunicorn
-print("Flask app module loaded successfully")
+service.startup_metrics['app_import_seconds'] = round(time.perf_counter() - service.PROCESS_START, 3)
+print(f"Flask app module loaded successfully in {service.startup_metrics['app_import_seconds']}s")
 print(f"App routes: {[rule.rule for rule in app.url_map.iter_rules()]}")
@@ -1,6 +1,10 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import os
+import uuid
+import threading
+
+from prediction_store import PredictionStore, query_options
 
 # Try to import the Hugging Face version first, fall back to local version
 try:
@@ -37,7 +41,17 @@ except Exception as e:
     print("Make sure you have internet connection and the repo ID is correct")
     checker = None
 
-FRONTEND_JSON_PATH = 'predictions.json'
+# Prediction history - appended in the background, queried through /predictions.
+# Opened on first use, so importing this module creates no files or threads
+prediction_history = None
+_history_lock = threading.Lock()
+
+def get_prediction_history():
+    global prediction_history
+    with _history_lock:
+        if prediction_history is None:
+            prediction_history = PredictionStore(os.environ.get('PREDICTIONS_DB', 'predictions.sqlite3'))
+        return prediction_history
 
 @app.route('/')
 def health_check():
@@ -83,16 +97,15 @@ def predict():
         # Make prediction
         result = checker.predict(upload_path)
         
-        # Save to JSON file
-        import json
-        with open(FRONTEND_JSON_PATH, 'w') as f:
-            json.dump(result, f, indent=2)
+        request_id = uuid.uuid4().hex
+        get_prediction_history().add(request_id, result, filename=file.filename)
         
         # Clean up uploaded file
         os.remove(upload_path)
         
         return jsonify({
             'success': True,
+            'request_id': request_id,
             'prediction': result,
             'model_source': 'Hugging Face',
             'hf_repo': HF_REPO_ID
@@ -109,28 +122,40 @@ def predict():
 
 @app.route('/predictions')
 def get_predictions():
-    """Get the latest predictions from JSON file"""
+    """
+    Prediction history, newest first - same parameters as app.py
+
+    Filters: ?class=&since=&until=&min_confidence=&max_confidence=
+    Pagination: ?limit= (max 500) and ?before=<next_before from the previous page>
+    """
+    try:
+        filters, limit = query_options(request.args)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid filter: {str(e)}'}), 400
     try:
-        if os.path.exists(FRONTEND_JSON_PATH):
-            import json
-            with open(FRONTEND_JSON_PATH, 'r') as f:
-                predictions = json.load(f)
-            return jsonify({
-                'success': True,
-                'predictions': predictions,
-                'model_source': 'Hugging Face',
-                'hf_repo': HF_REPO_ID
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'message': 'No predictions available yet'
-            })
+        predictions = get_prediction_history().query(limit=limit, **filters)
+        response = {
+            'success': True,
+            'count': len(predictions),
+            'predictions': predictions,
+            'model_source': 'Hugging Face',
+            'hf_repo': HF_REPO_ID
+        }
+        if len(predictions) == limit:
+            response['next_before'] = predictions[-1]['id']
+        return jsonify(response)
     except Exception as e:
         return jsonify({
             'error': f'Failed to load predictions: {str(e)}'
         }), 500
 
+@app.route('/predictions/<request_id>')
+def get_prediction(request_id):
+    prediction = get_prediction_history().get(request_id)
+    if prediction is None:
+        return jsonify({'error': 'Prediction not found'}), 404
+    return jsonify({'success': True, 'prediction': prediction})
+
 if __name__ == '__main__':
     # Get port from environment variable or default to 5000
     port = int(os.environ.get('PORT', 5000))
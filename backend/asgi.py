@@ -0,0 +1,361 @@
+"""
+ASGI entry point with the same routes and JSON responses as app.py
+
+Uploads are received and parsed asynchronously, so slow clients don't hold a
+worker thread while their body trickles in. Everything that blocks - upload
+checks, cache and SQLite reads, decoding and inference - runs in a thread
+pool, never on the event loop: classification and similar-case embeddings
+on a dedicated inference executor, model loading on its own.
+
+Configuration, model state and the logic behind every route are the ones in
+service.py that app.py also uses; only the HTTP layer differs.
+
+Usage:
+    pip install -r requirements-asgi.txt
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+
+import os
+import json
+import time
+import asyncio
+import functools
+import contextvars
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import service
+from service import ApiError
+from upload_guard import UploadRejected
+from metrics import registry, span, start_request, request_spans, server_timing
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, UploadFile
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+# Classification and similar-case embeddings run here, off the event loop. Single
+# images mostly wait on the micro-batcher, so by default enough of them can wait
+# at once to fill a batch; the checker itself still caps concurrent forward passes.
+INFERENCE_WORKERS = int(os.environ.get(
+    'ASGI_INFERENCE_WORKERS', max(service.RUNTIME_CONFIG['max_inflight'], service.BATCH_MAX_SIZE)
+))
+inference_pool = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix='inference')
+model_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='model-load')
+
+UPLOAD_LIMITS = {
+    '/predict': service.MAX_UPLOAD_BYTES,
+    '/similar': service.MAX_UPLOAD_BYTES,
+    '/similar/cases': service.MAX_UPLOAD_BYTES,
+    '/predict/batch': service.BATCH_MAX_UPLOAD_BYTES,
+    '/jobs': service.BATCH_MAX_UPLOAD_BYTES
+}
+
+
+def run_in(executor, fn, *args, **kwargs):
+    """Run a blocking call on an executor, keeping the request's timing spans"""
+    ctx = contextvars.copy_context()
+    return asyncio.get_running_loop().run_in_executor(executor, functools.partial(ctx.run, fn, *args, **kwargs))
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def error_response(e):
+    return JSONResponse(e.body(), status_code=e.status, headers=e.headers)
+
+
+async def api_error(request, e):
+    return error_response(e)
+
+
+class GuardMiddleware:
+    def __init__(self, app):
+        """
+        Per-request timing, counters and upload limits (the before/after_request hooks of app.py)
+
+        Upload bodies are counted as they stream in and cut off at the route's
+        limit, whether or not the client sent Content-Length.
+        """
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        # No reset needed: this context ends with the request's task. Responses may be
+        # started from another task (StreamingResponse), so hold the dict itself.
+        start_request()
+        spans = request_spans()
+        status = {}
+
+        async def send_with_timing(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+                total = time.perf_counter() - start
+                route = scope.get('route')
+                endpoint = route.path if route is not None else 'unmatched'
+                registry.inc(
+                    'leaf_http_requests_total', 'HTTP requests by route, method and status',
+                    endpoint=endpoint, method=scope['method'], status=message['status']
+                )
+                if message['status'] >= 400:
+                    registry.inc(
+                        'leaf_http_request_errors_total', 'HTTP requests answered with a 4xx or 5xx status',
+                        endpoint=endpoint, status=message['status']
+                    )
+                registry.observe(
+                    'leaf_http_request_duration_seconds', total,
+                    'Time from request start to response headers, by route', endpoint=endpoint
+                )
+                message['headers'] = list(message.get('headers', [])) + [
+                    (b'server-timing', server_timing(spans, total).encode('latin-1'))
+                ]
+            await send(message)
+
+        limit = UPLOAD_LIMITS.get(scope['path']) if scope['method'] == 'POST' else None
+        if limit is None:
+            await self.app(scope, receive, send_with_timing)
+            return
+
+        headers = Headers(scope=scope)
+        length = headers.get('content-length')
+        try:
+            service.check_upload_headers(
+                int(length) if length is not None and length.isdigit() else None,
+                headers.get('content-type'), limit
+            )
+        except ApiError as e:
+            await error_response(e)(scope, receive, send_with_timing)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > limit:
+                    raise UploadTooLarge()
+            return message
+
+        try:
+            await self.app(scope, limited_receive, send_with_timing)
+        except UploadTooLarge:
+            if 'code' not in status:
+                rejection = service.rejected(UploadRejected('too_large', 'Upload is too large', 413))
+                await error_response(rejection)(scope, receive, send_with_timing)
+
+
+async def read_image_upload(request):
+    """The form, the single 'file' upload and its checked bytes, as (form, upload, data)"""
+    with span('upload'):
+        form = await request.form(max_files=1)
+    upload = form.get('file')
+    if not isinstance(upload, UploadFile):
+        raise ApiError('No file provided')
+    if upload.filename == '':
+        raise ApiError('No file selected')
+    return form, upload, await run_in_threadpool(service.read_upload, upload.file)
+
+
+async def read_uploads(request, max_files):
+    """(filename, bytes) for every image in the 'files'/'file' parts, archives unpacked"""
+    with span('upload'):
+        form = await request.form(max_files=max_files + 1)
+        # In the order the parts arrived, so results line up with the client's files
+        uploads = [
+            f for name, f in form.multi_items()
+            if name in ('files', 'file') and isinstance(f, UploadFile) and f.filename
+        ]
+        uploads = [(f.filename, await f.read()) for f in uploads]
+    if not uploads:
+        raise ApiError('No files provided')
+    return await run_in_threadpool(service.read_archive_uploads, uploads, max_files)
+
+
+async def health_check(request):
+    service.ensure_model_loading(model_pool.submit)
+    # Always 200, even while loading or after a failed load
+    return JSONResponse(await run_in_threadpool(service.health))
+
+
+async def test(request):
+    return JSONResponse({'message': 'ASGI app is running', 'status': 'ok'})
+
+
+async def predict(request):
+    service.require_model()
+    options = service.predict_options(request.query_params)
+    _, upload, data = await read_image_upload(request)
+    # On the inference executor, so waiting on the micro-batcher never takes a default-pool token
+    return JSONResponse(await run_in(inference_pool, service.predict_image, data, upload.filename, **options))
+
+
+async def predict_batch(request):
+    """Classify many images (or zip/tar archives of images) posted in one request"""
+    service.require_model()
+    mode, k = service.response_options(request.query_params)
+    items = await read_uploads(request, service.BATCH_UPLOAD_MAX_FILES)
+    return JSONResponse(await run_in(inference_pool, service.predict_batch, items, mode, k))
+
+
+async def submit_job(request):
+    """Queue images or archives for background classification and return a job ID at once"""
+    mode, k = service.response_options(request.query_params)
+    items = await read_uploads(request, service.JOB_MAX_FILES)
+    return JSONResponse(await run_in_threadpool(service.submit_job, items, mode, k), status_code=202)
+
+
+async def get_job(request):
+    """Job status plus finished results, paginated with ?offset=&limit="""
+    summary, status = await run_in_threadpool(service.get_job, request.path_params['job_id'], request.query_params)
+    return JSONResponse(summary, status_code=status)
+
+
+async def stream_job(request):
+    """Stream results as newline-delimited JSON while the job runs, then a final summary line"""
+    job_id = request.path_params['job_id']
+    await run_in_threadpool(service.require_job, job_id)
+
+    async def generate():
+        offset, finished = 0, False
+        while not finished:
+            lines, new_offset, finished = await run_in_threadpool(service.job_stream_step, job_id, offset)
+            for line in lines:
+                yield json.dumps(line) + '\n'
+            if not lines:
+                await asyncio.sleep(0.5)
+            offset = new_offset
+
+    return StreamingResponse(generate(), media_type='application/x-ndjson')
+
+
+async def metrics(request):
+    """Counters, gauges and latency histograms in Prometheus text format (per process)"""
+    return Response(registry.render(), media_type='text/plain; version=0.0.4')
+
+
+async def get_classes(request):
+    """Class names in model output order, for decoding array/float16 responses"""
+    return JSONResponse(service.get_classes())
+
+
+async def get_predictions(request):
+    """Prediction history, newest first - same filters and paging as app.py"""
+    return JSONResponse(await run_in_threadpool(service.list_predictions, request.query_params))
+
+
+async def get_prediction(request):
+    """Look up one recorded prediction by the request_id returned from /predict"""
+    return JSONResponse(await run_in_threadpool(service.get_prediction, request.path_params['request_id']))
+
+
+async def similar(request):
+    """Diagnose an image and return the closest confirmed cases in the index"""
+    service.require_model()
+    k, label = service.similar_options(request.query_params)
+    _, _, data = await read_image_upload(request)
+    return JSONResponse(await run_in(inference_pool, service.find_similar, data, k, label))
+
+
+async def add_similar_case(request):
+    """Add a confirmed case: an image plus the class an agronomist confirmed for it"""
+    service.require_model()
+    form, upload, data = await read_image_upload(request)
+    result = await run_in(
+        inference_pool, service.add_similar_case, data, upload.filename, form.get('label', ''), form.get('case_id')
+    )
+    return JSONResponse(result, status_code=201)
+
+
+async def admin_options(request):
+    """Check the admin bearer token; the JSON object body of the request, {} when missing or malformed"""
+    service.require_admin(request.headers.get('authorization'))
+    try:
+        options = await request.json()
+    except ValueError:
+        return {}
+    return options if isinstance(options, dict) else {}
+
+
+async def get_models(request):
+    """Active and candidate model versions with their traffic share and latency"""
+    service.require_admin(request.headers.get('authorization'))
+    return JSONResponse(service.get_models())
+
+
+async def add_candidate(request):
+    """Load another model version next to the active one without downtime"""
+    options = await admin_options(request)
+    return JSONResponse(service.add_candidate(options, model_pool.submit), status_code=202)
+
+
+async def discard_candidate(request):
+    """Stop sending traffic to the candidate and unload it"""
+    service.require_admin(request.headers.get('authorization'))
+    return JSONResponse(service.discard_candidate())
+
+
+async def set_traffic(request):
+    """Change how the candidate is evaluated: {"mode": "shadow"|"split", "percent": 0-100}"""
+    return JSONResponse(service.set_traffic(await admin_options(request)))
+
+
+async def promote_candidate(request):
+    """Swap the candidate in; requests in flight finish on the old version, which is then unloaded"""
+    service.require_admin(request.headers.get('authorization'))
+    return JSONResponse(service.promote_candidate())
+
+
+@asynccontextmanager
+async def lifespan(app):
+    if service.MODEL_EAGER_LOAD:
+        service.ensure_model_loading(model_pool.submit)
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route('/', health_check),
+        Route('/health', health_check),
+        Route('/test', test),
+        Route('/predict', predict, methods=['POST']),
+        Route('/predict/batch', predict_batch, methods=['POST']),
+        Route('/jobs', submit_job, methods=['POST']),
+        Route('/jobs/{job_id}', get_job),
+        Route('/jobs/{job_id}/stream', stream_job),
+        Route('/metrics', metrics),
+        Route('/classes', get_classes),
+        Route('/predictions', get_predictions),
+        Route('/predictions/{request_id}', get_prediction),
+        Route('/similar', similar, methods=['POST']),
+        Route('/similar/cases', add_similar_case, methods=['POST']),
+        Route('/models', get_models),
+        Route('/models/candidate', add_candidate, methods=['POST']),
+        Route('/models/candidate', discard_candidate, methods=['DELETE']),
+        Route('/models/traffic', set_traffic, methods=['POST']),
+        Route('/models/promote', promote_candidate, methods=['POST'])
+    ],
+    middleware=[
+        # CORS configuration - allow all origins, as app.py does
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*']),
+        Middleware(GuardMiddleware)
+    ],
+    exception_handlers={ApiError: api_error},
+    lifespan=lifespan
+)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    port = int(os.environ.get('PORT', 5000))
+    print(f"Starting ASGI app on port {port}")
+    uvicorn.run(app, host='0.0.0.0', port=port)
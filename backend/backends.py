@@ -0,0 +1,124 @@
+import os
+import threading
+
+import numpy as np
+
+# Model file names on the Hugging Face repo for each backend
+MODEL_FILENAMES = {
+    'keras': 'final_model.h5',
+    'onnx': 'final_model.onnx',
+    'tflite': 'final_model.tflite'
+}
+
+
+class KerasBackend:
+    name = 'keras'
+
+    def __init__(self, model_path, num_threads=None):
+        # Imported here so the lighter backends never pull in TensorFlow
+        import tensorflow as tf
+        from tensorflow.keras.models import load_model
+        if num_threads:
+            try:
+                tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+            except RuntimeError:
+                # TensorFlow already ran an op; its pools are fixed (see runtime_config.py)
+                pass
+        self.model = load_model(model_path)
+        self.num_classes = self.model.output_shape[-1]
+        self._embedding_model = None
+
+    def predict(self, batch):
+        return self.model.predict(batch, verbose=0)
+
+    def predict_with_embeddings(self, batch):
+        """(probabilities, penultimate-layer embeddings) from one forward pass"""
+        if self._embedding_model is None:
+            from tensorflow.keras import Input, Model, Sequential
+            # The classifier's input is the feature vector from the layer before it
+            if isinstance(self.model, Sequential):
+                inputs = x = Input(self.model.input_shape[1:])
+                for layer in self.model.layers[:-1]:
+                    x = layer(x)
+                self._embedding_model = Model(inputs, [self.model.layers[-1](x), x])
+            else:
+                self._embedding_model = Model(self.model.inputs, [self.model.output, self.model.layers[-1].input])
+        probs, embeddings = self._embedding_model.predict(batch, verbose=0)
+        return probs, embeddings
+
+
+class OnnxBackend:
+    name = 'onnx'
+
+    def __init__(self, model_path, num_threads=None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.num_classes = self.session.get_outputs()[0].shape[-1]
+
+    def predict(self, batch):
+        return self.session.run(None, {self.input_name: np.asarray(batch, dtype=np.float32)})[0]
+
+
+class TFLiteBackend:
+    name = 'tflite'
+
+    def __init__(self, model_path, num_threads=None):
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            try:
+                from tflite_runtime.interpreter import Interpreter
+            except ImportError:
+                import tensorflow as tf
+                Interpreter = tf.lite.Interpreter
+        self.interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self.num_classes = int(self._output['shape'][-1])
+        self._batch_size = int(self._input['shape'][0])
+        # The interpreter holds mutable tensor buffers and is not thread-safe
+        self._lock = threading.Lock()
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=self._input['dtype'])
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self.interpreter.resize_tensor_input(self._input['index'], batch.shape)
+                self.interpreter.allocate_tensors()
+                self._batch_size = batch.shape[0]
+            self.interpreter.set_tensor(self._input['index'], batch)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self._output['index']).copy()
+
+
+BACKENDS = {
+    'keras': KerasBackend,
+    'onnx': OnnxBackend,
+    'tflite': TFLiteBackend
+}
+
+
+def backend_for_path(model_path):
+    """Guess the backend from the model file extension"""
+    ext = os.path.splitext(model_path)[1].lower()
+    return {'.onnx': 'onnx', '.tflite': 'tflite'}.get(ext, 'keras')
+
+
+def load_backend(model_path, backend=None, num_threads=None):
+    """
+    Load a model with the requested inference backend
+
+    Args:
+        model_path: Path to a .h5/.keras, .onnx or .tflite model
+        backend: 'keras', 'onnx' or 'tflite' (default: from the file extension)
+        num_threads: Threads used inside one forward pass (default: the runtime's own)
+    """
+    backend = backend or backend_for_path(model_path)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[backend](model_path, num_threads=num_threads)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Classify a directory tree of leaf photos in fixed-size batches
+
+Images are decoded in a thread pool while the model runs, results are streamed
+to a JSONL or CSV file as each batch finishes, and re-running with the same
+output file skips images that were already classified (ones that failed to
+decode are tried again).
+
+Usage:
+    python batch_classify.py /data/field_photos --output results.jsonl
+    python batch_classify.py /data/field_photos --output results.csv --batch-size 32 --workers 8
+"""
+
+import os
+import csv
+import json
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+CSV_FIELDS = ['file', 'predicted_class', 'confidence', 'error']
+
+
+def find_images(root):
+    """Yield image paths under root relative to it, in a stable order"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.relpath(os.path.join(dirpath, name), root)
+
+
+def drop_partial_line(output_path, chunk_size=1 << 16):
+    """
+    Cut an unterminated last line (a record interrupted by a crash) off output_path
+
+    Otherwise the next record would be appended onto it, and a cut-short CSV
+    row would count its image as done.
+    """
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - chunk_size)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b'\n')
+            if newline >= 0:
+                keep = start + newline + 1
+                break
+            position = start
+        else:
+            keep = 0
+        if keep < end:
+            print(f"Dropping an incomplete last record from {output_path}")
+            f.truncate(keep)
+
+
+def load_done(output_path):
+    """
+    Return the set of files already classified in an existing output file
+
+    Records of images that failed to decode don't count, so a transient read
+    error is retried on the next run; its new record is appended after the old one.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r', newline='') as f:
+        if output_path.endswith('.csv'):
+            for row in csv.DictReader(f):
+                if row.get('file') and not row.get('error'):
+                    done.add(row['file'])
+        else:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    if not record.get('error'):
+                        done.add(record['file'])
+                except (ValueError, KeyError, AttributeError):
+                    # A line cut short by a crash - that image is simply redone
+                    continue
+    return done
+
+
+class ResultWriter:
+    def __init__(self, output_path):
+        self.is_csv = output_path.endswith('.csv')
+        new_file = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+        self._f = open(output_path, 'a', newline='')
+        if self.is_csv:
+            self._csv = csv.DictWriter(self._f, fieldnames=CSV_FIELDS, extrasaction='ignore')
+            if new_file:
+                self._csv.writeheader()
+
+    def write(self, record):
+        if self.is_csv:
+            self._csv.writerow(record)
+        else:
+            self._f.write(json.dumps(record) + '\n')
+
+    def flush(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def close(self):
+        self._f.close()
+
+
+def _decode_stream(checker, root, files, pool, prefetch):
+    """Decode images ahead of the model, keeping at most `prefetch` in flight"""
+    pending = deque()
+    files = iter(files)
+
+    def schedule():
+        rel = next(files, None)
+        if rel is not None:
+            pending.append((rel, pool.submit(checker.preprocess, os.path.join(root, rel))))
+
+    for _ in range(prefetch):
+        schedule()
+    while pending:
+        rel, future = pending.popleft()
+        schedule()
+        try:
+            yield rel, future.result(), None
+        except Exception as e:
+            yield rel, None, str(e)
+
+
+def classify_directory(checker, root, output_path, batch_size=32, workers=4, top_k=3):
+    """
+    Classify every image under root, appending one record per image to output_path
+
+    Returns:
+        dict with counts of processed, skipped and failed images and images/s
+    """
+    drop_partial_line(output_path)
+    done = load_done(output_path)
+    files = [f for f in find_images(root) if f not in done]
+    print(f"{len(files)} images to classify ({len(done)} already done)")
+
+    writer = ResultWriter(output_path)
+    processed = failed = 0
+    start = time.perf_counter()
+
+    def flush_batch(names, arrays):
+        nonlocal processed
+        for rel, result in zip(names, checker.predict_batch(arrays, mode='top_k', k=top_k)):
+            result['file'] = rel
+            writer.write(result)
+        processed += len(names)
+        writer.flush()
+        rate = processed / (time.perf_counter() - start)
+        print(f"{processed}/{len(files)} images, {rate:.1f} images/s")
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            names, arrays = [], []
+            for rel, array, error in _decode_stream(checker, root, files, pool, prefetch=batch_size * 2):
+                if error is not None:
+                    failed += 1
+                    writer.write({'file': rel, 'error': error})
+                    continue
+                names.append(rel)
+                arrays.append(array)
+                if len(arrays) == batch_size:
+                    flush_batch(names, arrays)
+                    names, arrays = [], []
+            if arrays:
+                flush_batch(names, arrays)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        'processed': processed,
+        'failed': failed,
+        'skipped': len(done),
+        'seconds': round(elapsed, 2),
+        'images_per_second': round(processed / elapsed, 2) if elapsed > 0 else 0.0
+    }
+    print(summary)
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batch-classify a directory of leaf images')
+    parser.add_argument('directory', help='Directory tree containing images')
+    parser.add_argument('--output', default='batch_results.jsonl', help='Output .jsonl or .csv file (appended to, used for resume)')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4, help='Decode threads')
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--model', help='Local model path (skips Hugging Face)')
+    parser.add_argument('--indices', default='class_indices.json')
+    args = parser.parse_args()
+
+    from run_hf import LeafDiseaseChecker
+
+    if args.model:
+        checker = LeafDiseaseChecker(model_path=args.model, idx_path=args.indices, use_huggingface=False)
+    else:
+        checker = LeafDiseaseChecker(
+            use_huggingface=True,
+            repo_id=os.environ.get('HF_REPO_ID', 'rishabh914/leaf-disease-detection'),
+            cache_dir=os.environ.get('MODEL_CACHE_DIR') or None
+        )
+    classify_directory(checker, args.directory, args.output, args.batch_size, args.workers, args.top_k)
@@ -0,0 +1,71 @@
+import io
+import os
+import tarfile
+import zipfile
+
+from batch_classify import IMAGE_EXTENSIONS
+
+
+def _is_image_name(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS) and not os.path.basename(name).startswith('.')
+
+
+def _check_member(name, size, max_member_bytes):
+    if max_member_bytes is not None and size > max_member_bytes:
+        raise ValueError(f"Archive member {name} would exceed the upload size limit")
+
+
+def expand_upload(filename, data, max_member_bytes=None):
+    """
+    Yield (name, bytes) for an uploaded image, or for each image inside a zip/tar archive
+
+    Archive members keep their order in the archive; non-image members are skipped.
+    A member whose uncompressed size exceeds max_member_bytes raises ValueError
+    before it is extracted, so a small archive can't inflate into gigabytes.
+    """
+    buf = io.BytesIO(data)
+    if zipfile.is_zipfile(buf):
+        with zipfile.ZipFile(buf) as zf:
+            for info in zf.infolist():
+                if not info.is_dir() and _is_image_name(info.filename):
+                    _check_member(info.filename, info.file_size, max_member_bytes)
+                    yield f"{filename}/{info.filename}", zf.read(info)
+        return
+
+    buf.seek(0)
+    if tarfile.is_tarfile(buf):
+        buf.seek(0)
+        with tarfile.open(fileobj=buf, mode='r:*') as tf:
+            for member in tf:
+                if member.isfile() and _is_image_name(member.name):
+                    _check_member(member.name, member.size, max_member_bytes)
+                    yield f"{filename}/{member.name}", tf.extractfile(member).read()
+        return
+
+    yield filename, data
+
+
+def expand_uploads(uploads, max_files, max_bytes=None):
+    """
+    Flatten uploaded files and archives into a list of (name, bytes)
+
+    Args:
+        uploads: Iterable of (filename, bytes) as received
+        max_files: Maximum number of images accepted in one request
+        max_bytes: Optional cap on the total size of the images after extraction
+
+    Raises:
+        ValueError: if the request holds more than max_files images or max_bytes
+    """
+    items = []
+    total = 0
+    for filename, data in uploads:
+        remaining = None if max_bytes is None else max_bytes - total
+        for name, image_data in expand_upload(filename, data, remaining):
+            items.append((name, image_data))
+            total += len(image_data)
+            if len(items) > max_files:
+                raise ValueError(f"Too many images in one request (max {max_files})")
+            if max_bytes is not None and total > max_bytes:
+                raise ValueError(f"Images in one request exceed {max_bytes // (1024 * 1024)} MB")
+    return items
@@ -0,0 +1,129 @@
+import threading
+import queue
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+# Queued by close(); the worker exits once it reaches it
+_STOP = object()
+
+
+class MicroBatcher:
+    def __init__(self, predict_fn, max_batch_size=8, max_wait_ms=10):
+        """
+        Gather concurrent prediction requests into batches
+
+        Args:
+            predict_fn: Callable taking a list of inputs and returning a list
+                of results in the same order (e.g. LeafDiseaseChecker.predict_probs)
+            max_batch_size: Largest number of inputs sent in one forward pass
+            max_wait_ms: How long the first queued request may wait for
+                others to join its batch
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._max_queue_depth = 0
+        self._requests = 0
+        self._batches = 0
+        self._closed = False
+
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, item, timeout=None):
+        """Queue one input and block until its result is ready"""
+        return self.submit_async(item).result(timeout=timeout)
+
+    def submit_async(self, item):
+        """Queue one input and return a Future for its result"""
+        future = Future()
+        with self._lock:
+            # Checked and queued under the lock so nothing lands behind close()'s _STOP
+            if self._closed:
+                raise RuntimeError('MicroBatcher is closed')
+            self._queue.put((item, future))
+            depth = self._queue.qsize()
+            self._requests += 1
+            self._max_queue_depth = max(self._max_queue_depth, depth)
+        return future
+
+    def close(self):
+        """Finish the requests already queued, then stop the worker thread (and release predict_fn)"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put((_STOP, None))
+        self._worker.join()
+        self.predict_fn = None
+        # Nothing can be queued after _STOP any more, but fail anything that somehow was
+        while True:
+            try:
+                _, future = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if future is not None and not future.done():
+                future.set_exception(RuntimeError('MicroBatcher is closed'))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self._max_queue_depth,
+                'requests': self._requests,
+                'batches': self._batches,
+                'batch_size_histogram': {
+                    str(size): count
+                    for size, count in sorted(self._batch_sizes.items())
+                }
+            }
+
+    def _collect(self):
+        """Next batch, and whether close() was reached"""
+        first = self._queue.get()
+        if first[0] is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item[0] is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        while True:
+            batch, stopping = self._collect()
+            if not batch:
+                return
+            items = [item for item, _ in batch]
+            futures = [future for _, future in batch]
+
+            with self._lock:
+                self._batches += 1
+                self._batch_sizes[len(batch)] += 1
+
+            try:
+                results = self.predict_fn(items)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+            else:
+                for future, result in zip(futures, results):
+                    future.set_result(result)
+            if stopping:
+                return
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Inference benchmark suite with a regression gate
+
+Measures, on the images in backend/uploads/:
+  - checker: single-image latency (p50/p95/p99) and batch throughput of
+    LeafDiseaseChecker called directly
+  - cold_start: import + model load + first prediction in a fresh interpreter,
+    with its peak RSS
+  - app: latency and requests/second of POST /predict on a local server, at
+    several client concurrency levels, plus the mean Server-Timing stages
+
+Without --model a small stand-in Keras model with the real input shape and
+class count is generated, so the suite runs offline. Numbers from the
+stand-in are only comparable with a baseline recorded on the stand-in.
+
+Usage:
+    python benchmark.py --output benchmark_results.json
+    python benchmark.py --update-baseline benchmark_baseline.json
+    python benchmark.py --baseline benchmark_baseline.json --tolerance 0.25
+    python benchmark.py --model final_model.h5 --skip-app
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from export_model import SAMPLE_DIR, sample_images
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+INDICES_PATH = os.path.join(BACKEND_DIR, 'class_indices.json')
+
+COLD_START_PROBE = """
+import sys, json, time, resource
+start = time.perf_counter()
+from run_hf import LeafDiseaseChecker
+imported = time.perf_counter()
+checker = LeafDiseaseChecker(model_path=sys.argv[1], idx_path=sys.argv[2], use_huggingface=False)
+loaded = time.perf_counter()
+checker.predict_probs([checker.preprocess(sys.argv[3])])
+done = time.perf_counter()
+print('PROBE', json.dumps({
+    'import_seconds': imported - start,
+    'load_seconds': loaded - imported,
+    'first_prediction_seconds': done - loaded,
+    'total_seconds': done - start,
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+}))
+"""
+
+
+def build_stand_in_model(path, num_classes, seed=0):
+    """Write a tiny Keras model with the production input shape and class count"""
+    import tensorflow as tf
+
+    tf.keras.utils.set_random_seed(seed)
+    model = tf.keras.Sequential([
+        tf.keras.Input(shape=(256, 256, 3)),
+        tf.keras.layers.Rescaling(1.0 / 255),
+        tf.keras.layers.Conv2D(16, 3, strides=4, activation='relu'),
+        tf.keras.layers.Conv2D(32, 3, strides=4, activation='relu'),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(num_classes, activation='softmax')
+    ])
+    model.save(path)
+    return path
+
+
+def latency_summary(seconds):
+    """p50/p95/p99/mean in milliseconds"""
+    ms = np.asarray(seconds) * 1000.0
+    return {
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        'mean_ms': round(float(ms.mean()), 3)
+    }
+
+
+def bench_checker(model_path, paths, iterations=50, batch_sizes=(1, 8, 32)):
+    """Latency and throughput of LeafDiseaseChecker without the web stack"""
+    from run_hf import LeafDiseaseChecker
+
+    checker = LeafDiseaseChecker(model_path=model_path, idx_path=INDICES_PATH, use_huggingface=False)
+    checker.warmup(batch_sizes=sorted(set(batch_sizes) | {1}))
+    data = []
+    for p in paths:
+        with open(p, 'rb') as f:
+            data.append(f.read())
+
+    # One image end to end: decode, resize, forward pass, post-processing
+    latencies = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        probs = checker.predict_probs([checker.preprocess_bytes(data[i % len(data)])])
+        checker.format_predictions(probs, 'full')
+        latencies.append(time.perf_counter() - start)
+
+    arrays = [checker.preprocess_bytes(d) for d in data]
+    throughput = {}
+    for n in batch_sizes:
+        batch = [arrays[i % len(arrays)] for i in range(n)]
+        rounds = max(3, iterations // n)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            checker.predict_probs(batch)
+        elapsed = time.perf_counter() - start
+        throughput[str(n)] = {
+            'batch_ms': round(elapsed / rounds * 1000.0, 3),
+            'images_per_second': round(n * rounds / elapsed, 2)
+        }
+
+    return {
+        'model_version': checker.model_version,
+        'backend': checker.backend.name,
+        'single_image': latency_summary(latencies),
+        'batch_throughput': throughput
+    }
+
+
+def bench_cold_start(model_path, image_path):
+    """Fresh interpreter: import, load the model and answer one prediction"""
+    proc = subprocess.run(
+        [sys.executable, '-c', COLD_START_PROBE, model_path, INDICES_PATH, image_path],
+        cwd=BACKEND_DIR, capture_output=True, text=True
+    )
+    for line in proc.stdout.splitlines():
+        if line.startswith('PROBE '):
+            return {k: round(v, 3) for k, v in json.loads(line[len('PROBE '):]).items()}
+    raise RuntimeError(f"Cold-start probe failed:\n{proc.stderr[-2000:]}")
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _multipart(filename, data, boundary='----leafbenchmark'):
+    body = (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        'Content-Type: application/octet-stream\r\n\r\n'
+    ).encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def start_server(model_path, workdir, port, timeout=300):
+    """
+    Serve app.py with the given model from a scratch directory
+
+    Uses Gunicorn with the production flags when it is installed, otherwise
+    Flask's threaded development server.
+    """
+    from backends import MODEL_FILENAMES, backend_for_path
+
+    backend = backend_for_path(model_path)
+    os.symlink(os.path.abspath(model_path), os.path.join(workdir, MODEL_FILENAMES[backend]))
+    shutil.copy(INDICES_PATH, os.path.join(workdir, 'class_indices.json'))
+
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        PYTHONPATH=BACKEND_DIR,
+        MODEL_BACKEND=backend,
+        # Never download - the Hub lookup fails fast and the app falls back to the
+        # unpinned model file in its working directory
+        HF_HUB_OFFLINE='1',
+        MODEL_OFFLINE='0',
+        MODEL_SHA256='',
+        MODEL_CACHE_DIR=os.path.join(workdir, 'model_cache'),
+        JOBS_DB=os.path.join(workdir, 'jobs.sqlite3'),
+        PREDICTIONS_DB=os.path.join(workdir, 'predictions.sqlite3'),
+        # Images are cycled, so a one-entry cache keeps every request on the model path
+        PREDICTION_CACHE_SIZE='1'
+    )
+    try:
+        import gunicorn  # noqa: F401
+        cmd = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+               '--timeout', '120', '--workers', '1', '--threads', '8', 'app:app']
+    except ImportError:
+        cmd = [sys.executable, os.path.join(BACKEND_DIR, 'app.py')]
+    proc = subprocess.Popen(cmd, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Server exited with code {proc.returncode}")
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=5) as r:
+                status = json.load(r).get('status')
+            if status == 'healthy':
+                return proc
+            if status == 'error':
+                break
+        except OSError:
+            pass
+        time.sleep(0.5)
+    proc.terminate()
+    raise RuntimeError("Server did not become healthy")
+
+
+def load_test(url, payloads, requests, concurrency):
+    """Send `requests` POSTs with `concurrency` clients; returns latency and throughput"""
+    def send(i):
+        body, content_type = payloads[i % len(payloads)]
+        req = urllib.request.Request(url, data=body, headers={'Content-Type': content_type})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=120) as r:
+                r.read()
+                timing = r.headers.get('Server-Timing', '')
+                ok = r.status == 200
+        except OSError:
+            timing, ok = '', False
+        return time.perf_counter() - start, ok, timing
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(send, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    stages = {}
+    for _, _, timing in outcomes:
+        for entry in filter(None, (e.strip() for e in timing.split(','))):
+            name, _, dur = entry.partition(';dur=')
+            stages.setdefault(name, []).append(float(dur))
+
+    latencies = [seconds for seconds, ok, _ in outcomes if ok]
+    result = {
+        'requests': requests,
+        'errors': sum(1 for _, ok, _ in outcomes if not ok),
+        'requests_per_second': round(len(latencies) / elapsed, 2),
+        'stages': {name: round(sum(v) / len(v), 3) for name, v in stages.items()}
+    }
+    if latencies:
+        result.update(latency_summary(latencies))
+    return result
+
+
+def bench_app(model_path, paths, requests=100, concurrency_levels=(1, 8)):
+    """Latency and throughput of POST /predict through a real local server"""
+    payloads = []
+    for p in paths:
+        with open(p, 'rb') as f:
+            payloads.append(_multipart(os.path.basename(p), f.read()))
+
+    port = _free_port()
+    workdir = tempfile.mkdtemp(prefix='leaf-benchmark-')
+    proc = start_server(model_path, workdir, port)
+    try:
+        url = f'http://127.0.0.1:{port}/predict'
+        # Untimed pass so every image size has been seen once
+        load_test(url, payloads, len(payloads), 1)
+        return {
+            str(c): load_test(url, payloads, requests, c)
+            for c in concurrency_levels
+        }
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        name = f'{prefix}.{key}' if prefix else key
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    List metrics that got worse than the baseline by more than `tolerance`
+
+    Times and memory (*_ms, *_seconds, *_mb) must not grow, rates
+    (*_per_second) must not shrink; other numbers are informational.
+    """
+    current = _flatten(results)
+    regressions = []
+    for name, before in _flatten(baseline).items():
+        after = current.get(name)
+        if after is None or before <= 0:
+            continue
+        if name.endswith(('_ms', '_seconds', '_mb')) and '.stages.' not in name:
+            worse = after > before * (1 + tolerance)
+        elif name.endswith('_per_second'):
+            worse = after < before * (1 - tolerance)
+        else:
+            continue
+        if worse:
+            regressions.append({
+                'metric': name,
+                'baseline': before,
+                'current': after,
+                'change': round(after / before - 1, 3)
+            })
+    return regressions
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',') if v]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark inference latency, throughput and cold start')
+    parser.add_argument('--model', help='Model file to benchmark (default: generated stand-in model)')
+    parser.add_argument('--images', default=SAMPLE_DIR, help='Directory of benchmark images')
+    parser.add_argument('--iterations', type=int, default=50, help='Single-image predictions timed')
+    parser.add_argument('--batch-sizes', type=_int_list, default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=100, help='Requests per concurrency level')
+    parser.add_argument('--concurrency', type=_int_list, default=[1, 8])
+    parser.add_argument('--skip-app', action='store_true', help='Do not start the web server')
+    parser.add_argument('--skip-cold-start', action='store_true')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='Fail if results regress past this baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative regression')
+    parser.add_argument('--update-baseline', metavar='PATH', help='Write these results as the new baseline')
+    args = parser.parse_args()
+
+    paths = sample_images(args.images)
+    if not paths:
+        sys.exit(f"No benchmark images found in {args.images}")
+
+    scratch = tempfile.mkdtemp(prefix='leaf-benchmark-model-')
+    try:
+        model_path = args.model
+        if model_path is None:
+            with open(INDICES_PATH) as f:
+                num_classes = len(json.load(f))
+            model_path = build_stand_in_model(os.path.join(scratch, 'stand_in.h5'), num_classes)
+            print(f"Using stand-in model with {num_classes} classes")
+
+        results = {
+            'environment': {
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'cpus': os.cpu_count(),
+                'model': os.path.basename(args.model) if args.model else 'stand-in',
+                'images': len(paths)
+            }
+        }
+        print(f"Benchmarking LeafDiseaseChecker on {len(paths)} images...")
+        results['checker'] = bench_checker(model_path, paths, args.iterations, args.batch_sizes)
+        if not args.skip_cold_start:
+            print("Measuring cold start...")
+            results['cold_start'] = bench_cold_start(model_path, paths[0])
+        if not args.skip_app:
+            print("Load testing POST /predict...")
+            results['app'] = bench_app(model_path, paths, args.requests, args.concurrency)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {args.output}")
+
+    if args.update_baseline:
+        with open(args.update_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline updated: {args.update_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('environment', {}).get('model') != results['environment']['model']:
+            print("Warning: baseline was recorded with a different model")
+        regressions = compare(results, baseline, args.tolerance)
+        for r in regressions:
+            print(f"REGRESSION {r['metric']}: {r['baseline']} -> {r['current']} ({r['change']:+.1%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} of {args.baseline}")
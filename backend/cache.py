@@ -0,0 +1,138 @@
+import os
+import copy
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class PredictionCache:
+    def __init__(self, max_entries=1024, ttl_seconds=3600, disk_dir=None):
+        """
+        LRU + TTL cache for prediction results keyed by image content
+
+        Args:
+            max_entries: Number of results kept in memory before the least
+                recently used one is evicted
+            ttl_seconds: Age after which a cached result is ignored (0 = never expires)
+            disk_dir: Optional directory for a second tier that survives restarts
+        """
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl_seconds)
+        self.disk_dir = disk_dir
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._puts = 0
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(data, *parts):
+        """Build a key from the raw image bytes plus e.g. model version and call kind"""
+        digest = hashlib.sha256(data).hexdigest()
+        return ':'.join([str(p) for p in parts] + [digest])
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if not self._expired(stored_at, now):
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return copy.deepcopy(value)
+                del self._entries[key]
+
+        stored_at, value = self._disk_get(key, now)
+        with self._lock:
+            if value is None:
+                self._misses += 1
+                return None
+            self._disk_hits += 1
+            self._store(key, value, stored_at)
+        return copy.deepcopy(value)
+
+    def put(self, key, value):
+        now = time.time()
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._store(key, value, now)
+            self._puts += 1
+            prune = self.disk_dir and self._puts % 256 == 0
+        self._disk_put(key, value)
+        if prune:
+            self._prune_disk(now)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._disk_hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self._hits,
+                'disk_hits': self._disk_hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'hit_rate': (self._hits + self._disk_hits) / lookups if lookups else 0.0,
+                'disk_tier': bool(self.disk_dir)
+            }
+
+    def _expired(self, stored_at, now):
+        return self.ttl > 0 and now - stored_at > self.ttl
+
+    def _store(self, key, value, stored_at):
+        self._entries[key] = (stored_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def _disk_path(self, key):
+        # Keys contain ':' - hash them again for a portable file name
+        return os.path.join(self.disk_dir, hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+    def _disk_get(self, key, now):
+        if not self.disk_dir:
+            return None, None
+        path = self._disk_path(key)
+        try:
+            stored_at = os.path.getmtime(path)
+            if self._expired(stored_at, now):
+                os.remove(path)
+                return None, None
+            with open(path, 'r') as f:
+                return stored_at, json.load(f)
+        except (OSError, ValueError):
+            return None, None
+
+    def _disk_put(self, key, value):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Prediction cache disk write failed: {e}")
+
+    def _prune_disk(self, now):
+        if self.ttl <= 0:
+            return
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            try:
+                if self._expired(os.path.getmtime(path), now):
+                    os.remove(path)
+            except OSError:
+                pass
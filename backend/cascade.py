@@ -0,0 +1,76 @@
+import threading
+
+import numpy as np
+
+from metrics import span
+
+# Router outcomes, in the order stats() reports them
+PATHS = ('healthy', 'confident', 'escalated')
+
+
+def healthy_mask(class_names):
+    """True for the '<Crop>___healthy' classes of class_indices.json"""
+    return np.array([str(name).lower().endswith('healthy') for name in class_names])
+
+
+class CascadeRouter:
+    def __init__(self, backend, class_names, threshold=0.9, healthy_threshold=0.8):
+        """
+        Cheap first stage in front of the full disease model
+
+        The router is a small model (e.g. a MobileNet student, or an early-exit
+        head exported on its own) trained on the same 256x256 input and the same
+        class_indices.json. Images it classifies confidently are answered with
+        its output; only the rest go through the full model.
+
+        Args:
+            backend: Loaded router backend (see backends.load_backend)
+            class_names: Class name per output index
+            threshold: Router confidence needed to answer any class
+            healthy_threshold: Router confidence needed to answer a healthy
+                class - the most common and easiest case, so it may be lower
+        """
+        self.backend = backend
+        self.threshold = threshold
+        self.healthy_threshold = healthy_threshold
+        self._healthy = healthy_mask(class_names)
+        self._counts = dict.fromkeys(PATHS, 0)
+        self._lock = threading.Lock()
+
+    def predict(self, batch, full_predict):
+        """
+        Probabilities for a float batch, escalating uncertain rows to full_predict
+
+        Args:
+            batch: (N, H, W, 3) model input
+            full_predict: Runs the full model on a sub-batch
+
+        Returns:
+            (N, num_classes) array - router output for early exits, full model
+            output for escalated rows, in input order
+        """
+        with span('router'):
+            probs = np.array(self.backend.predict(batch), dtype=np.float32)
+        top = probs.argmax(axis=1)
+        confidence = probs.max(axis=1)
+        healthy = self._healthy[top] & (confidence >= self.healthy_threshold)
+        confident = ~healthy & (confidence >= self.threshold)
+        escalate = ~(healthy | confident)
+        if escalate.any():
+            probs[escalate] = full_predict(batch[escalate])
+        with self._lock:
+            self._counts['healthy'] += int(healthy.sum())
+            self._counts['confident'] += int(confident.sum())
+            self._counts['escalated'] += int(escalate.sum())
+        return probs
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        total = sum(counts.values())
+        return {
+            'threshold': self.threshold,
+            'healthy_threshold': self.healthy_threshold,
+            'images': counts,
+            'early_exit_rate': round((total - counts['escalated']) / total, 4) if total else None
+        }
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Score a model on a labelled dataset
+
+The dataset is laid out the way run.py's _make_indices expects: one folder
+per class, named as in class_indices.json. Images are decoded by a thread
+pool ahead of the model and classified in fixed-size batches; only running
+totals are kept, so memory does not grow with the dataset.
+
+Reports top-1/top-5 accuracy, the confusion matrix, per-class precision,
+recall and calibration (reliability bins and ECE), throughput and peak
+memory, written as JSON. --compare prints the differences from an earlier
+result, e.g. the model currently in production.
+
+Usage:
+    python evaluate.py dataset/valid --model final_model.h5 --output eval_v2.json
+    python evaluate.py dataset/valid --output eval_hub.json --compare eval_v1.json
+    python evaluate.py dataset/valid --model final_model.h5 --max-per-class 50
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from batch_classify import _decode_stream, find_images
+from metrics import peak_memory_bytes
+
+
+def labelled_files(root, class_names, max_per_class=None):
+    """
+    (relative path, class index) for every image under root/<class name>/
+
+    Folders that are not model classes are reported and skipped.
+    """
+    index = {name: i for i, name in enumerate(class_names)}
+    files = []
+    for label in sorted(os.listdir(root)):
+        if not os.path.isdir(os.path.join(root, label)):
+            continue
+        if label not in index:
+            print(f"Skipping folder '{label}': not a model class")
+            continue
+        images = list(find_images(os.path.join(root, label)))[:max_per_class]
+        files.extend((os.path.join(label, rel), index[label]) for rel in images)
+    return files
+
+
+class Evaluation:
+    def __init__(self, class_names, bins=15, top_k=5):
+        """
+        Running totals for accuracy, confusion matrix and calibration
+
+        Args:
+            class_names: Class name per model output
+            bins: Equal-width confidence bins for the reliability tables
+            top_k: The k of top-k accuracy
+        """
+        self.class_names = [str(name) for name in class_names]
+        self.bins = bins
+        self.top_k = top_k
+        n = len(self.class_names)
+        self.confusion = np.zeros((n, n), dtype=np.int64)       # [true, predicted]
+        self.top_k_hits = 0
+        # Per predicted class and confidence bin: images, correct ones, summed confidence
+        self.bin_count = np.zeros((n, bins), dtype=np.int64)
+        self.bin_correct = np.zeros((n, bins), dtype=np.int64)
+        self.bin_confidence = np.zeros((n, bins), dtype=np.float64)
+        self.log_loss = 0.0
+
+    def update(self, labels, probs):
+        """Add one batch: true class indices (N,) and probabilities (N, num_classes)"""
+        labels = np.asarray(labels, dtype=np.int64)
+        probs = np.asarray(probs, dtype=np.float64)
+        n = len(self.class_names)
+        predicted = probs.argmax(axis=1)
+        confidence = probs[np.arange(len(labels)), predicted]
+        correct = predicted == labels
+
+        self.confusion += np.bincount(labels * n + predicted, minlength=n * n).reshape(n, n)
+        k = min(self.top_k, n)
+        top = np.argpartition(-probs, k - 1, axis=1)[:, :k]
+        self.top_k_hits += int((top == labels[:, None]).any(axis=1).sum())
+
+        cells = predicted * self.bins + np.minimum((confidence * self.bins).astype(np.int64), self.bins - 1)
+        size = n * self.bins
+        self.bin_count += np.bincount(cells, minlength=size).reshape(n, self.bins)
+        self.bin_correct += np.bincount(cells, weights=correct, minlength=size).astype(np.int64).reshape(n, self.bins)
+        self.bin_confidence += np.bincount(cells, weights=confidence, minlength=size).reshape(n, self.bins)
+        self.log_loss -= float(np.log(np.clip(probs[np.arange(len(labels)), labels], 1e-12, None)).sum())
+
+    @staticmethod
+    def _ece(count, correct, confidence):
+        """Expected calibration error: |accuracy - confidence| per bin, weighted by its share of images"""
+        total = count.sum(axis=-1)
+        gap = np.abs(correct - confidence).sum(axis=-1)
+        return np.divide(gap, total, out=np.zeros_like(gap, dtype=np.float64), where=total > 0)
+
+    def results(self):
+        images = int(self.confusion.sum())
+        true_positives = np.diag(self.confusion)
+        support = self.confusion.sum(axis=1)
+        predicted = self.confusion.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            precision = true_positives / predicted
+            recall = true_positives / support
+            f1 = 2 * precision * recall / (precision + recall)
+        class_ece = self._ece(self.bin_count, self.bin_correct, self.bin_confidence)
+        mean_confidence = self.bin_confidence.sum(axis=1) / np.maximum(predicted, 1)
+
+        def number(value):
+            return None if not np.isfinite(value) else round(float(value), 4)
+
+        per_class = {
+            name: {
+                'support': int(support[i]),
+                'predicted': int(predicted[i]),
+                'precision': number(precision[i]),
+                'recall': number(recall[i]),
+                'f1': number(f1[i]),
+                'mean_confidence': number(mean_confidence[i]) if predicted[i] else None,
+                'ece': number(class_ece[i]) if predicted[i] else None
+            }
+            for i, name in enumerate(self.class_names)
+        }
+        count = self.bin_count.sum(axis=0)
+        reliability = [
+            {
+                'confidence': [round(b / self.bins, 4), round((b + 1) / self.bins, 4)],
+                'images': int(count[b]),
+                'accuracy': round(float(self.bin_correct[:, b].sum() / count[b]), 4),
+                'mean_confidence': round(float(self.bin_confidence[:, b].sum() / count[b]), 4)
+            }
+            for b in range(self.bins) if count[b]
+        ]
+        evaluated = support > 0
+        return {
+            'images': images,
+            'top1_accuracy': round(float(true_positives.sum() / images), 4) if images else None,
+            f'top{self.top_k}_accuracy': round(self.top_k_hits / images, 4) if images else None,
+            'balanced_accuracy': round(float(recall[evaluated].mean()), 4) if evaluated.any() else None,
+            'log_loss': round(self.log_loss / images, 4) if images else None,
+            'ece': round(float(self._ece(
+                self.bin_count.sum(axis=0), self.bin_correct.sum(axis=0), self.bin_confidence.sum(axis=0)
+            )), 4) if images else None,
+            'reliability': reliability,
+            'per_class': per_class,
+            'class_names': self.class_names,
+            'confusion_matrix': self.confusion.tolist()
+        }
+
+
+def evaluate(checker, root, batch_size=32, workers=4, max_per_class=None, bins=15):
+    """
+    Classify every labelled image under root and score the predictions
+
+    Returns:
+        dict of metrics (see Evaluation.results) plus dataset and throughput details
+    """
+    files = labelled_files(root, checker.class_names, max_per_class)
+    labels = dict(files)
+    print(f"{len(files)} images in {len({label for _, label in files})} classes")
+
+    evaluation = Evaluation(checker.class_names, bins=bins)
+    failed = []
+    scored = 0
+    model_seconds = 0.0
+    start = time.perf_counter()
+
+    def flush(names, arrays):
+        nonlocal scored, model_seconds
+        batch_start = time.perf_counter()
+        probs = checker.predict_probs(arrays)
+        model_seconds += time.perf_counter() - batch_start
+        evaluation.update([labels[rel] for rel in names], probs)
+        scored += len(names)
+        if scored % (batch_size * 20) < len(names):
+            print(f"{scored}/{len(files)} images, {scored / (time.perf_counter() - start):.1f} images/s")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        names, arrays = [], []
+        stream = _decode_stream(checker, root, [rel for rel, _ in files], pool, prefetch=batch_size * 2)
+        for rel, array, error in stream:
+            if error is not None:
+                failed.append({'file': rel, 'error': error})
+                continue
+            names.append(rel)
+            arrays.append(array)
+            if len(arrays) == batch_size:
+                flush(names, arrays)
+                names, arrays = [], []
+        if arrays:
+            flush(names, arrays)
+
+    elapsed = time.perf_counter() - start
+    peak = peak_memory_bytes()
+    return dict(evaluation.results(), **{
+        'model_version': checker.model_version,
+        'dataset': os.path.abspath(root),
+        'failed': failed,
+        'throughput': {
+            'seconds': round(elapsed, 2),
+            'images_per_second': round(scored / elapsed, 2) if elapsed > 0 else None,
+            'model_images_per_second': round(scored / model_seconds, 2) if model_seconds > 0 else None,
+            'batch_size': batch_size,
+            'decode_workers': workers
+        },
+        'peak_memory_mb': round(peak / 2 ** 20, 1) if peak else None
+    })
+
+
+def compare(results, baseline, top=5):
+    """Print headline metric changes and the classes whose recall moved most"""
+    print(f"Compared with {baseline.get('model_version')} on {baseline.get('dataset')}:")
+    for metric in ('top1_accuracy', 'top5_accuracy', 'balanced_accuracy', 'log_loss', 'ece'):
+        before, after = baseline.get(metric), results.get(metric)
+        if before is not None and after is not None:
+            print(f"  {metric}: {before} -> {after} ({after - before:+.4f})")
+    changes = []
+    for name, stats in results['per_class'].items():
+        before = baseline.get('per_class', {}).get(name, {}).get('recall')
+        if before is not None and stats['recall'] is not None:
+            changes.append((stats['recall'] - before, name, before, stats['recall']))
+    changes.sort()
+    for delta, name, before, after in changes[:top] + changes[-top:][::-1]:
+        if delta:
+            print(f"  recall {name}: {before} -> {after} ({delta:+.4f})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score a model on a labelled dataset (one folder per class)')
+    parser.add_argument('directory', help='Dataset root with one subfolder per class')
+    parser.add_argument('--model', help='Local model file (default: from Hugging Face)')
+    parser.add_argument('--indices', default='class_indices.json')
+    parser.add_argument('--output', default='evaluation.json')
+    parser.add_argument('--compare', metavar='PATH', help='Earlier evaluation JSON to compare with')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4, help='Decode threads')
+    parser.add_argument('--max-per-class', type=int, help='Evaluate at most this many images per class')
+    parser.add_argument('--bins', type=int, default=15, help='Confidence bins for calibration')
+    args = parser.parse_args()
+
+    from run_hf import LeafDiseaseChecker
+
+    if args.model:
+        checker = LeafDiseaseChecker(model_path=args.model, idx_path=args.indices, use_huggingface=False)
+    else:
+        checker = LeafDiseaseChecker(
+            use_huggingface=True,
+            repo_id=os.environ.get('HF_REPO_ID', 'rishabh914/leaf-disease-detection'),
+            cache_dir=os.environ.get('MODEL_CACHE_DIR') or None
+        )
+    results = evaluate(checker, args.directory, args.batch_size, args.workers, args.max_per_class, args.bins)
+    if not results['images']:
+        sys.exit(f"No labelled images found in {args.directory}")
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(f"top-1 {results['top1_accuracy']}, top-5 {results['top5_accuracy']}, ECE {results['ece']}, "
+          f"{results['throughput']['images_per_second']} images/s, peak {results['peak_memory_mb']} MB")
+    print(f"Wrote {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
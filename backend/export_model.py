@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Export the Keras model to ONNX or TFLite and check parity on the sample images
+
+Usage:
+    python export_model.py final_model.h5 --format onnx
+    python export_model.py final_model.h5 --format tflite --output final_model.tflite
+    python export_model.py final_model.h5 --check final_model.onnx
+
+Exporting needs TensorFlow (plus tf2onnx for ONNX); serving the exported file
+only needs onnxruntime or the TFLite interpreter - see requirements-onnx.txt.
+"""
+
+import os
+import sys
+import glob
+import time
+import argparse
+
+import numpy as np
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
+INPUT_SHAPE = (256, 256, 3)
+
+
+def export_onnx(keras_path, output_path, opset=17):
+    import tensorflow as tf
+    import tf2onnx
+
+    model = tf.keras.models.load_model(keras_path)
+    spec = (tf.TensorSpec((None,) + INPUT_SHAPE, tf.float32, name='input'),)
+    # from_keras() can't resolve Keras 3 output names - trace a plain tf.function instead
+    forward = tf.function(lambda x: model(x, training=False), input_signature=spec)
+    tf2onnx.convert.from_function(forward, input_signature=spec, opset=opset, output_path=output_path)
+    return output_path
+
+
+def export_tflite(keras_path, output_path):
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(keras_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+    return output_path
+
+
+EXPORTERS = {
+    'onnx': export_onnx,
+    'tflite': export_tflite
+}
+
+
+def sample_images(sample_dir=SAMPLE_DIR):
+    paths = []
+    for ext in ('*.jpg', '*.JPG', '*.jpeg', '*.png', '*.webp'):
+        paths.extend(glob.glob(os.path.join(sample_dir, ext)))
+    return sorted(set(paths))
+
+
+def check_parity(reference_path, candidate_path, sample_dir=SAMPLE_DIR, atol=1e-3, idx_path='class_indices.json'):
+    """
+    Compare two model files on the sample images
+
+    Returns:
+        dict with top-1 agreement, max absolute probability difference and
+        per-backend latency; 'passed' is False if any top-1 differs or the
+        difference exceeds atol
+    """
+    from run_hf import LeafDiseaseChecker
+
+    paths = sample_images(sample_dir)
+    if not paths:
+        raise RuntimeError(f"No sample images found in {sample_dir}")
+
+    reference = LeafDiseaseChecker(model_path=reference_path, idx_path=idx_path, use_huggingface=False)
+    candidate = LeafDiseaseChecker(model_path=candidate_path, idx_path=idx_path, use_huggingface=False)
+    batch = [reference.preprocess(p) for p in paths]
+
+    timings = {}
+    outputs = {}
+    for name, checker in (('reference', reference), ('candidate', candidate)):
+        checker.warmup()
+        start = time.perf_counter()
+        outputs[name] = np.asarray(checker.predict_probs(batch))
+        timings[name] = (time.perf_counter() - start) / len(batch) * 1000.0
+
+    agree = outputs['reference'].argmax(axis=1) == outputs['candidate'].argmax(axis=1)
+    max_diff = float(np.abs(outputs['reference'] - outputs['candidate']).max())
+    report = {
+        'images': len(paths),
+        'reference_backend': reference.backend.name,
+        'candidate_backend': candidate.backend.name,
+        'top1_agreement': float(agree.mean()),
+        'max_abs_diff': max_diff,
+        'reference_ms_per_image': round(timings['reference'], 2),
+        'candidate_ms_per_image': round(timings['candidate'], 2),
+        'mismatched': [os.path.basename(p) for p, ok in zip(paths, agree) if not ok],
+        'passed': bool(agree.all()) and max_diff <= atol
+    }
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export final_model.h5 to a lighter inference runtime')
+    parser.add_argument('model', help='Source Keras model (.h5/.keras)')
+    parser.add_argument('--format', choices=sorted(EXPORTERS), default='onnx')
+    parser.add_argument('--output', help='Output path (default: model name with the format extension)')
+    parser.add_argument('--check', metavar='EXPORTED', help='Skip export, only compare an exported model against the source')
+    parser.add_argument('--samples', default=SAMPLE_DIR, help='Directory of images used for the parity check')
+    parser.add_argument('--atol', type=float, default=1e-3, help='Maximum allowed probability difference')
+    args = parser.parse_args()
+
+    exported = args.check
+    if exported is None:
+        exported = args.output or os.path.splitext(args.model)[0] + '.' + args.format
+        print(f"Exporting {args.model} -> {exported} ({args.format})")
+        EXPORTERS[args.format](args.model, exported)
+
+    print(f"Checking parity on images in {args.samples}")
+    report = check_parity(args.model, exported, args.samples, args.atol)
+    print(report)
+    sys.exit(0 if report['passed'] else 1)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Shared inference process for multi-worker serving
+
+One process loads the model once and serves predictions over a local Unix
+socket. Gunicorn workers started with INFERENCE_SOCKET set decode uploads
+themselves and send the preprocessed tensors here, so requests from every
+worker are micro-batched together and memory stays at one model copy.
+
+Usage:
+    INFERENCE_SOCKET=/tmp/leaf-inference.sock python inference_server.py
+"""
+
+import os
+import time
+import threading
+from multiprocessing.connection import Listener, Client
+
+import numpy as np
+
+from batching import MicroBatcher
+from metrics import span
+from postprocess import encode_predictions
+from preprocessing import IMAGE_SIZE, decode_image
+from tta import DEFAULT_VIEWS, tta_probs
+
+INFERENCE_SOCKET = os.environ.get('INFERENCE_SOCKET', '/tmp/leaf-inference.sock')
+INFERENCE_AUTHKEY = os.environ.get('INFERENCE_AUTHKEY', 'leaf-disease').encode()
+
+
+def serve(checker, address=INFERENCE_SOCKET, max_batch_size=8, max_wait_ms=10, warmup_seconds=0.0):
+    """Accept worker connections and answer their requests until the process exits"""
+    batcher = MicroBatcher(checker.predict_probs, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    info = {
+        'model_version': checker.model_version,
+        'class_names': checker.class_names.tolist(),
+        'load_seconds': checker.load_seconds,
+        'warmup_seconds': warmup_seconds
+    }
+
+    if os.path.exists(address):
+        os.remove(address)
+    listener = Listener(address, family='AF_UNIX', authkey=INFERENCE_AUTHKEY)
+    print(f"Inference server listening on {address}")
+
+    def handle(conn):
+        with conn:
+            while True:
+                try:
+                    op, payload = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    if op == 'predict_probs':
+                        futures = [batcher.submit_async(a) for a in payload]
+                        reply = ('ok', [f.result() for f in futures])
+                    elif op == 'predict_with_embeddings':
+                        # Needs the embedding output too, so it bypasses the batcher
+                        reply = ('ok', checker.predict_with_embeddings(payload))
+                    elif op == 'stats':
+                        reply = ('ok', batcher.stats())
+                    elif op == 'info':
+                        reply = ('ok', info)
+                    else:
+                        reply = ('error', f"Unknown operation: {op}")
+                except NotImplementedError as e:
+                    reply = ('unsupported', str(e))
+                except Exception as e:
+                    reply = ('error', str(e))
+                conn.send(reply)
+
+    while True:
+        conn = listener.accept()
+        threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+
+class InferenceClient:
+    def __init__(self, address=INFERENCE_SOCKET, cache=None, connect_timeout=300, draft_decode=True):
+        """
+        Worker-side stand-in for LeafDiseaseChecker backed by the shared inference process
+
+        Provides the parts of the LeafDiseaseChecker and MicroBatcher interfaces the
+        Flask app uses (preprocess_bytes, predict_probs, predict_tta, predict_with_embeddings,
+        format_predictions, cached, submit, stats) without importing TensorFlow or loading the model in the worker.
+
+        Args:
+            address: Unix socket path of the inference server
+            cache: Optional PredictionCache local to this worker
+            connect_timeout: Seconds to wait for the server to come up
+            draft_decode: Decode JPEGs at reduced resolution (see preprocessing.decode_image)
+        """
+        self.address = address
+        self.cache = cache
+        self.draft_decode = draft_decode
+        self._local = threading.local()
+
+        deadline = time.monotonic() + connect_timeout
+        while True:
+            try:
+                info = self._call('info', None)
+                break
+            except (OSError, EOFError):
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Inference server not reachable at {address}")
+                time.sleep(0.5)
+
+        self.model_version = info['model_version']
+        self.class_names = np.array(info['class_names'], dtype=object)
+        self.load_seconds = info['load_seconds']
+        self.warmup_seconds = info['warmup_seconds']
+
+    def _conn(self):
+        # One connection per thread so concurrent requests don't interleave messages
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = Client(self.address, family='AF_UNIX', authkey=INFERENCE_AUTHKEY)
+            self._local.conn = conn
+        return conn
+
+    def _call(self, op, payload):
+        conn = self._conn()
+        try:
+            conn.send((op, payload))
+            status, result = conn.recv()
+        except (OSError, EOFError):
+            self._local.conn = None
+            raise
+        if status == 'unsupported':
+            raise NotImplementedError(result)
+        if status != 'ok':
+            raise RuntimeError(result)
+        return result
+
+    def preprocess_bytes(self, data, size=IMAGE_SIZE):
+        """Decode and resize in the worker; uint8 arrays keep the socket payload small"""
+        if hasattr(data, 'read'):
+            data = data.read()
+        return decode_image(data, size, draft=self.draft_decode)
+
+    def predict_probs(self, arrays):
+        # Socket round trip plus the server's batched forward pass
+        with span('model'):
+            return np.asarray(self._call('predict_probs', list(arrays)))
+
+    def predict_with_embeddings(self, arrays):
+        with span('model'):
+            probs, embeddings = self._call('predict_with_embeddings', list(arrays))
+        return np.asarray(probs), np.asarray(embeddings)
+
+    def format_predictions(self, probs, mode='full', k=5):
+        return encode_predictions(probs, self.class_names, mode, k)
+
+    def predict_batch(self, arrays, mode='full', k=5):
+        return self.format_predictions(self.predict_probs(arrays), mode, k)
+
+    def predict_tta(self, array, views=DEFAULT_VIEWS, base_probs=None):
+        return tta_probs(self.predict_probs, array, views, base_probs)
+
+    def submit(self, item, timeout=None):
+        return self.predict_probs([item])[0]
+
+    def stats(self):
+        return self._call('stats', None)
+
+    def warmup(self, batch_sizes=(1,), size=IMAGE_SIZE):
+        # The server warmed up before it started listening
+        return self.warmup_seconds
+
+    def cached(self, data, kind, compute):
+        if self.cache is None:
+            return compute()
+        key = self.cache.make_key(data, self.model_version, kind)
+        result = self.cache.get(key)
+        if result is None:
+            result = compute()
+            self.cache.put(key, result)
+        return result
+
+
+if __name__ == '__main__':
+    from runtime_config import apply_environment, load_config
+
+    runtime_config = load_config()
+    apply_environment(runtime_config)
+    from run_hf import LeafDiseaseChecker
+
+    batch_max_size = int(os.environ.get('BATCH_MAX_SIZE', 8))
+    checker = LeafDiseaseChecker(
+        use_huggingface=True,
+        repo_id=os.environ.get('HF_REPO_ID', 'rishabh914/leaf-disease-detection'),
+        cache_dir=os.environ.get('MODEL_CACHE_DIR') or None,
+        offline=os.environ.get('MODEL_OFFLINE', '0').lower() in ('1', 'true', 'yes'),
+        model_sha256=os.environ.get('MODEL_SHA256') or None,
+        backend=os.environ.get('MODEL_BACKEND', 'keras'),
+        model_filename=os.environ.get('MODEL_FILENAME') or None,
+        cascade_model=os.environ.get('CASCADE_MODEL') or None,
+        cascade_threshold=float(os.environ.get('CASCADE_THRESHOLD', 0.9)),
+        cascade_healthy_threshold=float(os.environ.get('CASCADE_HEALTHY_THRESHOLD', 0.8)),
+        num_threads=runtime_config['intra_op_threads'],
+        max_inflight=runtime_config['max_inflight']
+    )
+    warmup_seconds = checker.warmup(batch_sizes=sorted({1, batch_max_size}))
+    serve(
+        checker,
+        max_batch_size=batch_max_size,
+        max_wait_ms=float(os.environ.get('BATCH_MAX_WAIT_MS', 10)),
+        warmup_seconds=warmup_seconds
+    )
@@ -0,0 +1,277 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    heartbeat_at REAL,
+    owner TEXT,
+    total INTEGER NOT NULL,
+    completed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    mode TEXT NOT NULL,
+    k INTEGER NOT NULL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    status TEXT NOT NULL,
+    data BLOB,
+    probs TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+"""
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+class QueueFull(Exception):
+    """Raised when too many jobs are waiting - callers should retry later"""
+
+
+class JobStore:
+    def __init__(self, db_path):
+        """
+        SQLite-backed job state, safe to share between threads and Gunicorn workers
+
+        Uploaded images are kept in the database until processed, so queued
+        and half-finished jobs survive a restart.
+        """
+        self.db_path = db_path
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # Autocommit connection per call; an unfinished BEGIN is rolled back on close
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def create(self, items, mode='full', k=5):
+        """Persist a new job from a list of (filename, bytes) and return its ID"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN')
+            conn.execute(
+                'INSERT INTO jobs (id, status, created_at, updated_at, total, mode, k) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (job_id, 'queued', now, now, len(items), mode, k)
+            )
+            conn.executemany(
+                'INSERT INTO job_items (job_id, idx, filename, status, data) VALUES (?, ?, ?, ?, ?)',
+                [(job_id, i, name, 'pending', data) for i, (name, data) in enumerate(items)]
+            )
+            conn.execute('COMMIT')
+        return job_id
+
+    def count_active(self):
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT COUNT(*) FROM jobs WHERE status IN ({','.join('?' * len(ACTIVE_STATUSES))})",
+                ACTIVE_STATUSES
+            ).fetchone()
+        return row[0]
+
+    def claim(self, owner, lease_seconds):
+        """
+        Atomically take the oldest queued job, or a running job whose owner stopped
+        heartbeating (e.g. the worker was restarted). Returns the job ID or None.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' "
+                "OR (status = 'running' AND heartbeat_at < ?) ORDER BY created_at LIMIT 1",
+                (now - lease_seconds,)
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, heartbeat_at = ?, updated_at = ? WHERE id = ?",
+                (owner, now, now, row['id'])
+            )
+            conn.execute('COMMIT')
+        return row['id']
+
+    def pending_items(self, job_id, limit):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT idx, filename, data FROM job_items WHERE job_id = ? AND status = 'pending' "
+                'ORDER BY idx LIMIT ?',
+                (job_id, limit)
+            ).fetchall()
+        return [(row['idx'], row['filename'], row['data']) for row in rows]
+
+    def record(self, job_id, outcomes):
+        """Store results for processed items: outcomes is a list of (idx, probs, error)"""
+        now = time.time()
+        done = sum(1 for _, probs, _ in outcomes if probs is not None)
+        failed = len(outcomes) - done
+        with self._connect() as conn:
+            conn.execute('BEGIN')
+            conn.executemany(
+                'UPDATE job_items SET status = ?, probs = ?, error = ?, data = NULL WHERE job_id = ? AND idx = ?',
+                [
+                    ('done' if probs is not None else 'failed',
+                     json.dumps(probs) if probs is not None else None,
+                     error, job_id, idx)
+                    for idx, probs, error in outcomes
+                ]
+            )
+            conn.execute(
+                'UPDATE jobs SET completed = completed + ?, failed = failed + ?, heartbeat_at = ?, updated_at = ? WHERE id = ?',
+                (done, failed, now, now, job_id)
+            )
+            conn.execute('COMMIT')
+
+    def finish(self, job_id, status='completed', error=None):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?',
+                (status, error, now, job_id)
+            )
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def results(self, job_id, offset=0, limit=100):
+        """Finished items (done or failed) with idx >= offset, in input order"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT idx, filename, status, probs, error FROM job_items "
+                "WHERE job_id = ? AND idx >= ? AND status != 'pending' ORDER BY idx LIMIT ?",
+                (job_id, offset, limit)
+            ).fetchall()
+        return [
+            {
+                'idx': row['idx'],
+                'filename': row['filename'],
+                'probs': json.loads(row['probs']) if row['probs'] else None,
+                'error': row['error']
+            }
+            for row in rows
+        ]
+
+    def purge(self, older_than_seconds):
+        """Delete finished jobs last updated before the retention window"""
+        cutoff = time.time() - older_than_seconds
+        with self._connect() as conn:
+            conn.execute('BEGIN')
+            conn.execute(
+                "DELETE FROM job_items WHERE job_id IN "
+                "(SELECT id FROM jobs WHERE status NOT IN ('queued', 'running') AND updated_at < ?)",
+                (cutoff,)
+            )
+            conn.execute(
+                "DELETE FROM jobs WHERE status NOT IN ('queued', 'running') AND updated_at < ?",
+                (cutoff,)
+            )
+            conn.execute('COMMIT')
+
+
+class JobRunner:
+    def __init__(self, store, process_fn, workers=1, chunk_size=8, max_active=16,
+                 lease_seconds=60, retention_seconds=86400):
+        """
+        Drain the job store with a bounded pool of worker threads
+
+        Args:
+            store: JobStore
+            process_fn: Callable taking a list of image bytes and returning
+                (probs_list, errors_list) in the same order
+            workers: Jobs processed concurrently by this process
+            chunk_size: Images loaded from the store and classified per step
+            max_active: Queued + running jobs allowed before submit() pushes back
+            lease_seconds: How long a running job may go without a heartbeat
+                before another worker takes it over
+            retention_seconds: How long finished jobs are kept for polling
+        """
+        self.store = store
+        self.process_fn = process_fn
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.max_active = max_active
+        self.lease_seconds = lease_seconds
+        self.retention_seconds = retention_seconds
+
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._wake = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, items, mode='full', k=5):
+        """Persist a job and wake a worker; raises QueueFull when the backlog is full"""
+        if self.store.count_active() >= self.max_active:
+            raise QueueFull(f"{self.max_active} jobs already queued or running")
+        job_id = self.store.create(items, mode, k)
+        self._wake.set()
+        return job_id
+
+    def _run(self):
+        last_purge = 0.0
+        backoff = 0.0
+        while True:
+            try:
+                if time.time() - last_purge > 3600:
+                    self.store.purge(self.retention_seconds)
+                    last_purge = time.time()
+
+                job_id = self.store.claim(self.owner, self.lease_seconds)
+                if job_id is None:
+                    self._wake.wait(timeout=self.lease_seconds / 4)
+                    self._wake.clear()
+                    continue
+                try:
+                    self._process(job_id)
+                    self.store.finish(job_id, 'completed')
+                except Exception as e:
+                    print(f"Job {job_id} failed: {e}")
+                    self.store.finish(job_id, 'failed', str(e))
+                backoff = 0.0
+            except Exception as e:
+                # e.g. "database is locked" - the worker must survive it; a job it
+                # could not finish is picked up again once its lease expires
+                backoff = min(30.0, backoff * 2 or 0.5)
+                print(f"Job worker error, retrying in {backoff:.1f}s: {e}")
+                time.sleep(backoff)
+
+    def _process(self, job_id):
+        while True:
+            chunk = self.store.pending_items(job_id, self.chunk_size)
+            if not chunk:
+                return
+            probs, errors = self.process_fn([data for _, _, data in chunk])
+            self.store.record(job_id, [
+                (idx, p, e) for (idx, _, _), p, e in zip(chunk, probs, errors)
+            ])
@@ -0,0 +1,182 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Histogram buckets (seconds) for per-stage and per-request latency
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Stage durations recorded while the current request is being handled
+_request_spans = ContextVar('request_spans', default=None)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in labels
+    )
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+class MetricsRegistry:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        Minimal in-process counters, gauges and histograms in Prometheus text format
+
+        Values are per process; with several Gunicorn workers each one
+        reports its own series.
+        """
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._meta = {}        # name -> (type, help)
+        self._counters = {}    # (name, labels) -> value
+        self._gauges = {}      # (name, labels) -> value or zero-argument callable
+        self._histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+
+    def _declare(self, name, kind, help_text):
+        if name not in self._meta:
+            self._meta[name] = (kind, help_text)
+
+    def inc(self, name, help_text='', amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._declare(name, 'counter', help_text)
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_counter(self, name, value, help_text='', **labels):
+        """Expose a total kept elsewhere, as a number or a callable evaluated at scrape time"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._declare(name, 'counter', help_text)
+            self._counters[key] = value
+
+    def set_gauge(self, name, value, help_text='', **labels):
+        """Set a gauge to a number, or to a callable evaluated at scrape time"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._declare(name, 'gauge', help_text)
+            self._gauges[key] = value
+
+    def observe(self, name, value, help_text='', **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._declare(name, 'histogram', help_text)
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    hist[i] += 1
+            hist[-2] += value
+            hist[-1] += 1
+
+    def render(self):
+        """All series in the Prometheus text exposition format (version 0.0.4)"""
+        with self._lock:
+            meta = dict(self._meta)
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {k: list(v) for k, v in self._histograms.items()}
+
+        lines = []
+        for name in sorted(meta):
+            kind, help_text = meta[name]
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind in ('counter', 'gauge'):
+                series = counters if kind == 'counter' else gauges
+                for (n, labels), value in sorted(series.items(), key=lambda item: item[0]):
+                    if n != name:
+                        continue
+                    if callable(value):
+                        try:
+                            value = value()
+                        except Exception:
+                            continue
+                    if value is not None:
+                        lines.append(f'{name}{_format_labels(labels)} {float(value)}')
+            else:
+                for (n, labels), hist in sorted(histograms.items()):
+                    if n != name:
+                        continue
+                    for bound, count in zip(self.buckets, hist):
+                        lines.append(f'{name}_bucket{_format_labels(labels + (("le", bound),))} {count}')
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {hist[-1]}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {hist[-2]}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {hist[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+@contextmanager
+def span(stage):
+    """
+    Time one stage of request handling
+
+    The duration goes into the leaf_stage_duration_seconds histogram and, when
+    called while a request is being tracked, into that request's Server-Timing.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        registry.observe(
+            'leaf_stage_duration_seconds', elapsed,
+            'Time spent in each stage of handling a prediction', stage=stage
+        )
+        spans = _request_spans.get()
+        if spans is not None:
+            spans[stage] = spans.get(stage, 0.0) + elapsed
+
+
+def start_request():
+    """Begin collecting spans for the current request; returns a token for end_request()"""
+    return _request_spans.set({})
+
+
+def request_spans():
+    """The {stage: seconds} dict being filled for the current request, or None"""
+    return _request_spans.get()
+
+
+def end_request(token):
+    """Stop collecting and return {stage: seconds} for the request"""
+    spans = _request_spans.get() or {}
+    _request_spans.reset(token)
+    return spans
+
+
+def server_timing(spans, total=None):
+    """Format stage durations as a Server-Timing header value (milliseconds)"""
+    entries = [f'{stage};dur={seconds * 1000.0:.2f}' for stage, seconds in spans.items()]
+    if total is not None:
+        entries.append(f'total;dur={total * 1000.0:.2f}')
+    return ', '.join(entries)
+
+
+def resident_memory_bytes():
+    """Current resident set size, or None where /proc is unavailable"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def peak_memory_bytes():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
@@ -0,0 +1,215 @@
+import gc
+import time
+import random
+import threading
+import itertools
+from collections import deque
+
+import numpy as np
+
+from metrics import registry
+
+TRAFFIC_MODES = ('shadow', 'split')
+_slot_ids = itertools.count(1)
+
+
+class ModelSlot:
+    def __init__(self, checker, batcher, warmup_seconds=None, window=1000):
+        """
+        One loaded model version: its checker, micro-batcher and live stats
+
+        Requests hold the slot (acquire/release) while they use it, so a
+        replaced version is only unloaded once its in-flight requests finish.
+        Stats are kept per slot id, so reloading the same version (e.g. to
+        compare backends) doesn't merge its series with the active one's.
+
+        Args:
+            window: Recent request latencies kept for the p50/p95 stats
+        """
+        self.checker = checker
+        self.batcher = batcher
+        self.id = str(next(_slot_ids))
+        self.version = checker.model_version
+        self.loaded_at = time.time()
+        self.warmup_seconds = warmup_seconds
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._inflight = 0
+        self.requests = 0
+
+    def acquire(self):
+        with self._lock:
+            self._inflight += 1
+
+    def release(self):
+        with self._lock:
+            self._inflight -= 1
+            if self._inflight == 0:
+                self._idle.notify_all()
+
+    def observe(self, seconds):
+        """Record one served request's latency for this version"""
+        with self._lock:
+            self.requests += 1
+            self._latencies.append(seconds)
+        registry.observe(
+            'leaf_model_request_duration_seconds', seconds,
+            'Prediction latency per loaded model', slot=self.id, version=self.version
+        )
+
+    def wait_idle(self, timeout=60.0):
+        with self._lock:
+            return self._idle.wait_for(lambda: self._inflight == 0, timeout=timeout)
+
+    def close(self):
+        """Stop the batcher and drop the model so its memory can be freed"""
+        if hasattr(self.batcher, 'close'):
+            self.batcher.close()
+        self.checker = self.batcher = None
+
+    def stats(self):
+        with self._lock:
+            latencies = np.asarray(self._latencies) * 1000.0
+            return {
+                'slot_id': self.id,
+                'version': self.version,
+                'loaded_at': self.loaded_at,
+                'warmup_seconds': self.warmup_seconds,
+                'requests': self.requests,
+                'in_flight': self._inflight,
+                'p50_ms': round(float(np.percentile(latencies, 50)), 3) if len(latencies) else None,
+                'p95_ms': round(float(np.percentile(latencies, 95)), 3) if len(latencies) else None
+            }
+
+
+class ModelSlots:
+    def __init__(self, on_activate=None, drain_timeout=60.0):
+        """
+        Active model plus an optional candidate being evaluated
+
+        The candidate either serves a share of the traffic ('split') or
+        re-runs a share of the requests in the background without affecting
+        responses ('shadow'), with top-1 agreement against the active model
+        counted. promote() swaps it in atomically.
+
+        Args:
+            on_activate: Called with the new active slot after every swap
+            drain_timeout: Longest wait for a replaced version's in-flight
+                requests before it is unloaded anyway
+        """
+        self.on_activate = on_activate
+        self.drain_timeout = drain_timeout
+        self.active = None
+        self.candidate = None
+        self.mode = None
+        self.percent = 0.0
+        self.loading = None      # description of a candidate being loaded
+        self.error = None        # why the last candidate failed to load
+        self._agreement = {}     # candidate slot id -> [compared, agreed]
+        self._lock = threading.Lock()
+
+    def set_active(self, slot):
+        with self._lock:
+            old, self.active = self.active, slot
+        if self.on_activate:
+            self.on_activate(slot)
+        if old is not None:
+            self._retire(old)
+
+    def stage(self, slot, mode='shadow', percent=10.0):
+        """Make a loaded slot the candidate, replacing (and unloading) any previous one"""
+        with self._lock:
+            old, self.candidate = self.candidate, slot
+            self.mode, self.percent = mode, float(percent)
+            self._agreement[slot.id] = [0, 0]
+        if old is not None:
+            self._retire(old)
+
+    def set_traffic(self, mode, percent):
+        if mode not in TRAFFIC_MODES:
+            raise ValueError(f"Unknown traffic mode '{mode}', expected one of {', '.join(TRAFFIC_MODES)}")
+        with self._lock:
+            self.mode, self.percent = mode, float(percent)
+
+    def promote(self):
+        """Swap the candidate in as the active model; the old one drains, then unloads"""
+        with self._lock:
+            slot, self.candidate = self.candidate, None
+        if slot is None:
+            raise ValueError('No candidate model to promote')
+        self.set_active(slot)
+        return slot
+
+    def discard(self):
+        with self._lock:
+            slot, self.candidate = self.candidate, None
+        if slot is not None:
+            self._retire(slot)
+        return slot
+
+    def route(self):
+        """
+        Pick the slots for one request, both acquired
+
+        Returns:
+            (slot serving the response, candidate to shadow-run it on or None)
+            - release both when done
+        """
+        with self._lock:
+            serve, shadow = self.active, None
+            candidate = self.candidate
+            if candidate is not None and random.random() * 100.0 < self.percent:
+                if self.mode == 'split':
+                    serve = candidate
+                elif self.mode == 'shadow':
+                    shadow = candidate
+            serve.acquire()
+            if shadow is not None:
+                shadow.acquire()
+        return serve, shadow
+
+    def acquire_active(self):
+        """The active slot, acquired - release it when done"""
+        with self._lock:
+            slot = self.active
+            slot.acquire()
+        return slot
+
+    def record_agreement(self, slot, agreed):
+        """Count one shadow prediction on the candidate slot against the active model's"""
+        with self._lock:
+            counts = self._agreement.setdefault(slot.id, [0, 0])
+            counts[0] += 1
+            counts[1] += int(agreed)
+        registry.inc(
+            'leaf_shadow_comparisons_total', 'Shadow predictions compared with the active model',
+            slot=slot.id, version=slot.version, agreed=str(bool(agreed)).lower()
+        )
+
+    def _retire(self, slot):
+        def drain():
+            if not slot.wait_idle(self.drain_timeout):
+                print(f"Model {slot.version} still had requests in flight after {self.drain_timeout}s")
+            slot.close()
+            gc.collect()
+            print(f"Unloaded model {slot.version}")
+        threading.Thread(target=drain, name=f'retire-{slot.version}', daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            active, candidate = self.active, self.candidate
+            agreement = {i: list(c) for i, c in self._agreement.items()}
+            response = {
+                'active': active.stats() if active else None,
+                'candidate': candidate.stats() if candidate else None,
+                'mode': self.mode if candidate else None,
+                'percent': self.percent if candidate else None,
+                'loading': self.loading,
+                'error': self.error
+            }
+        if candidate is not None:
+            compared, agreed = agreement.get(candidate.id, [0, 0])
+            response['candidate']['shadow_compared'] = compared
+            response['candidate']['top1_agreement'] = round(agreed / compared, 4) if compared else None
+        return response
@@ -0,0 +1,111 @@
+import os
+import hashlib
+
+from huggingface_hub import hf_hub_download
+
+# Persistent location for downloaded model artifacts - mount a volume here so
+# container restarts reuse the verified copy instead of re-downloading
+DEFAULT_CACHE_DIR = os.environ.get(
+    'MODEL_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'leaf-disease')
+)
+
+
+class ArtifactUnavailable(RuntimeError):
+    """No copy of an artifact passed verification (pinned checksum or offline cache)"""
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _read_checksum(path):
+    try:
+        with open(path + '.sha256', 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _write_checksum(path, digest):
+    try:
+        with open(path + '.sha256', 'w') as f:
+            f.write(digest)
+    except OSError as e:
+        print(f"Could not record checksum for {path}: {e}")
+
+
+def verify_artifact(path, expected_sha256=None):
+    """
+    Check a cached artifact against its recorded (or pinned) SHA-256
+
+    Returns:
+        The file digest if the file is intact, otherwise None
+    """
+    if not path or not os.path.exists(path):
+        return None
+    digest = file_sha256(path)
+    expected = expected_sha256 or _read_checksum(path)
+    if expected and digest != expected:
+        print(f"Checksum mismatch for {path}: expected {expected}, got {digest}")
+        return None
+    return digest
+
+
+def fetch_artifact(repo_id, filename, cache_dir=None, offline=False, expected_sha256=None, revision=None):
+    """
+    Resolve a Hugging Face artifact through the persistent, verified cache
+
+    Args:
+        repo_id: Hugging Face repository ID
+        filename: File inside the repository
+        cache_dir: Persistent cache directory (defaults to MODEL_CACHE_DIR)
+        offline: Never touch the network; fail unless a verified copy exists
+        expected_sha256: Optional pinned digest the file must match
+        revision: Optional branch, tag or commit of the repository (default: main)
+
+    Returns:
+        (local_path, sha256_digest)
+    """
+    cache_dir = cache_dir or DEFAULT_CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+
+    if offline:
+        try:
+            path = hf_hub_download(
+                repo_id=repo_id,
+                filename=filename,
+                cache_dir=cache_dir,
+                revision=revision,
+                local_files_only=True
+            )
+        except Exception:
+            path = None
+        digest = verify_artifact(path, expected_sha256)
+        if digest is None:
+            raise ArtifactUnavailable(f"Offline mode: no verified copy of {filename} in {cache_dir}")
+        print(f"Using verified cached {filename} (offline)")
+        return path, digest
+
+    # Online: hub revalidates the cached copy and only downloads if it changed
+    path = hf_hub_download(repo_id=repo_id, filename=filename, cache_dir=cache_dir, revision=revision)
+    digest = verify_artifact(path, expected_sha256)
+    if digest is None:
+        print(f"Cached {filename} failed verification, re-downloading")
+        path = hf_hub_download(
+            repo_id=repo_id,
+            filename=filename,
+            cache_dir=cache_dir,
+            revision=revision,
+            force_download=True
+        )
+        digest = file_sha256(path)
+        if expected_sha256 and digest != expected_sha256:
+            raise ArtifactUnavailable(f"Downloaded {filename} does not match pinned checksum")
+
+    _write_checksum(path, digest)
+    return path, digest
@@ -0,0 +1,54 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from PIL import Image
+
+# Plotting helpers for LeafDiseaseChecker, kept out of run_hf.py/run.py so that
+# serving never imports matplotlib. Requires: pip install matplotlib
+
+
+def visualize_prediction(checker, img_path, save_path=None):
+    results = checker.predict_top_k(img_path, k=5)
+    
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12, 5))
+    
+    # Display image
+    img = Image.open(img_path)
+    ax1.imshow(img)
+    ax1.set_title('Input Image')
+    ax1.axis('off')
+    
+    # Display predictions
+    classes = [r['class'] for r in results]
+    confidences = [r['confidence'] for r in results]
+    
+    y_pos = np.arange(len(classes))
+    bars = ax2.barh(y_pos, confidences)
+    ax2.set_yticks(y_pos)
+    ax2.set_yticklabels(classes)
+    ax2.set_xlabel('Confidence')
+    ax2.set_title('Top 5 Predictions')
+    ax2.set_xlim(0, 1)
+    
+    # Add confidence values on bars
+    for i, (bar, conf) in enumerate(zip(bars, confidences)):
+        ax2.text(bar.get_width() + 0.01, bar.get_y() + bar.get_height()/2, 
+                f'{conf:.3f}', va='center')
+    
+    plt.tight_layout()
+    
+    if save_path:
+        plt.savefig(save_path, dpi=150, bbox_inches='tight')
+    
+    return fig
+
+
+def show_top_predictions(img, top, idx_to_class):
+    fig, axes = plt.subplots(1, 2, figsize=(12, 5))
+    axes[0].imshow(img)
+    axes[0].axis('off')
+    classes, vals = zip(*[(idx_to_class.get(i, i), p) for i, p in top])
+    axes[1].barh(classes, vals)
+    axes[1].invert_yaxis()
+    axes[1].set_xlabel('Confidence')
+    plt.tight_layout()
+    plt.show()
@@ -0,0 +1,77 @@
+import base64
+
+import numpy as np
+
+# Response encodings accepted by LeafDiseaseChecker.format_predictions and /predict
+#   full     - predicted class + {class name: probability} for every class (default, what the frontend used)
+#   top_k    - predicted class + the k most likely classes only
+#   array    - predicted class + probabilities as a float list in /classes order
+#   float16  - predicted class + base64 of the little-endian float16 probability vector
+RESPONSE_MODES = ('full', 'top_k', 'array', 'float16')
+
+
+def class_name_array(idx_to_class, num_classes):
+    """Precompute an index -> class name lookup array"""
+    return np.array([idx_to_class.get(i, f"class_{i}") for i in range(num_classes)], dtype=object)
+
+
+def top_k(probs, k):
+    """
+    Vectorized top-k over a batch of probability rows
+
+    Args:
+        probs: (N, C) array
+        k: Number of classes to keep per row
+
+    Returns:
+        (indices, values), both (N, k) and sorted by descending probability
+    """
+    probs = np.asarray(probs)
+    k = max(1, min(int(k), probs.shape[1]))
+    idx = np.argpartition(-probs, k - 1, axis=1)[:, :k]
+    vals = np.take_along_axis(probs, idx, axis=1)
+    order = np.argsort(-vals, axis=1, kind='stable')
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(vals, order, axis=1)
+
+
+def encode_predictions(probs, class_names, mode='full', k=5):
+    """
+    Turn a batch of probability rows into response dicts
+
+    Args:
+        probs: (N, C) array or nested list of probabilities
+        class_names: Array from class_name_array()
+        mode: One of RESPONSE_MODES
+        k: Classes returned in top_k mode
+
+    Returns:
+        One dict per row, in input order
+    """
+    if mode not in RESPONSE_MODES:
+        raise ValueError(f"Unknown response mode '{mode}', expected one of {', '.join(RESPONSE_MODES)}")
+
+    probs = np.asarray(probs, dtype=np.float32)
+    idx, vals = top_k(probs, k if mode == 'top_k' else 1)
+    top_names = class_names[idx].tolist()
+    top_vals = vals.tolist()
+    names = class_names.tolist() if mode == 'full' else None
+
+    results = []
+    for i, row in enumerate(probs):
+        result = {
+            'predicted_class': top_names[i][0],
+            'confidence': top_vals[i][0]
+        }
+        if mode == 'full':
+            result['all_predictions'] = dict(zip(names, row.tolist()))
+        elif mode == 'top_k':
+            result['top_k'] = [
+                {'class': c, 'confidence': p}
+                for c, p in zip(top_names[i], top_vals[i])
+            ]
+        elif mode == 'array':
+            result['probabilities'] = row.tolist()
+        else:
+            result['probabilities_f16'] = base64.b64encode(row.astype('<f2').tobytes()).decode('ascii')
+        results.append(result)
+    return results
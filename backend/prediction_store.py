@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    request_id TEXT NOT NULL UNIQUE,
+    created_at REAL NOT NULL,
+    predicted_class TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    filename TEXT,
+    model_version TEXT,
+    top_k TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_predictions_created ON predictions (created_at);
+CREATE INDEX IF NOT EXISTS idx_predictions_class ON predictions (predicted_class, created_at);
+CREATE INDEX IF NOT EXISTS idx_predictions_confidence ON predictions (confidence);
+"""
+
+
+def parse_time(value):
+    """Unix seconds or an ISO 8601 timestamp (naive means UTC) -> Unix seconds"""
+    try:
+        return float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+
+
+def query_options(args):
+    """
+    Parse /predictions query parameters into (filters, limit) for PredictionStore.query
+
+    Filters: class, since, until (Unix seconds or ISO 8601), min_confidence,
+    max_confidence and before (the id to page back from); limit is capped at 500.
+    Raises ValueError on a malformed value.
+    """
+    filters = {
+        'predicted_class': args.get('class') or None,
+        'since': parse_time(args['since']) if args.get('since') else None,
+        'until': parse_time(args['until']) if args.get('until') else None,
+        'min_confidence': float(args['min_confidence']) if args.get('min_confidence') else None,
+        'max_confidence': float(args['max_confidence']) if args.get('max_confidence') else None,
+        'before_id': int(args['before']) if args.get('before') else None
+    }
+    return filters, min(500, max(1, int(args.get('limit', 50))))
+
+
+class PredictionStore:
+    def __init__(self, db_path, max_pending=10000, flush_interval=0.5, max_batch=500):
+        """
+        Append-only, indexed prediction history in SQLite (WAL mode)
+
+        add() only enqueues; a background thread writes queued records in
+        batched transactions, so the request path never waits on disk.
+
+        Args:
+            db_path: SQLite file, shared safely by all Gunicorn workers
+            max_pending: Records buffered before new ones are dropped (and counted)
+            flush_interval: Longest time a record waits before being written
+            max_batch: Records written per transaction
+        """
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._written = 0
+        self._dropped = 0
+        self._writer = threading.Thread(target=self._run, name='prediction-writer', daemon=True)
+        self._writer.start()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def add(self, request_id, result, filename=None, model_version=None, top_k=None):
+        """Queue one prediction for writing; never blocks"""
+        record = (
+            request_id,
+            time.time(),
+            result['predicted_class'],
+            float(result['confidence']),
+            filename,
+            model_version,
+            json.dumps(top_k) if top_k is not None else None
+        )
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+
+    def flush(self):
+        """Block until every queued record has been written"""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                with self._connect() as conn:
+                    conn.execute('BEGIN')
+                    conn.executemany(
+                        'INSERT OR IGNORE INTO predictions '
+                        '(request_id, created_at, predicted_class, confidence, filename, model_version, top_k) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        batch
+                    )
+                    conn.execute('COMMIT')
+                with self._lock:
+                    self._written += len(batch)
+            except sqlite3.Error as e:
+                print(f"Prediction history write failed: {e}")
+                with self._lock:
+                    self._dropped += len(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    @staticmethod
+    def _row(row):
+        record = dict(row)
+        record['top_k'] = json.loads(record['top_k']) if record['top_k'] else None
+        return record
+
+    def get(self, request_id):
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM predictions WHERE request_id = ?', (request_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def query(self, predicted_class=None, since=None, until=None,
+              min_confidence=None, max_confidence=None, before_id=None, limit=50):
+        """
+        Newest-first page of predictions matching every given filter
+
+        Pass the smallest returned id as before_id to fetch the next page.
+        """
+        clauses, params = [], []
+        for clause, value in (
+            ('predicted_class = ?', predicted_class),
+            ('created_at >= ?', since),
+            ('created_at < ?', until),
+            ('confidence >= ?', min_confidence),
+            ('confidence <= ?', max_confidence),
+            ('id < ?', before_id)
+        ):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        with self._connect() as conn:
+            rows = conn.execute(
+                f'SELECT * FROM predictions {where} ORDER BY id DESC LIMIT ?',
+                params + [limit]
+            ).fetchall()
+        return [self._row(r) for r in rows]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'written': self._written,
+                'pending': self._queue.qsize(),
+                'dropped': self._dropped
+            }
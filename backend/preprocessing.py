@@ -0,0 +1,76 @@
+import io
+import threading
+
+import numpy as np
+from PIL import Image
+
+from metrics import span
+
+try:
+    import cv2
+    # Exact nearest-neighbour matches PIL / keras load_img pixel centres; older
+    # OpenCV only has the slightly shifted INTER_NEAREST
+    CV2_NEAREST = getattr(cv2, 'INTER_NEAREST_EXACT', cv2.INTER_NEAREST)
+except ImportError:
+    cv2 = None
+
+# Model input (height, width)
+IMAGE_SIZE = (256, 256)
+
+
+def decode_image(source, size=IMAGE_SIZE, draft=True):
+    """
+    Decode an image and resize it to the model input
+
+    Same result as keras load_img(target_size=size) + img_to_array: RGB,
+    nearest-neighbour resize. EfficientNet's preprocess_input is the identity
+    (the model rescales internally), so nothing else is applied.
+
+    Args:
+        source: Raw bytes, a file-like object or a path
+        size: Target (height, width)
+        draft: Let the JPEG decoder scale down by 1/2, 1/4 or 1/8 while
+            decoding (never below size), so a 12 MP photo is decoded at a
+            fraction of the cost; the output differs from a full decode only
+            by the DCT-domain downscale
+
+    Returns:
+        (H, W, 3) uint8 array - predict_probs casts it into the float batch
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    with span('decode'):
+        with Image.open(source) as img:
+            if draft and img.format == 'JPEG':
+                img.draft('RGB', (size[1], size[0]))
+            array = np.asarray(img.convert('RGB'))
+    with span('resize'):
+        if array.shape[:2] == tuple(size):
+            return array
+        if cv2 is not None:
+            return cv2.resize(array, (size[1], size[0]), interpolation=CV2_NEAREST)
+        return np.asarray(Image.fromarray(array).resize((size[1], size[0]), Image.NEAREST))
+
+
+class BatchBuffer:
+    def __init__(self, dtype=np.float32):
+        """
+        Reusable model input batch, one per thread
+
+        stack() casts decoded images straight into a preallocated array instead
+        of building a float copy per image and another for np.stack. The
+        returned view is overwritten by the next stack() on the same thread.
+        """
+        self.dtype = dtype
+        self._local = threading.local()
+
+    def stack(self, arrays):
+        n = len(arrays)
+        shape = np.shape(arrays[0])
+        buf = getattr(self._local, 'buf', None)
+        if buf is None or buf.shape[0] < n or buf.shape[1:] != shape:
+            buf = self._local.buf = np.empty((n,) + tuple(shape), dtype=self.dtype)
+        out = buf[:n]
+        for i, array in enumerate(arrays):
+            out[i] = array
+        return out
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Build post-training quantized TFLite variants of the model, gated on accuracy
+
+Each variant is compared with the float Keras model on a calibration set
+(backend/uploads/ by default). The variant file is only written to --output
+when its top-1 agreement reaches --min-agreement; a JSON report with
+latency, memory and agreement is written next to it either way.
+
+Usage:
+    python quantize_model.py final_model.h5 --mode float16
+    python quantize_model.py final_model.h5 --mode dynamic --min-agreement 0.99
+    python quantize_model.py final_model.h5 --mode int8 --calibration /data/calib
+
+Serve a published variant with MODEL_BACKEND=tflite and MODEL_FILENAME set to its name.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+from export_model import SAMPLE_DIR, sample_images
+
+# dynamic - int8 weights, float activations (no calibration needed to convert)
+# float16 - float16 weights, roughly half the size with near-identical outputs
+# int8    - int8 weights and activations, ranges calibrated on the calibration set
+QUANT_MODES = ('dynamic', 'float16', 'int8')
+
+
+def _rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def quantize(keras_path, mode, calibration_arrays=None):
+    """Convert a Keras model to a quantized TFLite flatbuffer (bytes)"""
+    import tensorflow as tf
+
+    if mode not in QUANT_MODES:
+        raise ValueError(f"Unknown mode '{mode}', expected one of {', '.join(QUANT_MODES)}")
+
+    model = tf.keras.models.load_model(keras_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if mode == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode == 'int8':
+        if not calibration_arrays:
+            raise ValueError("int8 quantization needs calibration images")
+        converter.representative_dataset = lambda: ([a[None].astype(np.float32)] for a in calibration_arrays)
+    return converter.convert()
+
+
+def _latency_ms(checker, arrays):
+    checker.warmup()
+    times = []
+    for a in arrays:
+        start = time.perf_counter()
+        checker.predict_probs([a])
+        times.append((time.perf_counter() - start) * 1000.0)
+    return float(np.median(times))
+
+
+def evaluate_variant(reference, variant_path, arrays, idx_path='class_indices.json'):
+    """
+    Compare a quantized variant with the float reference checker
+
+    Returns:
+        dict with top-1 agreement, max probability difference, median
+        single-image latency, resident memory added by loading and file size
+    """
+    from run_hf import LeafDiseaseChecker
+
+    rss_before = _rss_mb()
+    candidate = LeafDiseaseChecker(model_path=variant_path, idx_path=idx_path, use_huggingface=False)
+    rss_after = _rss_mb()
+
+    ref_probs = np.asarray(reference.predict_probs(arrays))
+    cand_probs = np.asarray(candidate.predict_probs(arrays))
+    agree = ref_probs.argmax(axis=1) == cand_probs.argmax(axis=1)
+
+    return {
+        'images': len(arrays),
+        'top1_agreement': float(agree.mean()),
+        'max_abs_diff': float(np.abs(ref_probs - cand_probs).max()),
+        'reference_ms_per_image': round(_latency_ms(reference, arrays), 2),
+        'variant_ms_per_image': round(_latency_ms(candidate, arrays), 2),
+        'variant_load_rss_mb': round(rss_after - rss_before, 1),
+        'variant_size_mb': round(os.path.getsize(variant_path) / 1e6, 2)
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a quantized model variant with an accuracy gate')
+    parser.add_argument('model', help='Float Keras model (.h5/.keras)')
+    parser.add_argument('--mode', choices=QUANT_MODES, default='dynamic')
+    parser.add_argument('--calibration', default=SAMPLE_DIR, help='Directory of calibration/evaluation images')
+    parser.add_argument('--min-agreement', type=float, default=0.98, help='Minimum top-1 agreement with the float model')
+    parser.add_argument('--output', help='Published variant path (default: final_model_<mode>.tflite)')
+    parser.add_argument('--indices', default='class_indices.json')
+    args = parser.parse_args()
+
+    from run_hf import LeafDiseaseChecker
+
+    output = args.output or os.path.join(os.path.dirname(args.model) or '.', f"final_model_{args.mode}.tflite")
+    paths = sample_images(args.calibration)
+    if not paths:
+        sys.exit(f"No calibration images found in {args.calibration}")
+
+    reference = LeafDiseaseChecker(model_path=args.model, idx_path=args.indices, use_huggingface=False)
+    arrays = [reference.preprocess(p) for p in paths]
+    print(f"Quantizing {args.model} ({args.mode}) with {len(arrays)} calibration images")
+
+    fd, tmp_path = tempfile.mkstemp(suffix='.tflite', dir=os.path.dirname(os.path.abspath(output)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(quantize(args.model, args.mode, arrays))
+        report = evaluate_variant(reference, tmp_path, arrays, args.indices)
+        report.update({
+            'mode': args.mode,
+            'source': args.model,
+            'min_agreement': args.min_agreement,
+            'reference_size_mb': round(os.path.getsize(args.model) / 1e6, 2),
+            'published': report['top1_agreement'] >= args.min_agreement
+        })
+        if report['published']:
+            os.replace(tmp_path, output)
+            print(f"Published {output}")
+        else:
+            print(f"Rejected: top-1 agreement {report['top1_agreement']:.3f} < {args.min_agreement}")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    with open(output + '.json', 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report['published'] else 1)
@@ -1,9 +1,11 @@
 import os
 import json
 import numpy as np
-import matplotlib.pyplot as plt
+
+from metrics import span
+from postprocess import top_k as select_top_k
+from preprocessing import decode_image
 from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing.image import load_img, img_to_array
 from tensorflow.keras.applications.efficientnet import preprocess_input
 
 
@@ -32,10 +34,15 @@ class LeafDiseaseChecker:
         if not os.path.exists(img_path):
             result = {"error": "file not found"}
         else:
-            img = load_img(img_path, target_size=size)
-            arr = preprocess_input(np.expand_dims(img_to_array(img), 0))
-            preds = self.model.predict(arr)[0]
-            top = sorted(enumerate(preds), key=lambda x: -x[1])[:top_k]
+            # decode_image records its own decode and resize spans
+            img = decode_image(img_path, size)
+            with span('preprocess'):
+                arr = preprocess_input(np.expand_dims(img, 0).astype(np.float32))
+            with span('model'):
+                preds = self.model.predict(arr)[0]
+            with span('postprocess'):
+                idx, vals = select_top_k(preds[None, :], top_k)
+                top = list(zip(idx[0].tolist(), vals[0].tolist()))
 
             result = {
                 "predictions": [
@@ -49,31 +56,26 @@ class LeafDiseaseChecker:
 
         # Only write to file if a valid path is provided
         if output_json:
-            with open(output_json, 'w') as f:
+            with span('write_json'), open(output_json, 'w') as f:
                 json.dump(result, f, indent=2)
 
         return result
 
     def _viz(self, img, top):
-        fig, axes = plt.subplots(1, 2, figsize=(12, 5))
-        axes[0].imshow(img)
-        axes[0].axis('off')
-        classes, vals = zip(*[(self.idx_to_class.get(i, i), p) for i, p in top])
-        axes[1].barh(classes, vals)
-        axes[1].invert_yaxis()
-        axes[1].set_xlabel('Confidence')
-        plt.tight_layout()
-        plt.show()
+        from plotting import show_top_predictions
+        show_top_predictions(img, top, self.idx_to_class)
 
     def batch(self, d, size=(256, 256)):
+        # For large directories use batch_classify.py, which batches and resumes
         res = {}
         for f in os.listdir(d):
             if f.lower().endswith(('.jpg', '.png', '.jpeg')):
                 res[f] = self.predict(os.path.join(d, f), size, output_json=None)
-        summary = {
-            v['disease']: sum(1 for r in res.values() if r.get('disease') == v['disease'])
-            for v in res.values()
-        }
+        # Count images per top-1 class; results carry no 'disease' key
+        summary = {}
+        for r in res.values():
+            top = r['predictions'][0]['name'] if r.get('predictions') else r.get('error', 'unknown')
+            summary[top] = summary.get(top, 0) + 1
         print({'total': len(res), 'summary': summary})
         return res
 
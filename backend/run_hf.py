@@ -1,16 +1,26 @@
 import os
 import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
 import numpy as np
-import matplotlib.pyplot as plt
-from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing.image import load_img, img_to_array
-from tensorflow.keras.applications.efficientnet import preprocess_input
-from huggingface_hub import hf_hub_download
-import tempfile
+
+from backends import MODEL_FILENAMES, backend_for_path, load_backend
+from cascade import CascadeRouter
+from metrics import span
+from preprocessing import IMAGE_SIZE, BatchBuffer, decode_image
+from model_store import fetch_artifact, file_sha256
+from postprocess import class_name_array, encode_predictions, top_k
+from tta import DEFAULT_VIEWS, needs_tta, tta_probs
+from tiling import load_for_tiling, needs_tiling, predict_tiles
 
 
 class LeafDiseaseChecker:
-    def __init__(self, model_path=None, idx_path=None, auto_dir=None, use_huggingface=True, repo_id="your-username/leaf-disease-detection"):
+    def __init__(self, model_path=None, idx_path=None, auto_dir=None, use_huggingface=True, repo_id="your-username/leaf-disease-detection", cache=None,
+                 cache_dir=None, offline=False, model_sha256=None, backend=None, model_filename=None, draft_decode=True,
+                 cascade_model=None, cascade_threshold=0.9, cascade_healthy_threshold=0.8,
+                 num_threads=None, max_inflight=None, revision=None, inflight=None):
         """
         Initialize the LeafDiseaseChecker
         
@@ -20,34 +30,69 @@ class LeafDiseaseChecker:
             auto_dir: Directory to auto-generate indices from
             use_huggingface: Whether to download model from Hugging Face
             repo_id: Hugging Face repository ID
+            cache: Optional PredictionCache shared by predict() and predict_top_k()
+            cache_dir: Persistent directory for downloaded artifacts (defaults to MODEL_CACHE_DIR)
+            offline: Only use verified artifacts already in cache_dir, never the network;
+                without model_sha256 the local model file is used when none is cached
+            model_sha256: Optional pinned checksum the model file must match
+            backend: Inference backend - 'keras', 'onnx' or 'tflite' (default: keras on
+                Hugging Face, otherwise from the model file extension)
+            model_filename: File to fetch from the Hugging Face repo, e.g. a quantized
+                'final_model_float16.tflite' (default: the backend's standard file name)
+            draft_decode: Decode JPEGs at reduced resolution (see preprocessing.decode_image)
+            cascade_model: Optional small router model answering confident images before
+                the full model (see cascade.CascadeRouter) - a local path, or a file
+                on the Hugging Face repo
+            cascade_threshold: Router confidence needed to skip the full model
+            cascade_healthy_threshold: Same, when the router predicts a healthy class
+            num_threads: Threads inside one forward pass (see runtime_config.py)
+            max_inflight: Forward passes allowed to run at once across all callers
+                (micro-batcher, batch uploads, jobs, TTA, tiles); None = unlimited
+            revision: Hugging Face branch, tag or commit to load (default: main)
+            inflight: Semaphore shared with other checkers in this process, used
+                instead of a private one of max_inflight slots
         """
         self.use_huggingface = use_huggingface
         self.repo_id = repo_id
+        self.cache = cache
+        self.draft_decode = draft_decode
+        self._batch = BatchBuffer()
+        if inflight is None and max_inflight:
+            inflight = threading.BoundedSemaphore(max_inflight)
+        self._inflight = inflight
+        self.num_threads = num_threads
         
+        model_digest = None
         if use_huggingface:
-            # Download model and indices from Hugging Face
-            print("Downloading model from Hugging Face...")
+            backend = backend or (backend_for_path(model_filename) if model_filename else 'keras')
+            model_filename = model_filename or MODEL_FILENAMES[backend]
+            # Download model and indices from Hugging Face (or reuse the verified cache)
+            print("Resolving model from Hugging Face cache...")
             try:
-                model_path = hf_hub_download(
-                    repo_id=repo_id,
-                    filename="final_model.h5",
-                    cache_dir=tempfile.gettempdir()
+                model_path, model_digest = fetch_artifact(
+                    repo_id, model_filename,
+                    cache_dir=cache_dir, offline=offline, expected_sha256=model_sha256, revision=revision
                 )
-                idx_path = hf_hub_download(
-                    repo_id=repo_id,
-                    filename="class_indices.json",
-                    cache_dir=tempfile.gettempdir()
+                idx_path, _ = fetch_artifact(
+                    repo_id, "class_indices.json",
+                    cache_dir=cache_dir, offline=offline, revision=revision
                 )
-                print("Model and indices downloaded successfully")
+                print("Model and indices ready")
             except Exception as e:
                 print(f"Failed to download from Hugging Face: {e}")
+                if model_sha256:
+                    # A pinned model must come from a verified copy, never an unchecked local file
+                    raise
                 print("Falling back to local files...")
                 # Fallback to local files
-                model_path = model_path or "final_model.h5"
+                model_path = model_path or model_filename
                 idx_path = idx_path or "class_indices.json"
         
         # Load model
-        self.model = load_model(model_path)
+        start = time.perf_counter()
+        self.backend = load_backend(model_path, backend or backend_for_path(model_path), num_threads=num_threads)
+        self.model_version = (model_digest or file_sha256(model_path))[:16]
+        self.load_seconds = time.perf_counter() - start
 
         # Load class indices
         if idx_path and os.path.exists(idx_path):
@@ -59,6 +104,63 @@ class LeafDiseaseChecker:
             mapping = {}
 
         self.idx_to_class = {v: k for k, v in mapping.items()}
+        self.class_names = class_name_array(self.idx_to_class, self.backend.num_classes)
+        
+        self.router = None
+        if cascade_model:
+            self.router = self._load_router(
+                cascade_model, cascade_threshold, cascade_healthy_threshold,
+                cache_dir=cache_dir, offline=offline
+            )
+
+    def _load_router(self, router_model, threshold, healthy_threshold, cache_dir=None, offline=False):
+        start = time.perf_counter()
+        if os.path.exists(router_model) or not self.use_huggingface:
+            router_path, router_digest = router_model, None
+        else:
+            router_path, router_digest = fetch_artifact(
+                self.repo_id, router_model, cache_dir=cache_dir, offline=offline
+            )
+        backend = load_backend(router_path, backend_for_path(router_path), num_threads=self.num_threads)
+        if backend.num_classes != self.backend.num_classes:
+            raise ValueError(
+                f"Cascade model has {backend.num_classes} outputs, the full model {self.backend.num_classes}"
+            )
+        self.load_seconds += time.perf_counter() - start
+        
+        # Cascaded results differ from the full model's, so they get their own cache entries
+        tag = f"{router_digest or file_sha256(router_path)}:{threshold}:{healthy_threshold}"
+        self.model_version += '+' + hashlib.sha256(tag.encode()).hexdigest()[:8]
+        print(f"Cascade router loaded: {router_model} (threshold={threshold}, healthy_threshold={healthy_threshold})")
+        return CascadeRouter(backend, self.class_names, threshold, healthy_threshold)
+
+    def warmup(self, batch_sizes=(1,), size=IMAGE_SIZE):
+        """Run dummy forward passes so the first real request doesn't pay for graph tracing"""
+        start = time.perf_counter()
+        for n in batch_sizes:
+            batch = np.zeros((n, size[0], size[1], 3), dtype=np.float32)
+            self.backend.predict(batch)
+            if self.router is not None:
+                self.router.backend.predict(batch)
+        return time.perf_counter() - start
+
+    def cached(self, data, kind, compute):
+        """
+        Return the cached result for these image bytes, or compute and store it
+        
+        Args:
+            data: Raw image bytes used for the content hash
+            kind: Distinguishes result shapes, e.g. 'predict' or 'top_k:3'
+            compute: Zero-argument callable producing the result on a miss
+        """
+        if self.cache is None:
+            return compute()
+        key = self.cache.make_key(data, self.model_version, kind)
+        result = self.cache.get(key)
+        if result is None:
+            result = compute()
+            self.cache.put(key, result)
+        return result
 
     def _make_indices(self, data_dir):
         classes = sorted([
@@ -67,78 +169,160 @@ class LeafDiseaseChecker:
         ])
         return {c: i for i, c in enumerate(classes)}
 
-    def predict(self, img_path):
-        img = load_img(img_path, target_size=(256, 256))  # Changed from 224 to 256
-        img_array = img_to_array(img)
-        img_array = np.expand_dims(img_array, axis=0)
-        img_array = preprocess_input(img_array)
-
-        pred = self.model.predict(img_array)
-        pred_idx = np.argmax(pred)
-        pred_prob = np.max(pred)
+    def preprocess(self, img_path, size=IMAGE_SIZE):
+        """Load an image from disk and return a preprocessed (H, W, 3) array"""
+        return decode_image(img_path, size, draft=self.draft_decode)
 
-        pred_class = self.idx_to_class.get(pred_idx, f"class_{pred_idx}")
-
-        return {
-            'predicted_class': pred_class,
-            'confidence': float(pred_prob),
-            'all_predictions': {
-                self.idx_to_class.get(i, f"class_{i}"): float(prob)
-                for i, prob in enumerate(pred[0])
-            }
-        }
-
-    def predict_top_k(self, img_path, k=3):
-        img = load_img(img_path, target_size=(256, 256))  # Changed from 224 to 256
-        img_array = img_to_array(img)
-        img_array = np.expand_dims(img_array, axis=0)
-        img_array = preprocess_input(img_array)
-
-        pred = self.model.predict(img_array)
-        top_k_idx = np.argsort(pred[0])[::-1][:k]
-
-        results = []
-        for idx in top_k_idx:
-            class_name = self.idx_to_class.get(idx, f"class_{idx}")
-            confidence = float(pred[0][idx])
-            results.append({
-                'class': class_name,
-                'confidence': confidence
-            })
+    def preprocess_bytes(self, data, size=IMAGE_SIZE):
+        """
+        Decode and resize an image entirely in memory
+        
+        Args:
+            data: Raw image bytes or a file-like object (e.g. a Flask upload stream)
+            size: Target (height, width) fed to the model
+        
+        Returns:
+            A preprocessed (H, W, 3) array, same as preprocess()
+        """
+        if hasattr(data, 'read'):
+            data = data.read()
+        return decode_image(data, size, draft=self.draft_decode)
 
-        return results
+    def predict_bytes(self, data, mode='full', k=5):
+        if hasattr(data, 'read'):
+            data = data.read()
+        probs = self.cached(
+            data, 'probs',
+            lambda: self.predict_probs([self.preprocess_bytes(data)])[0].tolist()
+        )
+        return self.format_predictions([probs], mode, k)[0]
 
-    def visualize_prediction(self, img_path, save_path=None):
-        results = self.predict_top_k(img_path, k=5)
+    def predict_probs(self, arrays):
+        """
+        Run a single forward pass over several preprocessed images
         
-        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12, 5))
+        With a cascade router loaded, only the images it is unsure about go
+        through the full model.
         
-        # Display image
-        img = load_img(img_path)
-        ax1.imshow(img)
-        ax1.set_title('Input Image')
-        ax1.axis('off')
+        Args:
+            arrays: Sequence of arrays as returned by preprocess()
         
-        # Display predictions
-        classes = [r['class'] for r in results]
-        confidences = [r['confidence'] for r in results]
+        Returns:
+            (N, num_classes) array of probabilities, in input order
+        """
+        batch = self._batch.stack(arrays)
+        with self._inference_slot():
+            if self.router is not None:
+                return self.router.predict(batch, self._full_predict)
+            return self._full_predict(batch)
+
+    @contextmanager
+    def _inference_slot(self):
+        """Hold one of max_inflight forward-pass slots, so concurrent callers don't oversubscribe the CPUs"""
+        if self._inflight is None:
+            yield
+            return
+        with span('inference_wait'):
+            self._inflight.acquire()
+        try:
+            yield
+        finally:
+            self._inflight.release()
+
+    def predict_with_embeddings(self, arrays):
+        """
+        Probabilities and penultimate-layer embeddings in a single forward pass
         
-        y_pos = np.arange(len(classes))
-        bars = ax2.barh(y_pos, confidences)
-        ax2.set_yticks(y_pos)
-        ax2.set_yticklabels(classes)
-        ax2.set_xlabel('Confidence')
-        ax2.set_title('Top 5 Predictions')
-        ax2.set_xlim(0, 1)
+        Always runs the full model (the cascade router has no comparable
+        embedding). Only the Keras backend exposes the embedding layer.
         
-        # Add confidence values on bars
-        for i, (bar, conf) in enumerate(zip(bars, confidences)):
-            ax2.text(bar.get_width() + 0.01, bar.get_y() + bar.get_height()/2, 
-                    f'{conf:.3f}', va='center')
+        Returns:
+            ((N, num_classes) probabilities, (N, embedding_dim) embeddings)
+        """
+        if not hasattr(self.backend, 'predict_with_embeddings'):
+            raise NotImplementedError(f"The {self.backend.name} backend does not expose embeddings")
+        batch = self._batch.stack(arrays)
+        with self._inference_slot(), span('model'):
+            return self.backend.predict_with_embeddings(batch)
+
+    def _full_predict(self, batch):
+        with span('model'):
+            return self.backend.predict(batch)
+
+    def format_predictions(self, probs, mode='full', k=5):
+        """Encode probability rows as response dicts (see postprocess.RESPONSE_MODES)"""
+        return encode_predictions(probs, self.class_names, mode, k)
+
+    def predict_batch(self, arrays, mode='full', k=5):
+        """One forward pass over several preprocessed images, one result dict per input"""
+        return self.format_predictions(self.predict_probs(arrays), mode, k)
+
+    def _probs_for_path(self, img_path):
+        if self.cache is None:
+            return self.predict_probs([self.preprocess(img_path)])[0]
+        with open(img_path, 'rb') as f:
+            data = f.read()
+        return self.cached(
+            data, 'probs',
+            lambda: self.predict_probs([self.preprocess_bytes(data)])[0].tolist()
+        )
+
+    def predict_tta(self, array, views=DEFAULT_VIEWS, base_probs=None):
+        """Probabilities averaged over augmented views in one forward pass (see tta.py)"""
+        return tta_probs(self.predict_probs, array, views, base_probs)
+
+    def predict_tiled(self, source, overlap=0.25, min_green=0.15, aggregate='mean', max_side=2048, batch_size=16):
+        """
+        Classify a large photo from overlapping 256 px tiles (see tiling.predict_tiles)
         
-        plt.tight_layout()
+        Args:
+            source: Image path, bytes or file-like object
+            max_side: The image is first scaled down to at most this long side
         
-        if save_path:
-            plt.savefig(save_path, dpi=150, bbox_inches='tight')
+        Returns:
+            (probs, tiles) - probs is None when the image is too small to tile
+            or has no leaf-coloured tiles; tiles is None when it was not tiled
+        """
+        img = load_for_tiling(source, max_side)
+        if not needs_tiling(img.size):
+            return None, None
+        return predict_tiles(
+            self.predict_probs, img, self.class_names,
+            overlap=overlap, min_green=min_green, batch_size=batch_size, aggregate=aggregate
+        )
+
+    def predict(self, img_path, mode='full', k=5, tta=None, tta_threshold=None, tiled=False):
+        """
+        Classify an image file
         
-        return fig
+        Args:
+            tiled: Classify a large photo from overlapping tiles instead of one
+                downscaled view; the result gets a 'tiles' heatmap (see predict_tiled)
+            tta: True for the default test-time augmentation views, or a list of
+                tta.VIEWS names; off by default
+            tta_threshold: Only run TTA when the plain prediction's confidence
+                is below this (None = always)
+        """
+        if tiled:
+            probs, tiles = self.predict_tiled(img_path)
+            if probs is not None:
+                result = self.format_predictions([probs], mode, k)[0]
+                result['tiles'] = tiles
+                return result
+        probs = self._probs_for_path(img_path)
+        if tta and needs_tta(probs, tta_threshold):
+            views = DEFAULT_VIEWS if tta is True else tta
+            probs = self.predict_tta(self.preprocess(img_path), views, base_probs=probs)
+        return self.format_predictions([probs], mode, k)[0]
+
+    def predict_top_k(self, img_path, k=3):
+        idx, vals = top_k([self._probs_for_path(img_path)], k)
+        return [
+            {'class': self.class_names[i], 'confidence': float(p)}
+            for i, p in zip(idx[0], vals[0])
+        ]
+
+    def visualize_prediction(self, img_path, save_path=None):
+        # matplotlib is optional and only imported when plotting
+        from plotting import visualize_prediction
+        return visualize_prediction(self, img_path, save_path)
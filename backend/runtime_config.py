@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+CPU threading and inference concurrency settings
+
+Sizes TensorFlow's intra/inter-op thread pools, OpenMP (which oneDNN uses),
+the decode pool and the number of forward passes allowed in flight from
+the CPUs this container may actually use - its cgroup CPU quota and CPU
+affinity, not the host's core count. A JSON file written by `autotune`
+replaces the derived values, and environment variables override both.
+
+Usage:
+    python runtime_config.py show
+    python runtime_config.py autotune --model final_model.h5 --output runtime_config.json
+    python runtime_config.py autotune --model final_model.h5 --requests 200
+"""
+
+import os
+import sys
+import json
+import math
+import argparse
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Setting -> environment variable that overrides it
+ENV_OVERRIDES = {
+    'intra_op_threads': 'TF_NUM_INTRAOP_THREADS',
+    'inter_op_threads': 'TF_NUM_INTEROP_THREADS',
+    'decode_workers': 'DECODE_WORKERS',
+    'max_inflight': 'MAX_INFLIGHT_INFERENCES'
+}
+
+AUTOTUNE_PROBE = """
+import sys, json, time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from run_hf import LeafDiseaseChecker
+
+model_path, idx_path, requests, concurrency = sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4])
+checker = LeafDiseaseChecker(
+    model_path=model_path, idx_path=idx_path, use_huggingface=False,
+    num_threads=int(sys.argv[5]), max_inflight=int(sys.argv[6])
+)
+data = [open(p, 'rb').read() for p in sys.argv[7:]]
+checker.warmup()
+
+def one(i):
+    start = time.perf_counter()
+    checker.predict_probs([checker.preprocess_bytes(data[i % len(data)])])
+    return time.perf_counter() - start
+
+with ThreadPoolExecutor(concurrency) as pool:
+    list(pool.map(one, range(concurrency)))
+    start = time.perf_counter()
+    latencies = list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+print('PROBE', json.dumps({
+    'images_per_second': requests / elapsed,
+    'p50_ms': float(np.percentile(latencies, 50)) * 1000.0,
+    'p95_ms': float(np.percentile(latencies, 95)) * 1000.0
+}))
+"""
+
+
+def _cgroup_quota():
+    """CPU quota of this container in CPUs, or None when unlimited"""
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        return None if quota == 'max' else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        # cgroup v1
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+        return None if quota <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus():
+    """CPUs this process can use: the cgroup quota, capped by CPU affinity"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = _cgroup_quota()
+    if quota is not None:
+        # A fractional quota is rounded down - extra threads would only be throttled
+        cpus = min(cpus, max(1, math.floor(quota)))
+    return cpus
+
+
+def derive(cpus):
+    """Default settings for a CPU budget: in-flight passes x intra-op threads ~ cpus"""
+    max_inflight = 1 if cpus < 4 else 2
+    return {
+        'cpus': cpus,
+        'intra_op_threads': max(1, cpus // max_inflight),
+        'inter_op_threads': 1 if cpus < 4 else 2,
+        'decode_workers': max(1, min(4, cpus // 2)),
+        'max_inflight': max_inflight
+    }
+
+
+def load_config(path=None):
+    """
+    Settings for this process: derived from the CPU budget, then a tuned
+    JSON file (RUNTIME_CONFIG, default runtime_config.json) if it exists,
+    then environment variables (see ENV_OVERRIDES)
+    """
+    config = derive(available_cpus())
+    config['source'] = 'derived'
+    path = path or os.environ.get('RUNTIME_CONFIG', 'runtime_config.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            tuned = json.load(f)
+        config.update({key: int(tuned[key]) for key in ENV_OVERRIDES if key in tuned})
+        config['source'] = path
+    for key, env in ENV_OVERRIDES.items():
+        if os.environ.get(env):
+            config[key] = int(os.environ[env])
+    return config
+
+
+def apply_environment(config):
+    """
+    Export thread settings read by TensorFlow, OpenMP and oneDNN when they
+    load, so this must run before they are imported. Variables that are
+    already set are left alone.
+    """
+    os.environ.setdefault('TF_NUM_INTRAOP_THREADS', str(config['intra_op_threads']))
+    os.environ.setdefault('TF_NUM_INTEROP_THREADS', str(config['inter_op_threads']))
+    os.environ.setdefault('OMP_NUM_THREADS', str(config['intra_op_threads']))
+    # Idle OpenMP threads sleep after 1 ms instead of spinning on cores the decoders need
+    os.environ.setdefault('KMP_BLOCKTIME', '1')
+
+
+def candidates(cpus):
+    """Settings swept by autotune: intra-op threads in powers of two up to cpus"""
+    intra = sorted({2 ** i for i in range(int(math.log2(cpus)) + 1)} | {cpus})
+    for threads in intra:
+        for inter in (1, 2):
+            config = dict(derive(cpus), intra_op_threads=threads, inter_op_threads=inter)
+            config['max_inflight'] = max(1, cpus // threads)
+            yield config
+
+
+def run_probe(config, model_path, paths, requests, concurrency):
+    """Load test one setting in a fresh interpreter (thread pools are fixed once TensorFlow starts)"""
+    env = dict(os.environ)
+    for name in ENV_OVERRIDES.values():
+        env.pop(name, None)
+    env.update({
+        'TF_NUM_INTRAOP_THREADS': str(config['intra_op_threads']),
+        'TF_NUM_INTEROP_THREADS': str(config['inter_op_threads']),
+        'OMP_NUM_THREADS': str(config['intra_op_threads']),
+        'KMP_BLOCKTIME': '1',
+        'TF_CPP_MIN_LOG_LEVEL': '2'
+    })
+    proc = subprocess.run(
+        [sys.executable, '-c', AUTOTUNE_PROBE, model_path, os.path.join(BACKEND_DIR, 'class_indices.json'),
+         str(requests), str(concurrency), str(config['intra_op_threads']), str(config['max_inflight'])] + paths,
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True
+    )
+    for line in proc.stdout.splitlines():
+        if line.startswith('PROBE '):
+            return json.loads(line[len('PROBE '):])
+    raise RuntimeError(f"Autotune probe failed:\n{proc.stderr[-2000:]}")
+
+
+def autotune(model_path, paths, requests=100, concurrency=8, cpus=None):
+    """
+    Sweep thread settings under concurrent load and pick the best
+
+    The winner has the highest throughput; settings within 5% of it are
+    ranked by p95 latency instead.
+
+    Returns:
+        (best config, every result)
+    """
+    cpus = cpus or available_cpus()
+    results = []
+    for config in candidates(cpus):
+        stats = run_probe(config, model_path, paths, requests, concurrency)
+        print(f"intra={config['intra_op_threads']} inter={config['inter_op_threads']} "
+              f"inflight={config['max_inflight']}: {stats['images_per_second']:.1f} img/s, "
+              f"p95 {stats['p95_ms']:.1f} ms")
+        results.append(dict(config, **{k: round(v, 3) for k, v in stats.items()}))
+    fastest = max(r['images_per_second'] for r in results)
+    best = min(
+        (r for r in results if r['images_per_second'] >= 0.95 * fastest),
+        key=lambda r: r['p95_ms']
+    )
+    return {key: best[key] for key in ['cpus'] + list(ENV_OVERRIDES)}, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show or tune CPU threading settings')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('show', help='Print the settings this process would use')
+    tune = sub.add_parser('autotune', help='Sweep settings on the sample images and write the best')
+    # Thread settings depend on the network, so only the production model is a meaningful target
+    tune.add_argument('--model', required=True, help='Model file served in production, e.g. final_model.h5')
+    tune.add_argument('--images', default=os.path.join(BACKEND_DIR, 'uploads'))
+    tune.add_argument('--requests', type=int, default=100, help='Requests timed per setting')
+    tune.add_argument('--concurrency', type=int, default=8, help='Concurrent clients (Gunicorn threads)')
+    tune.add_argument('--output', default='runtime_config.json')
+    args = parser.parse_args()
+
+    if args.command == 'show':
+        print(json.dumps(load_config(), indent=2))
+        return
+
+    if not os.path.exists(args.model):
+        sys.exit(f"Model not found: {args.model}")
+
+    from export_model import sample_images
+
+    paths = sample_images(args.images)
+    if not paths:
+        sys.exit(f"No images found in {args.images}")
+    best, results = autotune(os.path.abspath(args.model), paths, args.requests, args.concurrency)
+    with open(args.output, 'w') as f:
+        json.dump(dict(best, results=results), f, indent=2)
+    print(f"Best: {best}")
+    print(f"Wrote {args.output} - loaded at startup from RUNTIME_CONFIG (default runtime_config.json)")
+
+
+if __name__ == '__main__':
+    main()
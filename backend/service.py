@@ -0,0 +1,1088 @@
+"""
+Framework-independent core of the API, shared by app.py (Flask) and asgi.py
+
+Configuration, model state, the stores and every route's logic live here:
+request parsing helpers take a mapping of query parameters, operations take
+upload bytes and return the JSON payload, and failures are raised as
+ApiError carrying the HTTP status. The two entry points only read uploads,
+call these functions and turn the results into their own responses.
+"""
+
+import os
+import hmac
+import time
+import uuid
+import sqlite3
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+# Boot timestamp used for the time-to-healthy metric
+PROCESS_START = time.perf_counter()
+
+# Thread pools sized from the container's CPU quota; exported before numpy or
+# TensorFlow load so they pick the settings up - see runtime_config.py
+from runtime_config import apply_environment, load_config
+RUNTIME_CONFIG = load_config()
+apply_environment(RUNTIME_CONFIG)
+print(f"Runtime config: {RUNTIME_CONFIG}")
+
+from batching import MicroBatcher
+from cache import PredictionCache
+from postprocess import RESPONSE_MODES
+from cascade import PATHS as CASCADE_PATHS
+from tta import needs_tta, parse_views
+from tiling import AGGREGATIONS, load_for_tiling, needs_tiling, predict_tiles
+from batch_upload import expand_uploads
+from upload_guard import UploadRejected, check_image, check_stream, set_pixel_limit
+from jobs import JobStore, JobRunner, QueueFull
+from prediction_store import PredictionStore, query_options
+from similarity_index import SimilarityIndex
+from model_slots import TRAFFIC_MODES, ModelSlot, ModelSlots
+from metrics import registry, span, resident_memory_bytes, peak_memory_bytes
+
+# Shared inference process - when set, this worker sends tensors to it and never loads the model
+INFERENCE_SOCKET = os.environ.get('INFERENCE_SOCKET') or None
+
+# Start loading the model at worker boot rather than on the first request
+MODEL_EAGER_LOAD = os.environ.get('MODEL_EAGER_LOAD', '1').lower() not in ('0', 'false', 'no')
+
+# Model code (TensorFlow, huggingface_hub, ...) is imported by load_model_async in the
+# background, so the server answers health probes before the heavy dependencies load
+LeafDiseaseChecker = None
+USE_HUGGINGFACE = True
+
+
+def import_checker_class():
+    """Import the Hugging Face version first, fall back to local version"""
+    global LeafDiseaseChecker, USE_HUGGINGFACE
+
+    if LeafDiseaseChecker is not None:
+        return LeafDiseaseChecker
+    try:
+        from run_hf import LeafDiseaseChecker
+        print("Hugging Face version available")
+    except ImportError as e:
+        print(f"Hugging Face version not available: {e}")
+        try:
+            from run import LeafDiseaseChecker
+            USE_HUGGINGFACE = False
+            print("Using local version of LeafDiseaseChecker")
+        except ImportError as e2:
+            print(f"Both versions failed to import: {e2}")
+            print("The server will keep running without model - check logs for import errors")
+    return LeafDiseaseChecker
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400, reason=None, headers=None):
+        """
+        A request that can't be answered, turned into a JSON error response by the entry points
+
+        Args:
+            message: Returned as 'error'
+            status: HTTP status code
+            reason: Optional machine-readable cause, returned as 'reason'
+            headers: Optional extra response headers, e.g. Retry-After
+        """
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+        self.headers = headers or {}
+
+    def body(self):
+        body = {'error': str(self)}
+        if self.reason is not None:
+            body['reason'] = self.reason
+        return body
+
+
+# Configuration for Hugging Face model (ONLY)
+HF_REPO_ID = os.environ.get('HF_REPO_ID', 'rishabh914/leaf-disease-detection')
+
+print(f"Using ONLY Hugging Face model: {HF_REPO_ID}")
+print(f"Current directory: {os.getcwd()}")
+print("Local files will be ignored")
+
+# Micro-batching configuration - concurrent /predict calls share one forward pass
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 8))
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', 10))
+
+# /predict/batch limits and the thread pool that decodes its images concurrently
+BATCH_UPLOAD_MAX_FILES = int(os.environ.get('BATCH_UPLOAD_MAX_FILES', 100))
+DECODE_WORKERS = RUNTIME_CONFIG['decode_workers']
+decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix='decode')
+
+# Test-time augmentation (?tta=1) only runs for predictions less confident than this
+TTA_CONFIDENCE_THRESHOLD = float(os.environ.get('TTA_CONFIDENCE_THRESHOLD', 0.9))
+
+# Tiled inference (?tiles=1) for drone and whole-plant photos - see tiling.py
+TILE_MAX_SIDE = int(os.environ.get('TILE_MAX_SIDE', 2048))
+TILE_MIN_GREEN = float(os.environ.get('TILE_MIN_GREEN', 0.15))
+
+# Asynchronous jobs - state and pending images live in SQLite so jobs survive restarts
+JOBS_DB = os.environ.get('JOBS_DB', 'jobs.sqlite3')
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 1))
+JOB_MAX_ACTIVE = int(os.environ.get('JOB_MAX_ACTIVE', 16))
+JOB_MAX_FILES = int(os.environ.get('JOB_MAX_FILES', 1000))
+job_runner = None
+
+# The stores create their files when opened, so they open on first use instead of
+# at import - importing app or asgi leaves the working directory untouched
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_store(name, factory):
+    """The store registered under name, created by factory() on first use"""
+    with _stores_lock:
+        if name not in _stores:
+            _stores[name] = factory()
+        return _stores[name]
+
+
+def get_job_store():
+    return open_store('jobs', lambda: JobStore(JOBS_DB))
+
+
+# Prediction history - appended in the background, queried through /predictions
+PREDICTIONS_DB = os.environ.get('PREDICTIONS_DB', 'predictions.sqlite3')
+
+
+def get_prediction_history():
+    return open_store('history', lambda: PredictionStore(PREDICTIONS_DB))
+
+
+# Similar confirmed cases - embeddings of labelled images, searched by /similar
+SIMILAR_INDEX_DIR = os.environ.get('SIMILAR_INDEX_DIR', 'similar_index')
+SIMILAR_NPROBE = int(os.environ.get('SIMILAR_NPROBE', 8))
+SIMILAR_TRAIN_SIZE = int(os.environ.get('SIMILAR_TRAIN_SIZE', 10000))
+
+
+def get_similar_cases():
+    return open_store(
+        'similar', lambda: SimilarityIndex(SIMILAR_INDEX_DIR, nprobe=SIMILAR_NPROBE, train_size=SIMILAR_TRAIN_SIZE)
+    )
+
+
+# Model version management (/models) - disabled unless an admin token is configured
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN') or None
+# Forward passes allowed at once across every loaded model version, so a candidate
+# next to the active model doesn't double the CPU concurrency runtime_config tuned for
+inference_limiter = threading.BoundedSemaphore(RUNTIME_CONFIG['max_inflight'])
+# Shadow predictions on a candidate model run here, off the request path. Each queued
+# one holds the image and the candidate, so past SHADOW_MAX_PENDING they are dropped.
+SHADOW_MAX_PENDING = int(os.environ.get('SHADOW_MAX_PENDING', 32))
+shadow_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='shadow')
+shadow_pending = threading.BoundedSemaphore(SHADOW_MAX_PENDING)
+
+# Upload guardrails - oversized bodies, non-images and decompression bombs are rejected
+# before they reach the decoder
+MAX_UPLOAD_BYTES = int(float(os.environ.get('MAX_UPLOAD_MB', 10)) * 1024 * 1024)
+BATCH_MAX_UPLOAD_BYTES = int(float(os.environ.get('BATCH_MAX_UPLOAD_MB', 200)) * 1024 * 1024)
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', 40_000_000))
+set_pixel_limit(MAX_IMAGE_PIXELS)
+
+# Prediction cache - repeated uploads of the same image skip the forward pass
+prediction_cache = PredictionCache(
+    max_entries=int(os.environ.get('PREDICTION_CACHE_SIZE', 1024)),
+    ttl_seconds=float(os.environ.get('PREDICTION_CACHE_TTL', 3600)),
+    disk_dir=os.environ.get('PREDICTION_CACHE_DIR') or None
+)
+
+# Model artifact cache - mount a volume at MODEL_CACHE_DIR so restarts skip the download
+MODEL_CACHE_DIR = os.environ.get('MODEL_CACHE_DIR') or None
+MODEL_OFFLINE = os.environ.get('MODEL_OFFLINE', '0').lower() in ('1', 'true', 'yes')
+MODEL_SHA256 = os.environ.get('MODEL_SHA256') or None
+# Inference runtime: keras (default), onnx or tflite - see export_model.py
+MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'keras')
+# Optional model file on the repo, e.g. a quantized final_model_float16.tflite - see quantize_model.py
+MODEL_FILENAME = os.environ.get('MODEL_FILENAME') or None
+# Reduced-resolution JPEG decoding - set to 0 for a full-resolution decode before resizing
+JPEG_DRAFT_DECODE = os.environ.get('JPEG_DRAFT_DECODE', '1').lower() not in ('0', 'false', 'no')
+# Optional small router model answering confident images before the full model - see cascade.py
+CASCADE_MODEL = os.environ.get('CASCADE_MODEL') or None
+CASCADE_THRESHOLD = float(os.environ.get('CASCADE_THRESHOLD', 0.9))
+CASCADE_HEALTHY_THRESHOLD = float(os.environ.get('CASCADE_HEALTHY_THRESHOLD', 0.8))
+
+# Initialize checker as None - will be loaded asynchronously
+checker = None
+batcher = None
+model_loading = False
+model_error = None
+startup_metrics = {}
+_load_lock = threading.Lock()
+
+# Gauges read at scrape time from the objects that already keep these numbers
+registry.set_gauge('leaf_model_loaded', lambda: int(checker is not None), 'Whether the model is ready to serve')
+registry.set_gauge('leaf_model_load_seconds', lambda: startup_metrics.get('model_load_seconds'), 'Time spent loading the model')
+registry.set_gauge('leaf_model_warmup_seconds', lambda: startup_metrics.get('warmup_seconds'), 'Time spent on warm-up forward passes')
+registry.set_gauge('leaf_time_to_healthy_seconds', lambda: startup_metrics.get('time_to_healthy_seconds'), 'Process start until the model was ready')
+registry.set_gauge('leaf_process_resident_memory_bytes', resident_memory_bytes, 'Resident memory of this process')
+registry.set_gauge('leaf_process_peak_memory_bytes', peak_memory_bytes, 'Peak resident memory of this process')
+registry.set_gauge('leaf_batch_queue_depth', lambda: batcher.stats()['queue_depth'] if batcher else None, 'Requests waiting for a forward pass')
+registry.set_counter('leaf_batches_total', lambda: batcher.stats()['batches'] if batcher else None, 'Forward passes run by the micro-batcher')
+for outcome in ('hits', 'disk_hits', 'misses'):
+    registry.set_counter(
+        'leaf_prediction_cache_lookups_total',
+        lambda outcome=outcome: prediction_cache.stats()[outcome],
+        'Prediction cache lookups by outcome', outcome=outcome
+    )
+for path in CASCADE_PATHS:
+    registry.set_counter(
+        'leaf_cascade_images_total',
+        lambda path=path: cascade_stats()['images'][path] if cascade_stats() else None,
+        'Images answered by the cascade router (healthy/confident) or escalated to the full model', path=path
+    )
+registry.set_gauge('leaf_history_pending', lambda: get_prediction_history().stats()['pending'], 'Predictions waiting to be written to the history')
+registry.set_counter('leaf_history_dropped_total', lambda: get_prediction_history().stats()['dropped'], 'Predictions that could not be written to the history')
+
+
+def cascade_stats():
+    """Router path counts, or None without a cascade (or with a shared inference server)"""
+    router = getattr(checker, 'router', None)
+    return router.stats() if router is not None else None
+
+
+def build_slot(model_filename=None, revision=None, model_sha256=None, backend=None):
+    """
+    Load, warm up and start batching one model version
+
+    Arguments override MODEL_FILENAME, the repo's main revision, MODEL_SHA256
+    and MODEL_BACKEND, e.g. to bring up a candidate version next to the active one.
+    """
+    new_checker = import_checker_class()(
+        use_huggingface=True,
+        repo_id=HF_REPO_ID,
+        cache=prediction_cache,
+        cache_dir=MODEL_CACHE_DIR,
+        offline=MODEL_OFFLINE,
+        model_sha256=model_sha256 or MODEL_SHA256,
+        backend=backend or MODEL_BACKEND,
+        model_filename=model_filename or MODEL_FILENAME,
+        revision=revision,
+        draft_decode=JPEG_DRAFT_DECODE,
+        cascade_model=CASCADE_MODEL,
+        cascade_threshold=CASCADE_THRESHOLD,
+        cascade_healthy_threshold=CASCADE_HEALTHY_THRESHOLD,
+        num_threads=RUNTIME_CONFIG['intra_op_threads'],
+        inflight=inference_limiter
+    )
+    # Trace the graph for both single requests and full batches before serving
+    warmup_seconds = new_checker.warmup(batch_sizes=sorted({1, BATCH_MAX_SIZE}))
+    new_batcher = MicroBatcher(
+        new_checker.predict_probs,
+        max_batch_size=BATCH_MAX_SIZE,
+        max_wait_ms=BATCH_MAX_WAIT_MS
+    )
+    return ModelSlot(new_checker, new_batcher, warmup_seconds)
+
+
+def activate_slot(slot):
+    """Point checker/batcher (readiness checks, /health and metrics) at the new active version"""
+    global checker, batcher
+    checker, batcher = slot.checker, slot.batcher
+
+
+# Versioned model slots - candidates load in the background, then swap in atomically
+model_slots = ModelSlots(on_activate=activate_slot)
+
+
+@contextmanager
+def held_slot(route=True):
+    """
+    Hold a model slot while the block runs, so a swapped-out version isn't unloaded under it
+
+    Args:
+        route: Pick the slot the way /predict does, so a split candidate serves
+            its share (shadow runs are skipped); False always holds the active
+            version, e.g. for embeddings that must match the similar-case index
+    """
+    if route:
+        slot, shadow = model_slots.route()
+        if shadow is not None:
+            shadow.release()
+    else:
+        slot = model_slots.acquire_active()
+    try:
+        yield slot
+    finally:
+        slot.release()
+
+
+def load_model_async():
+    """Load model asynchronously to avoid blocking server startup"""
+    global checker, job_runner, model_loading, model_error
+
+    with _load_lock:
+        if checker is not None or model_loading:
+            return
+
+        model_loading = True
+
+    try:
+        if INFERENCE_SOCKET:
+            from inference_server import InferenceClient
+
+            # The inference server loads, warms up and batches for every worker
+            print(f"Connecting to inference server: {INFERENCE_SOCKET}")
+            client = InferenceClient(INFERENCE_SOCKET, cache=prediction_cache, draft_decode=JPEG_DRAFT_DECODE)
+            slot = ModelSlot(client, client, client.warmup())
+        else:
+            import_start = time.perf_counter()
+            checker_class = import_checker_class()
+            if checker_class is None:
+                raise RuntimeError("LeafDiseaseChecker class not available - import failed")
+            startup_metrics['model_import_seconds'] = round(time.perf_counter() - import_start, 3)
+
+            print(f"Loading model from Hugging Face: {HF_REPO_ID}")
+            slot = build_slot()
+        # Sets checker and batcher through activate_slot
+        model_slots.set_active(slot)
+        new_checker, warmup_seconds = slot.checker, slot.warmup_seconds
+        if job_runner is None:
+            # Jobs submitted while the model was loading start draining now
+            job_runner = JobRunner(
+                get_job_store(), classify_images,
+                workers=JOB_WORKERS, chunk_size=BATCH_MAX_SIZE, max_active=JOB_MAX_ACTIVE
+            )
+            job_runner.start()
+        startup_metrics.update({
+            'model_load_seconds': round(new_checker.load_seconds, 3),
+            'warmup_seconds': round(warmup_seconds, 3),
+            'time_to_healthy_seconds': round(time.perf_counter() - PROCESS_START, 3)
+        })
+        print("Hugging Face model loaded successfully")
+        print(f"Micro-batching enabled: max_batch_size={BATCH_MAX_SIZE}, max_wait_ms={BATCH_MAX_WAIT_MS}")
+        print(f"Startup metrics: {startup_metrics}")
+        model_error = None
+    except Exception as e:
+        print(f"Failed to load Hugging Face model: {e}")
+        print("Make sure you have internet connection and the repo ID is correct")
+        model_error = str(e)
+        checker = None
+    finally:
+        model_loading = False
+
+
+def ensure_model_loading(submit=None):
+    """
+    Start load_model_async unless the model is loaded or loading
+
+    Args:
+        submit: Runs the loader, e.g. an executor's submit (default: a new daemon thread)
+    """
+    if checker is None and not model_loading:
+        if submit is None:
+            threading.Thread(target=load_model_async, daemon=True).start()
+        else:
+            submit(load_model_async)
+
+
+def health():
+    """Health payload - always served with HTTP 200, status is loading, error or healthy"""
+    if model_loading:
+        return {
+            'status': 'loading',
+            'message': 'Leaf Disease Detection API is loading model...',
+            'model_source': 'Hugging Face',
+            'hf_repo': HF_REPO_ID,
+            'version': '2.0'
+        }
+
+    if checker is None:
+        return {
+            'status': 'error',
+            'message': f'Model loading failed: {model_error}',
+            'model_source': 'Hugging Face',
+            'hf_repo': HF_REPO_ID,
+            'version': '2.0'
+        }
+
+    return {
+        'status': 'healthy',
+        'message': 'Leaf Disease Detection API is running',
+        'model_source': 'Hugging Face',
+        'hf_repo': HF_REPO_ID,
+        'version': '2.0',
+        'batching': batcher.stats(),
+        'cache': prediction_cache.stats(),
+        'history': get_prediction_history().stats(),
+        'cascade': cascade_stats(),
+        'similar_cases': get_similar_cases().stats(),
+        'models': model_slots.stats(),
+        'runtime': RUNTIME_CONFIG,
+        'startup': startup_metrics
+    }
+
+
+def require_model():
+    """Raise ApiError while the model can't serve requests"""
+    if model_loading:
+        raise ApiError('Model is still loading, please try again in a few moments', 503)
+    if checker is None:
+        raise ApiError(f'Model not loaded - {model_error or "check Hugging Face connection"}', 500)
+
+
+# Request parsing - `args` is the query string as a mapping (Flask request.args,
+# Starlette query_params)
+
+def response_options(args):
+    """Parse ?response=...&k=... into (mode, k)"""
+    # Response encoding: full (default), top_k, array or float16 - see postprocess.py
+    mode = args.get('response', 'full')
+    if mode not in RESPONSE_MODES:
+        raise ApiError(f"Invalid response mode, expected one of {', '.join(RESPONSE_MODES)}")
+    try:
+        k = int(args.get('k', 5))
+    except ValueError:
+        raise ApiError('k must be an integer')
+    return mode, k
+
+
+def tta_options(args):
+    """Parse ?tta=...&tta_threshold=... into (views, threshold)"""
+    try:
+        views = parse_views(args.get('tta'))
+        threshold = float(args.get('tta_threshold', TTA_CONFIDENCE_THRESHOLD))
+    except ValueError as e:
+        raise ApiError(f'Invalid TTA option: {str(e)}')
+    return views, threshold
+
+
+def tile_options(args):
+    """Parse ?tiles=1&tile_overlap=...&aggregate=... into (overlap or None, aggregate)"""
+    if args.get('tiles', '').lower() not in ('1', 'true', 'yes'):
+        return None, None
+    aggregate = args.get('aggregate', 'mean')
+    if aggregate not in AGGREGATIONS:
+        raise ApiError(f"Invalid aggregate, expected one of {', '.join(AGGREGATIONS)}")
+    try:
+        overlap = float(args.get('tile_overlap', 0.25))
+    except ValueError:
+        overlap = -1.0
+    if not 0.0 <= overlap <= 0.75:
+        raise ApiError('tile_overlap must be a number between 0 and 0.75')
+    return overlap, aggregate
+
+
+def predict_options(args):
+    """Every /predict query option, as keyword arguments for predict_image()"""
+    mode, k = response_options(args)
+    tta_views, tta_threshold = tta_options(args)
+    tile_overlap, tile_aggregate = tile_options(args)
+    if tta_views and tile_overlap is not None:
+        raise ApiError('tta and tiles cannot be combined')
+    return {
+        'mode': mode, 'k': k,
+        'tta_views': tta_views, 'tta_threshold': tta_threshold,
+        'tile_overlap': tile_overlap, 'tile_aggregate': tile_aggregate
+    }
+
+
+def page_options(args):
+    """Parse ?offset=&limit= for job results into (offset, limit)"""
+    try:
+        offset = max(0, int(args.get('offset', 0)))
+        limit = min(1000, max(1, int(args.get('limit', 100))))
+    except ValueError:
+        raise ApiError('offset and limit must be integers')
+    return offset, limit
+
+
+def history_options(args):
+    """Parse the /predictions filters into (filters, limit) - see prediction_store.query_options"""
+    try:
+        return query_options(args)
+    except ValueError as e:
+        raise ApiError(f'Invalid filter: {str(e)}')
+
+
+def traffic_options(options):
+    """Validate mode/percent from a JSON body into (mode, percent)"""
+    modes = TRAFFIC_MODES + ('promote',)
+    mode = options.get('mode', 'shadow')
+    if mode not in modes:
+        raise ApiError(f"mode must be one of {', '.join(modes)}")
+    try:
+        percent = float(options.get('percent', 10))
+    except (TypeError, ValueError):
+        raise ApiError('percent must be a number')
+    if not 0 <= percent <= 100:
+        raise ApiError('percent must be between 0 and 100')
+    return mode, percent
+
+
+def require_admin(authorization):
+    """Raise ApiError unless the Authorization header carries the admin bearer token"""
+    if ADMIN_TOKEN is None:
+        raise ApiError('Model management is disabled - set ADMIN_TOKEN to enable it', 404)
+    if not hmac.compare_digest((authorization or '').encode(), f'Bearer {ADMIN_TOKEN}'.encode()):
+        raise ApiError('Invalid or missing admin token', 401)
+
+
+# Upload checks
+
+def count_rejection(reason):
+    registry.inc('leaf_upload_rejections_total', 'Uploads rejected before decoding, by reason', reason=reason)
+
+
+def rejected(e):
+    """ApiError for an UploadRejected, counted by reason"""
+    count_rejection(e.reason)
+    return ApiError(str(e), e.status, reason=e.reason)
+
+
+def check_upload_headers(content_length, content_type, limit):
+    """Refuse oversized or non-multipart uploads from the headers, before the body is read"""
+    if content_length is not None and content_length > limit:
+        raise rejected(UploadRejected('too_large', f'Upload is larger than {limit // (1024 * 1024)} MB', 413))
+    if not (content_type or '').startswith('multipart/form-data'):
+        raise rejected(UploadRejected('bad_content_type', 'Uploads must be sent as multipart/form-data', 415))
+
+
+def read_upload(stream):
+    """
+    The checked bytes of one uploaded image
+
+    Args:
+        stream: Seekable file object of the spooled upload
+    """
+    try:
+        # Sniff and size-check the spooled upload before reading it into memory
+        check_stream(stream, MAX_UPLOAD_BYTES)
+        # Decode the upload in memory - the request path never touches disk
+        with span('upload'):
+            data = stream.read()
+        # Dimensions come from the header - no pixels are decoded for a rejected image
+        check_image(data, MAX_IMAGE_PIXELS)
+    except UploadRejected as e:
+        raise rejected(e)
+    return data
+
+
+def read_archive_uploads(uploads, max_files):
+    """Expand (filename, bytes) uploads, unpacking zip/tar archives, into checked-size items"""
+    try:
+        with span('upload'):
+            return expand_uploads(uploads, max_files, BATCH_MAX_UPLOAD_BYTES)
+    except ValueError as e:
+        raise ApiError(str(e))
+    except Exception as e:
+        raise ApiError(f'Could not read upload: {str(e)}')
+
+
+# Inference
+
+def embed_image(data, model):
+    """Probabilities and embedding for image bytes from one forward pass of model, cached together"""
+    def compute():
+        array = model.preprocess_bytes(data)
+        with span('inference'):
+            probs, embeddings = model.predict_with_embeddings([array])
+        return {'probs': probs[0].tolist(), 'embedding': embeddings[0].tolist()}
+    return model.cached(data, 'embedding', compute)
+
+
+def tile_image(data, overlap, aggregate, model=None):
+    """
+    Tiled probabilities and heatmap for image bytes, cached per tiling setting
+
+    model is the checker to run (default: the active one).
+
+    Returns:
+        (probs, tiles) - probs is None for images too small to tile or
+        without leaf-coloured tiles, and tiles is None when not tiled
+    """
+    model = model or checker
+
+    def compute():
+        img = load_for_tiling(data, TILE_MAX_SIDE)
+        if not needs_tiling(img.size):
+            return {'probs': None, 'tiles': None}
+        with span('tiles'):
+            probs, tiles = predict_tiles(
+                model.predict_probs, img, model.class_names,
+                overlap=overlap, min_green=TILE_MIN_GREEN, batch_size=BATCH_MAX_SIZE, aggregate=aggregate
+            )
+        return {'probs': probs.tolist() if probs is not None else None, 'tiles': tiles}
+    entry = model.cached(data, f'tiles:{TILE_MAX_SIDE}:{TILE_MIN_GREEN}:{overlap}:{aggregate}', compute)
+    return entry['probs'], entry['tiles']
+
+
+def classify_images(datas, model=None):
+    """
+    Classify a list of image bytes, using the cache and batched forward passes
+
+    model is the checker to run (default: a routed slot's, held meanwhile).
+
+    Returns:
+        (probs, errors) - per image, probs is a probability list or None and
+        errors holds the message for images that could not be classified
+    """
+    if model is None:
+        with held_slot() as slot:
+            return classify_images(datas, slot.checker)
+
+    probs = [None] * len(datas)
+    errors = [None] * len(datas)
+
+    # Cached images skip decoding entirely; the rest decode concurrently
+    keys = [None] * len(datas)
+    misses = []
+    for i, data in enumerate(datas):
+        try:
+            check_image(data, MAX_IMAGE_PIXELS)
+        except UploadRejected as e:
+            count_rejection(e.reason)
+            errors[i] = str(e)
+            continue
+        if model.cache is not None:
+            keys[i] = model.cache.make_key(data, model.model_version, 'probs')
+            probs[i] = model.cache.get(keys[i])
+        if probs[i] is None:
+            misses.append(i)
+
+    decoded = [(i, decode_pool.submit(model.preprocess_bytes, datas[i])) for i in misses]
+    ready = []
+    with span('decode_wait'):
+        for i, future in decoded:
+            try:
+                ready.append((i, future.result()))
+            except Exception as e:
+                errors[i] = f'Could not decode image: {str(e)}'
+
+    # Run the decoded images through the model in fixed-size batches
+    for start in range(0, len(ready), BATCH_MAX_SIZE):
+        chunk = ready[start:start + BATCH_MAX_SIZE]
+        try:
+            chunk_probs = model.predict_probs([array for _, array in chunk])
+        except Exception as e:
+            print(f"Batch prediction error: {e}")
+            for i, _ in chunk:
+                errors[i] = f'Prediction failed: {str(e)}'
+            continue
+        for (i, _), row in zip(chunk, chunk_probs):
+            probs[i] = row.tolist()
+            if keys[i] is not None:
+                model.cache.put(keys[i], probs[i])
+
+    return probs, errors
+
+
+def record_predictions(entries, model):
+    """
+    Queue (request_id, filename, probs) entries for the prediction history
+
+    The top 5 classes are kept with each record whatever the response mode was.
+    model is the checker that produced them.
+    """
+    summaries = model.format_predictions([probs for _, _, probs in entries], 'top_k', 5)
+    for (request_id, filename, _), summary in zip(entries, summaries):
+        get_prediction_history().add(
+            request_id, summary,
+            filename=filename,
+            model_version=model.model_version,
+            top_k=summary['top_k']
+        )
+
+
+def shadow_compare(slot, data, probs):
+    """Re-run a served image on the candidate slot and count whether the top class agrees"""
+    if not shadow_pending.acquire(blocking=False):
+        # The candidate is falling behind - skip this comparison rather than queue it
+        registry.inc('leaf_shadow_dropped_total', 'Shadow predictions skipped because the queue was full')
+        slot.release()
+        return
+
+    def run():
+        try:
+            start = time.perf_counter()
+            shadow_probs = slot.batcher.submit(slot.checker.preprocess_bytes(data))
+            slot.observe(time.perf_counter() - start)
+            model_slots.record_agreement(slot, int(shadow_probs.argmax()) == probs.index(max(probs)))
+        except Exception as e:
+            print(f"Shadow prediction failed on {slot.version}: {e}")
+        finally:
+            slot.release()
+            shadow_pending.release()
+    try:
+        shadow_pool.submit(run)
+    except RuntimeError:
+        slot.release()
+        shadow_pending.release()
+
+
+# Route operations - each returns the JSON payload of a successful response
+
+def predict_image(data, filename, mode='full', k=5, tta_views=(), tta_threshold=TTA_CONFIDENCE_THRESHOLD,
+                  tile_overlap=None, tile_aggregate='mean'):
+    """Diagnose one uploaded image (POST /predict), options as parsed by predict_options()"""
+    require_model()
+    # The request stays on one model version even if another is swapped in meanwhile
+    slot, shadow = model_slots.route()
+    model = slot.checker
+    start = time.perf_counter()
+    try:
+        decoded = {}
+
+        def infer():
+            array = decoded['array'] = model.preprocess_bytes(data)
+            # Queue wait plus the batched forward pass
+            with span('inference'):
+                return slot.batcher.submit(array).tolist()
+
+        probs = tiles = None
+        if tile_overlap is not None:
+            # Large photos are classified from tiles; small ones fall through to one view
+            probs, tiles = tile_image(data, tile_overlap, tile_aggregate, model)
+        if probs is None:
+            # Probabilities are cached per image, so every response mode shares one entry
+            probs = model.cached(data, 'probs', infer)
+
+        tta = None
+        if tta_views:
+            # Confident predictions skip augmentation; the rest run every view in one batch
+            tta = {'applied': needs_tta(probs, tta_threshold), 'views': list(tta_views), 'base_confidence': max(probs)}
+            if tta['applied']:
+                def augment():
+                    array = decoded.get('array')
+                    if array is None:
+                        array = model.preprocess_bytes(data)
+                    with span('tta'):
+                        return model.predict_tta(array, tta_views, base_probs=probs).tolist()
+                probs = model.cached(data, f"tta:{','.join(tta_views)}", augment)
+
+        with span('postprocess'):
+            result = model.format_predictions([probs], mode, k)[0]
+
+        request_id = uuid.uuid4().hex
+        with span('history'):
+            record_predictions([(request_id, filename, probs)], model)
+        slot.observe(time.perf_counter() - start)
+        if shadow is not None and tiles is None and tta is None:
+            shadow_compare(shadow, data, probs)
+            shadow = None
+
+        response = {
+            'success': True,
+            'request_id': request_id,
+            'prediction': result,
+            'model_version': model.model_version,
+            'model_source': 'Hugging Face',
+            'hf_repo': HF_REPO_ID
+        }
+        if tta is not None:
+            response['tta'] = tta
+        if tiles is not None:
+            response['tiles'] = tiles
+        return response
+
+    except Exception as e:
+        print(f"Prediction error: {e}")
+        raise ApiError(f'Prediction failed: {str(e)}', 500)
+    finally:
+        slot.release()
+        if shadow is not None:
+            shadow.release()
+
+
+def predict_batch(items, mode='full', k=5):
+    """Classify many (filename, bytes) images in one request (POST /predict/batch)"""
+    require_model()
+    with held_slot() as slot:
+        model = slot.checker
+        probs, errors = classify_images([data for _, data in items], model)
+
+        done = [i for i, p in enumerate(probs) if p is not None]
+        formatted = dict(zip(done, model.format_predictions([probs[i] for i in done], mode, k))) if done else {}
+
+        request_ids = {i: uuid.uuid4().hex for i in done}
+        if done:
+            record_predictions([(request_ids[i], items[i][0], probs[i]) for i in done], model)
+
+    results = []
+    for i, (name, _) in enumerate(items):
+        if i in formatted:
+            results.append({'filename': name, 'success': True, 'request_id': request_ids[i], 'prediction': formatted[i]})
+        else:
+            results.append({'filename': name, 'success': False, 'error': errors[i]})
+
+    return {
+        'success': True,
+        'count': len(results),
+        'failed': sum(1 for r in results if not r['success']),
+        'results': results,
+        'model_source': 'Hugging Face',
+        'hf_repo': HF_REPO_ID
+    }
+
+
+def format_job_results(job, rows):
+    done = [r for r in rows if r['probs'] is not None]
+    formatted = []
+    if done:
+        with held_slot(route=False) as slot:
+            formatted = slot.checker.format_predictions([r['probs'] for r in done], job['mode'], job['k'])
+    by_idx = dict(zip([r['idx'] for r in done], formatted))
+    results = []
+    for r in rows:
+        if r['idx'] in by_idx:
+            results.append({'index': r['idx'], 'filename': r['filename'], 'success': True, 'prediction': by_idx[r['idx']]})
+        else:
+            results.append({'index': r['idx'], 'filename': r['filename'], 'success': False, 'error': r['error']})
+    return results
+
+
+def job_summary(job):
+    return {
+        'job_id': job['id'],
+        'status': job['status'],
+        'total': job['total'],
+        'completed': job['completed'],
+        'failed': job['failed'],
+        'error': job['error'],
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at']
+    }
+
+
+def submit_job(items, mode='full', k=5):
+    """Queue images for background classification (POST /jobs); answered with 202"""
+    try:
+        if job_runner is not None:
+            job_id = job_runner.submit(items, mode, k)
+        elif get_job_store().count_active() < JOB_MAX_ACTIVE:
+            # Model still loading - persist now, the runner picks it up once started
+            job_id = get_job_store().create(items, mode, k)
+        else:
+            raise QueueFull(f"{JOB_MAX_ACTIVE} jobs already queued or running")
+    except QueueFull as e:
+        raise ApiError(f'Job queue is full: {str(e)}, retry later', 429, headers={'Retry-After': '30'})
+
+    return {
+        'success': True,
+        'job_id': job_id,
+        'status': 'queued',
+        'total': len(items),
+        'status_url': f'/jobs/{job_id}',
+        'stream_url': f'/jobs/{job_id}/stream'
+    }
+
+
+def get_job(job_id, args):
+    """
+    Job status plus finished results, paginated with ?offset=&limit= (GET /jobs/<id>)
+
+    Returns:
+        (payload, status) - 503 while finished results wait for the model to load
+    """
+    job = require_job(job_id)
+    offset, limit = page_options(args)
+
+    summary = job_summary(job)
+    rows = get_job_store().results(job_id, offset, limit)
+    if rows and checker is None:
+        summary['results'] = None
+        summary['message'] = 'Model is loading, results will be available shortly'
+        return summary, 503
+    summary['results'] = format_job_results(job, rows)
+    if len(rows) == limit:
+        summary['next_offset'] = rows[-1]['idx'] + 1
+    return summary, 200
+
+
+def require_job(job_id):
+    job = get_job_store().get(job_id)
+    if job is None:
+        raise ApiError('Job not found', 404)
+    return job
+
+
+def job_stream_step(job_id, offset):
+    """
+    Next part of a job's NDJSON stream (GET /jobs/<id>/stream)
+
+    Returns:
+        (lines, offset, finished) - wait a moment before the next call when
+        no lines came back and the job is not finished
+    """
+    job = get_job_store().get(job_id)
+    rows = get_job_store().results(job_id, offset, 100) if checker is not None else []
+    if rows:
+        return format_job_results(job, rows), rows[-1]['idx'] + 1, False
+    if job['status'] not in ('queued', 'running'):
+        return [job_summary(job)], offset, True
+    return [], offset, False
+
+
+def get_classes():
+    """Class names in model output order, for decoding array/float16 responses"""
+    if checker is None:
+        raise ApiError('Model not loaded yet', 503)
+    with held_slot(route=False) as slot:
+        return {
+            'classes': slot.checker.class_names.tolist(),
+            'model_version': slot.version
+        }
+
+
+def list_predictions(args):
+    """Prediction history, newest first (GET /predictions) - see history_options()"""
+    filters, limit = history_options(args)
+    try:
+        predictions = get_prediction_history().query(limit=limit, **filters)
+    except Exception as e:
+        raise ApiError(f'Failed to load predictions: {str(e)}', 500)
+
+    response = {
+        'success': True,
+        'count': len(predictions),
+        'predictions': predictions,
+        'model_source': 'Hugging Face',
+        'hf_repo': HF_REPO_ID
+    }
+    if len(predictions) == limit:
+        response['next_before'] = predictions[-1]['id']
+    return response
+
+
+def get_prediction(request_id):
+    """Look up one recorded prediction by the request_id returned from /predict"""
+    prediction = get_prediction_history().get(request_id)
+    if prediction is None:
+        raise ApiError('Prediction not found', 404)
+    return {'success': True, 'prediction': prediction}
+
+
+def similar_options(args):
+    """Parse ?k=&class= for /similar into (k, label)"""
+    try:
+        k = min(max(int(args.get('k', 5)), 1), 100)
+    except ValueError:
+        raise ApiError('k must be an integer')
+    return k, args.get('class') or None
+
+
+def find_similar(data, k=5, label=None):
+    """Diagnose an image and return the closest confirmed cases in the index (POST /similar)"""
+    require_model()
+    try:
+        # Always the active version: cases were embedded by it, a candidate's vectors wouldn't compare
+        with held_slot(route=False) as slot:
+            entry = embed_image(data, slot.checker)
+            prediction = slot.checker.format_predictions([entry['probs']], 'top_k', 3)[0]
+        with span('search'):
+            cases = get_similar_cases().search(entry['embedding'], k, label=label)
+        return {
+            'success': True,
+            'prediction': prediction,
+            'similar': cases,
+            'count': len(cases)
+        }
+    except NotImplementedError as e:
+        raise ApiError(str(e), 501)
+    except Exception as e:
+        print(f"Similar-case search error: {e}")
+        raise ApiError(f'Search failed: {str(e)}', 500)
+
+
+def add_similar_case(data, filename, label, case_id=None):
+    """Add an image plus the class an agronomist confirmed for it (POST /similar/cases); answered with 201"""
+    require_model()
+    # Embedded by the active version, like the cases already in the index
+    with held_slot(route=False) as slot:
+        if label not in set(slot.checker.class_names.tolist()):
+            raise ApiError('label must be one of the classes listed by /classes')
+        try:
+            entry = embed_image(data, slot.checker)
+            case_ids = get_similar_cases().add([entry['embedding']], [label], [filename], [case_id] if case_id else None)
+            return {'success': True, 'case_id': case_ids[0]}
+        except NotImplementedError as e:
+            raise ApiError(str(e), 501)
+        except sqlite3.IntegrityError:
+            raise ApiError('case_id already exists', 409)
+        except Exception as e:
+            print(f"Similar-case insert error: {e}")
+            raise ApiError(f'Could not add case: {str(e)}', 500)
+
+
+def load_candidate(options, mode, percent):
+    """Load and warm up a candidate version, then stage or promote it (runs in the background)"""
+    try:
+        slot = build_slot(
+            model_filename=options.get('filename'),
+            revision=options.get('revision'),
+            model_sha256=options.get('sha256'),
+            backend=options.get('backend')
+        )
+        if mode == 'promote':
+            model_slots.set_active(slot)
+        else:
+            model_slots.stage(slot, mode, percent)
+        print(f"Model {slot.version} loaded in the background ({mode})")
+        model_slots.error = None
+    except Exception as e:
+        print(f"Failed to load candidate model: {e}")
+        model_slots.error = str(e)
+    finally:
+        model_slots.loading = None
+
+
+def get_models():
+    """Active and candidate model versions with their traffic share and latency"""
+    return {'success': True, **model_slots.stats()}
+
+
+def add_candidate(options, submit=None):
+    """
+    Start loading another model version next to the active one (POST /models/candidate); answered with 202
+
+    options is the JSON body: filename, revision, sha256 and backend select the
+    artifact; mode is 'shadow' or 'split' (with percent of requests), or
+    'promote' to swap it in as soon as it is warm.
+
+    Args:
+        submit: Runs the loader (default: a new daemon thread)
+    """
+    if INFERENCE_SOCKET:
+        raise ApiError('Model versions are managed by the shared inference server', 409)
+    require_model()
+    mode, percent = traffic_options(options)
+    with _load_lock:
+        if model_slots.loading:
+            raise ApiError(f'Already loading {model_slots.loading}', 409)
+        model_slots.loading = options.get('filename') or options.get('revision') or 'model'
+    if submit is None:
+        threading.Thread(target=load_candidate, args=(options, mode, percent), daemon=True).start()
+    else:
+        submit(load_candidate, options, mode, percent)
+    return {'success': True, 'loading': model_slots.loading, 'mode': mode}
+
+
+def discard_candidate():
+    """Stop sending traffic to the candidate and unload it"""
+    slot = model_slots.discard()
+    if slot is None:
+        raise ApiError('No candidate model', 404)
+    return {'success': True, 'discarded': slot.version}
+
+
+def set_traffic(options):
+    """Change how the candidate is evaluated: {"mode": "shadow"|"split", "percent": 0-100}"""
+    mode, percent = traffic_options(options)
+    if model_slots.candidate is None:
+        raise ApiError('No candidate model', 404)
+    if mode == 'promote':
+        raise ApiError('Use /models/promote to promote the candidate')
+    model_slots.set_traffic(mode, percent)
+    return {'success': True, **model_slots.stats()}
+
+
+def promote_candidate():
+    """Swap the candidate in; requests in flight finish on the old version, which is then unloaded"""
+    try:
+        slot = model_slots.promote()
+    except ValueError as e:
+        raise ApiError(str(e), 404)
+    return {'success': True, 'active': slot.version}
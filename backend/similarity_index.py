@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Nearest-neighbour index of confirmed cases, on local disk
+
+Embeddings (the model's penultimate layer) are L2-normalised and appended
+as float16 rows to a memory-mapped file; case metadata lives in SQLite next
+to it. Small indexes are searched exhaustively. Once an index reaches
+train_size rows it is clustered into an inverted file (IVF): a query is
+compared with the cluster centroids and only the rows of the nprobe
+closest clusters are scored, so search stays in the milliseconds with
+millions of rows.
+
+Usage:
+    python similarity_index.py add similar_index/ dataset/train    # one folder per class
+    python similarity_index.py train similar_index/ --nlist 1024
+    python similarity_index.py stats similar_index/
+"""
+
+import os
+import sys
+import time
+import uuid
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cases (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    case_id TEXT NOT NULL UNIQUE,
+    label TEXT NOT NULL,
+    filename TEXT,
+    created_at REAL NOT NULL,
+    list_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_cases_list ON cases (list_id);
+CREATE TABLE IF NOT EXISTS index_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+VECTOR_DTYPE = np.float16
+# List of rows added before the index was trained, scanned by every query
+UNASSIGNED = -1
+
+
+def normalize(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def kmeans(vectors, k, iterations=10, seed=0):
+    """Spherical k-means on normalised vectors; returns (k, dim) unit centroids"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = (vectors @ centroids.T).argmax(axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        empty = np.bincount(assign, minlength=k) == 0
+        # Empty clusters restart from random points instead of collapsing
+        sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+class SimilarityIndex:
+    def __init__(self, directory, nprobe=8, train_size=10000):
+        """
+        Append-only float16 vector index with an IVF search structure
+
+        Safe to share between Gunicorn workers: SQLite assigns row numbers,
+        each row's vector is written at its own offset before the row is
+        committed, and every process picks up new rows on its next search.
+
+        Args:
+            directory: Holds cases.sqlite3, vectors.f16 and centroids.npy
+            nprobe: Clusters scanned per query once the index is trained
+            train_size: Rows after which the index clusters itself (once, in
+                the background); retrain larger indexes with the CLI
+        """
+        self.directory = directory
+        self.nprobe = nprobe
+        self.train_size = train_size
+        self.db_path = os.path.join(directory, 'cases.sqlite3')
+        self.vectors_path = os.path.join(directory, 'vectors.f16')
+        self.centroids_path = os.path.join(directory, 'centroids.npy')
+
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+        open(self.vectors_path, 'ab').close()
+
+        self._lock = threading.RLock()
+        self._dim = None
+        self._count = 0
+        self._vectors = None
+        self._generation = None
+        self._centroids = None
+        self._lists = {}      # list_id (or UNASSIGNED) -> row indices
+        self._training = False
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _meta(conn, key):
+        row = conn.execute('SELECT value FROM index_meta WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else None
+
+    def _load_centroids(self, conn):
+        generation = self._meta(conn, 'generation')
+        if generation != self._generation:
+            self._centroids = np.load(self.centroids_path) if generation else None
+            self._generation = generation
+            # Every row may have moved to another list; rebuild them from scratch
+            self._count = 0
+            self._lists = {}
+        return self._centroids
+
+    def _refresh(self):
+        """Pick up rows committed since the last call, by this or another process"""
+        with self._connect() as conn:
+            self._load_centroids(conn)
+            if self._dim is None:
+                dim = self._meta(conn, 'dim')
+                self._dim = int(dim) if dim else None
+            rows = conn.execute(
+                'SELECT id, list_id FROM cases WHERE id > ? ORDER BY id', (self._count,)
+            ).fetchall()
+        if not rows:
+            return
+        ids = np.array([r['id'] for r in rows], dtype=np.int64) - 1
+        lists = np.array([UNASSIGNED if r['list_id'] is None else r['list_id'] for r in rows], dtype=np.int64)
+        order = np.argsort(lists, kind='stable')
+        list_ids, starts = np.unique(lists[order], return_index=True)
+        for list_id, new in zip(list_ids.tolist(), np.split(ids[order], starts[1:])):
+            old = self._lists.get(list_id)
+            self._lists[list_id] = new if old is None else np.concatenate([old, new])
+        self._count = int(ids[-1]) + 1
+        self._vectors = np.memmap(self.vectors_path, dtype=VECTOR_DTYPE, mode='r', shape=(self._count, self._dim))
+
+    def add(self, embeddings, labels, filenames=None, case_ids=None):
+        """
+        Store confirmed cases
+
+        Args:
+            embeddings: (N, dim) embeddings, e.g. from LeafDiseaseChecker.predict_with_embeddings
+            labels: Confirmed class per case
+            filenames: Optional source file per case
+            case_ids: Optional unique IDs (default: random)
+
+        Returns:
+            The case IDs
+        """
+        vectors = normalize(embeddings).astype(VECTOR_DTYPE)
+        n, dim = vectors.shape
+        filenames = filenames or [None] * n
+        case_ids = case_ids or [uuid.uuid4().hex for _ in range(n)]
+        with self._lock, self._connect() as conn:
+            # Serialises writers across processes until COMMIT
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                stored_dim = self._meta(conn, 'dim')
+                if stored_dim is None:
+                    conn.execute("INSERT INTO index_meta VALUES ('dim', ?)", (str(dim),))
+                elif int(stored_dim) != dim:
+                    raise ValueError(f"Embeddings have {dim} dimensions, the index {stored_dim}")
+                centroids = self._load_centroids(conn)
+                list_ids = (vectors.astype(np.float32) @ centroids.T).argmax(axis=1).tolist() \
+                    if centroids is not None else [None] * n
+                now = time.time()
+                first = None
+                for case_id, label, filename, list_id in zip(case_ids, labels, filenames, list_ids):
+                    cursor = conn.execute(
+                        'INSERT INTO cases (case_id, label, filename, created_at, list_id) VALUES (?, ?, ?, ?, ?)',
+                        (case_id, label, filename, now, list_id)
+                    )
+                    first = cursor.lastrowid if first is None else first
+                # Rows are numbered consecutively inside the transaction
+                with open(self.vectors_path, 'r+b') as f:
+                    f.seek((first - 1) * dim * vectors.itemsize)
+                    f.write(vectors.tobytes())
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            total = first - 1 + n
+        if self._centroids is None and total >= self.train_size and not self._training:
+            self._training = True
+            threading.Thread(target=self._train_background, daemon=True).start()
+        return case_ids
+
+    def _train_background(self):
+        try:
+            self.train()
+        except Exception as e:
+            print(f"Similarity index training failed: {e}")
+        finally:
+            self._training = False
+
+    def train(self, nlist=None, sample_size=100000, iterations=10):
+        """
+        Cluster the stored vectors into nlist inverted lists (default: sqrt(N))
+
+        Centroids are fitted on a sample, then every row is assigned to its
+        closest centroid. Rows added meanwhile are assigned at the end.
+        """
+        with self._lock:
+            self._refresh()
+            count, vectors = self._count, self._vectors
+        if not count:
+            raise ValueError('Index is empty')
+        nlist = min(nlist or max(1, int(np.sqrt(count))), count)
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(count, size=min(sample_size, count), replace=False))
+        centroids = kmeans(np.asarray(vectors[sample], dtype=np.float32), nlist, iterations)
+
+        assignments = np.empty(count, dtype=np.int64)
+        for start in range(0, count, 65536):
+            chunk = np.asarray(vectors[start:start + 65536], dtype=np.float32)
+            assignments[start:start + len(chunk)] = (chunk @ centroids.T).argmax(axis=1)
+
+        with self._lock, self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                generation = uuid.uuid4().hex
+                tmp_path = self.centroids_path + '.tmp.npy'
+                np.save(tmp_path, centroids.astype(np.float32))
+                os.replace(tmp_path, self.centroids_path)
+                conn.executemany(
+                    'UPDATE cases SET list_id = ? WHERE id = ?',
+                    ((int(a), i + 1) for i, a in enumerate(assignments))
+                )
+                late = conn.execute('SELECT id FROM cases WHERE id > ? ORDER BY id', (count,)).fetchall()
+                if late:
+                    ids = np.array([r['id'] for r in late]) - 1
+                    late_vectors = np.memmap(
+                        self.vectors_path, dtype=VECTOR_DTYPE, mode='r', shape=(int(ids[-1]) + 1, centroids.shape[1])
+                    )[ids].astype(np.float32)
+                    conn.executemany(
+                        'UPDATE cases SET list_id = ? WHERE id = ?',
+                        zip((late_vectors @ centroids.T).argmax(axis=1).tolist(), (ids + 1).tolist())
+                    )
+                conn.execute("INSERT OR REPLACE INTO index_meta VALUES ('generation', ?)", (generation,))
+                conn.execute("INSERT OR REPLACE INTO index_meta VALUES ('nlist', ?)", (str(nlist),))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        print(f"Similarity index trained: {count} rows in {nlist} lists")
+
+    def search(self, embedding, k=5, label=None):
+        """
+        The k stored cases closest to an embedding (cosine similarity)
+
+        Args:
+            embedding: (dim,) query embedding
+            k: Number of neighbours
+            label: Only return cases confirmed as this class
+
+        Returns:
+            List of case dicts with a 'similarity' score, closest first
+        """
+        query = normalize(embedding)[0]
+        with self._lock:
+            self._refresh()
+            if not self._count:
+                return []
+            if self._centroids is None:
+                candidates = None
+            else:
+                probe = np.argsort(self._centroids @ query)[::-1][:self.nprobe]
+                parts = [self._lists[l] for l in probe.tolist() + [UNASSIGNED] if l in self._lists]
+                candidates = np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+            vectors = self._vectors
+
+        if candidates is None:
+            # Exhaustive scan in chunks, so float32 copies stay small
+            scores = np.concatenate([
+                np.asarray(vectors[start:start + 8192], dtype=np.float32) @ query
+                for start in range(0, len(vectors), 8192)
+            ])
+            candidates = np.arange(len(scores))
+        else:
+            scores = np.asarray(vectors[candidates], dtype=np.float32) @ query
+
+        # Over-fetch when filtering by label, then keep the first k that match
+        fetch = min(len(scores), k if label is None else k * 10)
+        if not fetch:
+            return []
+        best = np.argpartition(-scores, fetch - 1)[:fetch]
+        best = best[np.argsort(-scores[best])]
+        ids = [int(candidates[i]) + 1 for i in best]
+
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT id, case_id, label, filename, created_at FROM cases WHERE id IN ({','.join('?' * len(ids))})",
+                ids
+            ).fetchall()
+        by_id = {row['id']: row for row in rows}
+        results = []
+        for row_id, i in zip(ids, best):
+            row = dict(by_id[row_id])
+            if label is not None and row['label'] != label:
+                continue
+            del row['id']
+            row['similarity'] = round(float(scores[i]), 4)
+            results.append(row)
+            if len(results) == k:
+                break
+        return results
+
+    def stats(self):
+        with self._lock:
+            self._refresh()
+            return {
+                'cases': self._count,
+                'dim': self._dim,
+                'lists': len(self._centroids) if self._centroids is not None else 0,
+                'nprobe': self.nprobe,
+                'disk_bytes': os.path.getsize(self.vectors_path)
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the similar-case index')
+    sub = parser.add_subparsers(dest='command', required=True)
+    add = sub.add_parser('add', help='Index a folder of confirmed images, one subfolder per class')
+    add.add_argument('index_dir')
+    add.add_argument('image_dir')
+    add.add_argument('--batch-size', type=int, default=32)
+    add.add_argument('--model', help='Local model file (default: from Hugging Face)')
+    train = sub.add_parser('train', help='(Re)build the IVF clusters')
+    train.add_argument('index_dir')
+    train.add_argument('--nlist', type=int)
+    stats = sub.add_parser('stats', help='Show index size')
+    stats.add_argument('index_dir')
+    args = parser.parse_args()
+
+    index = SimilarityIndex(args.index_dir, train_size=sys.maxsize)
+    if args.command == 'train':
+        index.train(nlist=args.nlist)
+    elif args.command == 'add':
+        from run_hf import LeafDiseaseChecker
+        # Same folder layout, image filter and class check as evaluate.py
+        from evaluate import labelled_files
+
+        if args.model:
+            checker = LeafDiseaseChecker(model_path=args.model, idx_path='class_indices.json', use_huggingface=False)
+        else:
+            checker = LeafDiseaseChecker(repo_id=os.environ.get('HF_REPO_ID', 'rishabh914/leaf-disease-detection'))
+        # A folder that isn't a model class would add a label ?label= can never match
+        files = [
+            (str(checker.class_names[i]), os.path.join(args.image_dir, rel))
+            for rel, i in labelled_files(args.image_dir, checker.class_names)
+        ]
+        for start in range(0, len(files), args.batch_size):
+            chunk = files[start:start + args.batch_size]
+            _, embeddings = checker.predict_with_embeddings([checker.preprocess(path) for _, path in chunk])
+            index.add(embeddings, [label for label, _ in chunk], [os.path.basename(path) for _, path in chunk])
+            print(f"Indexed {start + len(chunk)}/{len(files)}")
+    print(index.stats())
+
+
+if __name__ == '__main__':
+    main()
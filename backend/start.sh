@@ -16,4 +16,4 @@ echo "Activating virtual environment and starting the application..."
 . /opt/venv/bin/activate
 
 echo "Starting the application..."
-gunicorn --bind 0.0.0.0:$PORT --timeout 120 --workers 1 app:app
+gunicorn --bind 0.0.0.0:$PORT --timeout 120 --workers 1 --threads 8 app:app
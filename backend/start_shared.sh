@@ -0,0 +1,15 @@
+#!/bin/bash
+# Multi-worker serving: one inference process holds the model, Gunicorn
+# workers decode uploads and send tensors to it over a local Unix socket.
+set -e
+
+export INFERENCE_SOCKET=${INFERENCE_SOCKET:-/tmp/leaf-inference.sock}
+WEB_WORKERS=${WEB_WORKERS:-$(nproc)}
+
+echo "Starting shared inference server on $INFERENCE_SOCKET..."
+python inference_server.py &
+INFERENCE_PID=$!
+trap 'kill $INFERENCE_PID 2>/dev/null' EXIT
+
+echo "Starting Gunicorn with $WEB_WORKERS workers..."
+gunicorn --bind 0.0.0.0:${PORT:-5000} --timeout 300 --workers $WEB_WORKERS --threads 4 app:app
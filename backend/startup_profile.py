@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Report import time per module for the app (or any backend module)
+
+Runs a fresh interpreter with `python -X importtime`, so the numbers match
+what a Gunicorn worker pays at boot. The model is not loaded while profiling.
+
+Usage:
+    python startup_profile.py                 # profile `import app` and time /health
+    python startup_profile.py --module run_hf --top 30
+    python startup_profile.py --json startup_profile.json
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+HEALTH_PROBE = """
+import time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.app.test_client().get('/health')
+print('PROBE', imported - start, time.perf_counter() - imported)
+"""
+
+
+def profile_imports(module='app'):
+    """
+    Import `module` in a fresh interpreter and collect per-module import times
+
+    Returns:
+        (modules, probe) - modules is a list of dicts sorted by cumulative
+        time; probe holds import and first /health timings when module is 'app'
+    """
+    env = dict(os.environ, MODEL_EAGER_LOAD='0')
+    code = HEALTH_PROBE if module == 'app' else f"import {module}"
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{proc.stderr[-2000:]}")
+
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append({
+            'module': name.strip(),
+            # Nesting depth shows which import pulled this one in
+            'depth': (len(name) - len(name.lstrip()) - 1) // 2,
+            'self_ms': int(self_us) / 1000.0,
+            'cumulative_ms': int(cumulative_us) / 1000.0
+        })
+    modules.sort(key=lambda m: -m['cumulative_ms'])
+
+    probe = {}
+    for line in proc.stdout.splitlines():
+        if line.startswith('PROBE'):
+            _, import_s, health_s = line.split()
+            probe = {
+                'import_seconds': round(float(import_s), 3),
+                'first_health_seconds': round(float(health_s), 3)
+            }
+    return modules, probe
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Profile import time per module')
+    parser.add_argument('--module', default='app', help='Module to import (default: app)')
+    parser.add_argument('--top', type=int, default=20, help='Number of modules to list')
+    parser.add_argument('--json', help='Also write the full report to this file')
+    args = parser.parse_args()
+
+    modules, probe = profile_imports(args.module)
+    total_ms = sum(m['self_ms'] for m in modules)
+
+    print(f"Import profile for '{args.module}': {len(modules)} modules, {total_ms:.1f} ms total")
+    if probe:
+        print(f"import app: {probe['import_seconds']}s, first /health: {probe['first_health_seconds']}s")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for m in modules[:args.top]:
+        print(f"{m['cumulative_ms']:14.1f} {m['self_ms']:9.1f}  {'  ' * m['depth']}{m['module']}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'module': args.module, 'total_ms': total_ms, 'probe': probe, 'modules': modules}, f, indent=2)
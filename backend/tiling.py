@@ -0,0 +1,137 @@
+import io
+import math
+
+import numpy as np
+from PIL import Image
+
+from cascade import healthy_mask
+from metrics import span
+from preprocessing import IMAGE_SIZE
+
+TILE_SIZE = IMAGE_SIZE[0]
+AGGREGATIONS = ('mean', 'max')
+
+
+def load_for_tiling(source, max_side=2048):
+    """
+    Decode an image for tiling, no larger than max_side on its long edge
+
+    JPEGs are decoded at a reduced resolution straight away, so a 12 MP photo
+    never exists in memory at full size.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    with span('decode'):
+        with Image.open(source) as img:
+            scale = min(1.0, max_side / max(img.size))
+            if img.format == 'JPEG' and scale < 1.0:
+                img.draft('RGB', (int(img.width * scale), int(img.height * scale)))
+            img = img.convert('RGB')
+    if max(img.size) > max_side:
+        with span('resize'):
+            scale = max_side / max(img.size)
+            img = img.resize((round(img.width * scale), round(img.height * scale)), Image.BILINEAR)
+    return img
+
+
+def needs_tiling(size, tile=TILE_SIZE):
+    """Images under two tiles on their long side lose little when squashed to one"""
+    return max(size) >= 2 * tile
+
+
+def tile_offsets(length, tile=TILE_SIZE, overlap=0.25):
+    """Tile start positions along one axis, evenly spread so the last tile ends at the edge"""
+    if length <= tile:
+        return [0]
+    stride = max(1, int(tile * (1.0 - overlap)))
+    n = math.ceil((length - tile) / stride) + 1
+    return [round(i * (length - tile) / (n - 1)) for i in range(n)]
+
+
+def green_fraction(tile):
+    """Share of leaf-coloured pixels (excess green 2G - R - B), sampled every 4th pixel"""
+    pixels = tile[::4, ::4].astype(np.int16)
+    excess_green = 2 * pixels[..., 1] - pixels[..., 0] - pixels[..., 2]
+    return float((excess_green > 20).mean())
+
+
+def predict_tiles(predict_fn, img, class_names, tile=TILE_SIZE, overlap=0.25, min_green=0.15,
+                  batch_size=16, aggregate='mean'):
+    """
+    Classify a large image from overlapping model-sized tiles
+
+    Tiles are cropped one at a time and sent to the model batch_size at a
+    time, so memory stays at the decoded image plus one batch. Tiles with
+    less than min_green leaf pixels (soil, sky, background) are skipped.
+
+    Args:
+        predict_fn: Batch prediction, e.g. LeafDiseaseChecker.predict_probs
+        img: RGB PIL image, e.g. from load_for_tiling()
+        class_names: Class name per model output
+        overlap: Fraction of a tile shared with its neighbours
+        min_green: Minimum green_fraction() for a tile to be classified
+        aggregate: 'mean' averages tile probabilities weighted by their leaf
+            cover; 'max' takes each class's strongest tile, so a lesion seen
+            in a single tile is not averaged away
+
+    Returns:
+        (probs, tiles) - image-level probabilities (None if every tile was
+        background) and a dict with the tile grid and per-tile heatmaps
+    """
+    if aggregate not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation '{aggregate}', expected one of {', '.join(AGGREGATIONS)}")
+    healthy = healthy_mask(class_names)
+    ys = tile_offsets(img.height, tile, overlap)
+    xs = tile_offsets(img.width, tile, overlap)
+    labels = [[None] * len(xs) for _ in ys]
+    disease = [[None] * len(xs) for _ in ys]
+    total = np.zeros(len(class_names), dtype=np.float64)
+    strongest = np.zeros(len(class_names), dtype=np.float64)
+    weights = 0.0
+    pending = []
+
+    def flush():
+        nonlocal total, strongest, weights
+        if not pending:
+            return
+        probs = np.asarray(predict_fn([array for _, _, _, array in pending]), dtype=np.float64)
+        for (row, col, weight, _), p in zip(pending, probs):
+            top = int(p.argmax())
+            labels[row][col] = str(class_names[top])
+            disease[row][col] = round(float(1.0 - p[healthy].sum()), 4)
+            total += weight * p
+            strongest = np.maximum(strongest, p)
+            weights += weight
+        pending.clear()
+
+    used = 0
+    for row, y in enumerate(ys):
+        for col, x in enumerate(xs):
+            # Crops past the edge of a narrow image are padded with black
+            array = np.asarray(img.crop((x, y, x + tile, y + tile)))
+            green = green_fraction(array)
+            if green < min_green:
+                continue
+            pending.append((row, col, green, array))
+            used += 1
+            if len(pending) >= batch_size:
+                flush()
+    flush()
+
+    tiles = {
+        'grid': [len(ys), len(xs)],
+        'tile_size': tile,
+        'image_size': [img.width, img.height],
+        'used': used,
+        'skipped': len(ys) * len(xs) - used,
+        'aggregate': aggregate,
+        'labels': labels,
+        'disease': disease
+    }
+    if not used:
+        return None, tiles
+    if aggregate == 'max':
+        probs = strongest / strongest.sum()
+    else:
+        probs = total / weights
+    return probs.astype(np.float32), tiles
@@ -0,0 +1,80 @@
+import math
+
+import numpy as np
+from PIL import Image
+
+
+def _crop_resize(array, fraction):
+    """Central crop keeping `fraction` of each side, resized back to the input size"""
+    h, w = array.shape[:2]
+    ch, cw = int(round(h * fraction)), int(round(w * fraction))
+    top, left = (h - ch) // 2, (w - cw) // 2
+    crop = Image.fromarray(np.ascontiguousarray(array[top:top + ch, left:left + cw]))
+    return np.asarray(crop.resize((w, h), Image.BILINEAR))
+
+
+def _rotate(array, degrees):
+    """Small rotation, cropped to the inscribed square so no black corners reach the model"""
+    rotated = np.asarray(Image.fromarray(np.ascontiguousarray(array)).rotate(degrees, Image.BILINEAR))
+    rad = math.radians(abs(degrees))
+    return _crop_resize(rotated, 1.0 / (math.cos(rad) + math.sin(rad)))
+
+
+# Augmented views of a preprocessed (H, W, 3) image, applied at inference time
+VIEWS = {
+    'original': lambda a: a,
+    'flip_h': lambda a: a[:, ::-1],
+    'flip_v': lambda a: a[::-1],
+    'center_crop': lambda a: _crop_resize(a, 0.875),
+    'rotate_10': lambda a: _rotate(a, 10),
+    'rotate_-10': lambda a: _rotate(a, -10)
+}
+DEFAULT_VIEWS = tuple(VIEWS)
+
+
+def parse_views(value):
+    """
+    Views requested by a ?tta= value
+
+    '1', 'true' or 'all' select DEFAULT_VIEWS; otherwise a comma-separated
+    list of VIEWS names. Empty, '0' or 'false' turn TTA off (returns None).
+
+    Raises:
+        ValueError: for unknown view names
+    """
+    value = (value or '').strip().lower()
+    if value in ('', '0', 'false', 'no'):
+        return None
+    if value in ('1', 'true', 'yes', 'all'):
+        return DEFAULT_VIEWS
+    views = tuple(v.strip() for v in value.split(',') if v.strip())
+    unknown = [v for v in views if v not in VIEWS]
+    if unknown or not views:
+        raise ValueError(f"Unknown TTA view(s) {', '.join(unknown)}, expected {', '.join(VIEWS)}")
+    return views
+
+
+def needs_tta(probs, threshold):
+    """Only predictions less confident than threshold pay for augmentation (None = always)"""
+    return threshold is None or max(probs) < threshold
+
+
+def tta_probs(predict_fn, array, views=DEFAULT_VIEWS, base_probs=None):
+    """
+    Average softmax outputs over augmented views, in a single forward pass
+
+    Args:
+        predict_fn: Batch prediction, e.g. LeafDiseaseChecker.predict_probs
+        array: Preprocessed (H, W, 3) image
+        views: Names from VIEWS
+        base_probs: Already computed prediction for the original image; it is
+            reused instead of running the 'original' view again
+
+    Returns:
+        Averaged (num_classes,) probability array
+    """
+    names = [v for v in views if not (v == 'original' and base_probs is not None)]
+    rows = list(predict_fn([VIEWS[v](array) for v in names])) if names else []
+    if base_probs is not None and 'original' in views:
+        rows.append(np.asarray(base_probs, dtype=np.float32))
+    return np.mean(rows, axis=0)
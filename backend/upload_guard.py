@@ -0,0 +1,84 @@
+import io
+import os
+
+from PIL import Image
+
+# Leading bytes of the formats the decode pipeline accepts
+MAGIC_NUMBERS = (
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'),
+    (b'II*\x00', 'tiff'),
+    (b'MM\x00*', 'tiff')
+)
+SNIFF_BYTES = 16
+
+
+class UploadRejected(ValueError):
+    """An upload that must not reach the decoder; reason labels the rejection counter"""
+
+    def __init__(self, reason, message, status=400):
+        super().__init__(message)
+        self.reason = reason
+        self.status = status
+
+
+def sniff_format(header):
+    """Image format from the first SNIFF_BYTES bytes, or None if it isn't a supported image"""
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    for magic, fmt in MAGIC_NUMBERS:
+        if header.startswith(magic):
+            return fmt
+    return None
+
+
+def check_stream(stream, max_bytes):
+    """
+    Reject an uploaded file from its first bytes and size, before reading it into memory
+
+    Raises:
+        UploadRejected: not a supported image, or larger than max_bytes
+    """
+    start = stream.tell()
+    header = stream.read(SNIFF_BYTES)
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell() - start
+    stream.seek(start)
+    if sniff_format(header) is None:
+        raise UploadRejected('not_image', 'File is not a supported image (JPEG, PNG, WebP, GIF, BMP or TIFF)', 415)
+    if size > max_bytes:
+        raise UploadRejected('too_large', f'File is larger than {max_bytes // (1024 * 1024)} MB', 413)
+
+
+def check_image(data, max_pixels):
+    """
+    Validate image bytes from the header alone, before any pixel data is decoded
+
+    Returns:
+        (format, (width, height))
+
+    Raises:
+        UploadRejected: not a supported image, unreadable header or more than max_pixels
+    """
+    fmt = sniff_format(data[:SNIFF_BYTES])
+    if fmt is None:
+        raise UploadRejected('not_image', 'File is not a supported image (JPEG, PNG, WebP, GIF, BMP or TIFF)', 415)
+    try:
+        # Image.open only parses the header; pixels are decoded later by decode_image
+        with Image.open(io.BytesIO(data)) as img:
+            width, height = img.size
+    except Image.DecompressionBombError:
+        width = height = None
+    except Exception:
+        raise UploadRejected('corrupt', 'Could not read the image header', 400)
+    if width is None or width * height > max_pixels:
+        raise UploadRejected('too_many_pixels', f'Image has more than {max_pixels} pixels', 413)
+    return fmt, (width, height)
+
+
+def set_pixel_limit(max_pixels):
+    """Make PIL refuse to decode anything over the limit as well (it raises above 2x)"""
+    Image.MAX_IMAGE_PIXELS = max_pixels
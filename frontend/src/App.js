@@ -80,7 +80,8 @@ function App() {
       setPredictions([]);
   console.log("Sending request to:", `${API_BASE_URL}/predict`);
       
-  const response = await fetch(`${apiBase}/predict`, {
+  // Ask only for the top 5 classes - the backend ranks them, no client-side sort needed
+  const response = await fetch(`${apiBase}/predict?response=top_k&k=5`, {
         method: "POST",
         body: formData,
         mode: "cors",
@@ -105,13 +106,10 @@ function App() {
       if (data.success && data.prediction) {
         // Transform the prediction data for the chart
         const predictionData = data.prediction;
-        const chartData = Object.entries(predictionData.all_predictions)
-          .sort(([,a], [,b]) => b - a) // Sort by confidence descending
-          .slice(0, 5) // Take top 5
-          .map(([name, probability]) => ({
-            name: name.replace(/___/g, ' - ').replace(/_/g, ' '), // Clean up class names
-            probability: probability
-          }));
+        const chartData = predictionData.top_k.map(({ class: name, confidence }) => ({
+          name: name.replace(/___/g, ' - ').replace(/_/g, ' '), // Clean up class names
+          probability: confidence
+        }));
         
         setPredictions(chartData);
   setError("");
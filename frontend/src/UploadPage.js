@@ -25,9 +25,11 @@ function UploadPage() {
 
     try {
       setLoading(true);
-      console.log("Sending request to:", `${API_BASE_URL}/predict`);
+      // Ask only for the top 5 classes - the backend ranks them, no client-side sort needed
+      const predictUrl = `${API_BASE_URL}/predict?response=top_k&k=5`;
+      console.log("Sending request to:", predictUrl);
       
-      const response = await fetch(`${API_BASE_URL}/predict`, {
+      const response = await fetch(predictUrl, {
         method: "POST",
         body: formData,
       });
@@ -47,13 +49,10 @@ function UploadPage() {
         const predictions = data.prediction;
         console.log("Predictions object:", predictions);
         
-        const chartData = Object.entries(predictions.all_predictions)
-          .sort(([,a], [,b]) => b - a) // Sort by confidence descending
-          .slice(0, 5) // Take top 5
-          .map(([name, probability]) => ({
-            name: name.replace(/___/g, ' - ').replace(/_/g, ' '), // Clean up class names
-            probability: probability
-          }));
+        const chartData = predictions.top_k.map(({ class: name, confidence }) => ({
+          name: name.replace(/___/g, ' - ').replace(/_/g, ' '), // Clean up class names
+          probability: confidence
+        }));
         
         console.log("Chart data:", chartData);
         